@@ -69,6 +69,14 @@ class ActionCountPages(InterfaceActionBase):
         '''
         config_widget.save_settings()
 
+    def cli_main(self, argv):
+        '''
+        Count the statistics for a library without the GUI, run with:
+            calibre-debug -r "Count Pages" -- [options] LIBRARY_PATH
+        '''
+        from calibre_plugins.count_pages.cli import main
+        return main(argv[1:], self.load_resources)
+
 
 # For testing, run from command line with this:
 # calibre-debug -e __init__.py
@@ -2,27 +2,32 @@
 # vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
 from __future__ import (unicode_literals, division, absolute_import,
                         print_function)
-from calibre_plugins.count_pages.config import ALL_STATISTICS
 
 __license__   = 'GPL v3'
 __copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
 __docformat__ = 'restructuredtext en'
 
+import time
+# When calibre started loading the plugin, to log how long it added to startup
+_load_start_time = time.time()
+
 from functools import partial
-from PyQt4.Qt import QToolButton, QMenu
+from multiprocessing import cpu_count
+from PyQt4.Qt import QToolButton, QMenu, QTimer
 
-from calibre.ebooks.metadata.book.base import Metadata
-from calibre.gui2 import question_dialog
+from calibre import prints
+from calibre.constants import DEBUG
+from calibre.gui2 import question_dialog, warning_dialog
 from calibre.gui2.actions import InterfaceAction
-from calibre.gui2.dialogs.message_box import ErrorNotification
 from calibre.ptempfile import PersistentTemporaryDirectory, remove_dir
 
 import calibre_plugins.count_pages.config as cfg
 from calibre_plugins.count_pages.common_utils import (set_plugin_icon_resources, get_icon,
                                                     create_menu_action_unique)
-from calibre_plugins.count_pages.dialogs import QueueProgressDialog
 
 PLUGIN_ICONS = ['images/count_pages.png','images/estimate.png','images/goodreads.png']
+# How often in milliseconds to write the statistics of finished books when streaming results
+JOURNAL_WRITE_INTERVAL = 10000
 
 class CountPagesAction(InterfaceAction):
 
@@ -40,12 +45,16 @@ class CountPagesAction(InterfaceAction):
         set_plugin_icon_resources(self.name, icon_resources)
 
         self.rebuild_menus()
-        self.nltk_pickle = self._get_nltk_resource()
+        # The NLTK data is only read when first counting readability statistics
+        self.nltk_pickle = None
+        self.worker_pool = None
 
         # Assign our menu to this action and an icon
         self.qaction.setMenu(self.menu)
         self.qaction.setIcon(get_icon(PLUGIN_ICONS[0]))
         self.qaction.triggered.connect(self.toolbar_triggered)
+        if DEBUG:
+            prints('Count Pages: added %.3f seconds to calibre startup' % (time.time() - _load_start_time))
 
     def rebuild_menus(self):
         m = self.menu
@@ -54,6 +63,10 @@ class CountPagesAction(InterfaceAction):
                                   triggered=partial(self._count_pages_on_selected, 'Estimate'))
         create_menu_action_unique(self, m, '&Download page/word counts', 'images/goodreads.png',
                                   triggered=partial(self._count_pages_on_selected, 'Goodreads'))
+        create_menu_action_unique(self, m, '&Lookup page counts (offline)', 'images/goodreads.png',
+                                  triggered=partial(self._count_pages_on_selected, 'Offline'))
+        create_menu_action_unique(self, m, 'Build &offline page count index...', None,
+                                  shortcut=False, triggered=self._build_isbn_index)
         m.addSeparator()
         create_menu_action_unique(self, m, _('&Customize plugin')+'...', 'config.png',
                                   shortcut=False, triggered=self.show_configuration)
@@ -64,21 +77,34 @@ class CountPagesAction(InterfaceAction):
         mode = c.get(cfg.KEY_BUTTON_DEFAULT, cfg.DEFAULT_STORE_VALUES[cfg.KEY_BUTTON_DEFAULT])
         self._count_pages_on_selected(mode)
 
-    def _get_nltk_resource(self):
-        # Retrieve the english pickle file. Can't do it from within the nltk code
-        # because of our funky situation of executing a plugin from a zip file.
-        # So we retrieve it here and pass it through when executing jobs.
-        ENGLISH_PICKLE_FILE = 'nltk_lite/english.pickle'
-        pickle_data = self.load_resources([ENGLISH_PICKLE_FILE])[ENGLISH_PICKLE_FILE]
-        return pickle_data
+    def _get_nltk_resource(self, statistics_cols_map, readability_options):
+        # Only the readability statistics need the NLTK data, so it is not
+        # read from the plugin zip until a run counting them. The fast
+        # algorithm counts sentences without it.
+        readability = set(statistic for statistic, col_name in statistics_cols_map.iteritems()
+                          if col_name) - set([cfg.STATISTIC_PAGE_COUNT, cfg.STATISTIC_WORD_COUNT])
+        if not readability or readability_options[cfg.KEY_READABILITY_ALGORITHM] == 2:
+            return None
+        if self.nltk_pickle is None:
+            # Retrieve the english pickle file. Can't do it from within the nltk code
+            # because of our funky situation of executing a plugin from a zip file.
+            # So we retrieve it here and pass it through when executing jobs.
+            ENGLISH_PICKLE_FILE = 'nltk_lite/english.pickle'
+            start = time.time()
+            self.nltk_pickle = self.load_resources([ENGLISH_PICKLE_FILE])[ENGLISH_PICKLE_FILE]
+            if DEBUG:
+                prints('Count Pages: loaded NLTK data in %.3f seconds' % (time.time() - start))
+        return self.nltk_pickle
 
     def _count_pages_on_selected(self, mode):
         rows = self.gui.library_view.selectionModel().selectedRows()
         if not rows or len(rows) == 0:
             return
         book_ids = self.gui.library_view.get_selected_ids()
+        if mode == 'Offline':
+            return self._lookup_offline(book_ids)
 
-        statistics_to_run = [k for k in ALL_STATISTICS.keys()]
+        statistics_to_run = [k for k in cfg.ALL_STATISTICS.keys()]
         any_valid, statistics_cols_map = self._get_column_validity(statistics_to_run)
         if not any_valid:
             if not question_dialog(self.gui, 'Configure plugin', '<p>'+
@@ -92,28 +118,78 @@ class CountPagesAction(InterfaceAction):
             use_goodreads = True
         self._do_count_pages(book_ids, statistics_cols_map, use_goodreads)
 
+    def _lookup_offline(self, book_ids):
+        # Look up the page count of each book by its ISBN in the index built
+        # from a bulk dump, which is quick enough to do without a job
+        from calibre_plugins.count_pages.isbn_index import IsbnIndex, get_isbn_index_path, get_book_isbns
+        any_valid, statistics_cols_map = self._get_column_validity([cfg.STATISTIC_PAGE_COUNT])
+        if not any_valid:
+            if not question_dialog(self.gui, 'Configure plugin', '<p>'+
+                'You must specify custom column(s) first. Do you want to configure this now?',
+                show_copy_button=False):
+                return
+            self.show_configuration()
+            return
+        index = IsbnIndex(get_isbn_index_path())
+        if not index.exists():
+            if question_dialog(self.gui, 'Build offline index', '<p>'+
+                'The offline page count index has not been built yet. Do you want to build it now '
+                'from a bulk dump of editions?', show_copy_button=False):
+                self._build_isbn_index()
+            return
+
+        db = self.gui.current_db
+        c = cfg.plugin_prefs[cfg.STORE_NAME]
+        if not c.get(cfg.KEY_OVERWRITE_EXISTING, cfg.DEFAULT_STORE_VALUES[cfg.KEY_OVERWRITE_EXISTING]):
+            col = statistics_cols_map[cfg.STATISTIC_PAGE_COUNT]
+            label = db.field_metadata.custom_field_metadata()[col]['label']
+            book_ids = [book_id for book_id in book_ids if db.data.has_id(book_id) and
+                        not db.get_custom(book_id, label=label, index_is_id=True)]
+        start = time.time()
+        book_pages = index.lookup(get_book_isbns(db, book_ids))
+        if DEBUG:
+            prints('Count Pages: looked up %d books offline in %.3f seconds' % (
+                        len(book_ids), time.time() - start))
+        if not book_pages:
+            self.gui.status_bar.show_message('No page counts found in the offline index', 5000)
+            return
+        book_statistics_map = dict((book_id, {cfg.STATISTIC_PAGE_COUNT: pages})
+                                   for book_id, pages in book_pages.iteritems())
+        msg = 'Found page counts for %d of %d books in the offline index' % (len(book_pages), len(book_ids))
+        if c.get(cfg.KEY_CONFIRM_UPDATE, cfg.DEFAULT_STORE_VALUES[cfg.KEY_CONFIRM_UPDATE]):
+            if not question_dialog(self.gui, 'Lookup complete', '<p>' + msg +
+                    '. Proceed with updating columns in your library?', show_copy_button=False):
+                return
+        self._write_statistics(db, statistics_cols_map, book_statistics_map)
+        self.gui.status_bar.show_message(msg, 5000)
+
+    def _build_isbn_index(self):
+        from calibre.gui2 import choose_files
+        from calibre.gui2.threaded_jobs import ThreadedJob
+        from calibre_plugins.count_pages.isbn_index import build_index, get_isbn_index_path
+        files = choose_files(self.gui, 'count pages isbn dump dialog',
+                             'Choose a bulk dump of editions, such as from Open Library',
+                             filters=[('Editions dump', ['txt', 'gz'])], select_only_single_file=True)
+        if not files:
+            return
+        job = ThreadedJob('count_pages_index', 'Build offline page count index', build_index,
+                          (files[0], get_isbn_index_path()), {},
+                          self.Dispatcher(self._isbn_index_built))
+        self.gui.job_manager.run_threaded_job(job)
+        self.gui.status_bar.show_message('Building the offline page count index', 3000)
+
+    def _isbn_index_built(self, job):
+        if job.failed:
+            return self.gui.job_exception(job, dialog_title='Failed to build the offline index')
+        self.gui.status_bar.show_message('Offline page count index built with %d ISBNs' % job.result, 5000)
+
     def _get_column_validity(self, statistics_to_run):
         '''
         Given a list of algorithms requested to be run, lookup what custom
         columns are configured and return a dict for each possible statistic
         and its associated custom column (blank if not to be run).
         '''
-        db = self.gui.current_db
-        all_cols = db.field_metadata.custom_field_metadata()
-
-        library_config = cfg.get_library_config(db)
-        statistics_cols_map = {}
-        any_valid = False
-        for statistic, statistic_col_key in cfg.ALL_STATISTICS.iteritems():
-            col = library_config.get(statistic_col_key, '')
-            is_requested = statistic in statistics_to_run
-            is_valid = is_requested and len(col) > 0 and col in all_cols
-            if not is_valid or not col:
-                statistics_cols_map[statistic] = ''
-            else:
-                any_valid = True
-                statistics_cols_map[statistic] = col
-        return any_valid, statistics_cols_map
+        return cfg.get_statistics_cols_map(self.gui.current_db, statistics_to_run)
 
     def count_statistics(self, book_ids, statistics_to_run, use_goodreads=False):
         '''
@@ -124,7 +200,8 @@ class CountPagesAction(InterfaceAction):
           book_ids - list of calibre book ids to run the statistics against
 
           statistics_to_run - list of statistic names to be run. Possible values:
-              'PageCount', 'WordCount', 'FleschReading', 'FleschGrade', 'GunningFog'
+              'PageCount', 'WordCount', 'FleschReading', 'FleschGrade', 'GunningFog',
+              'SMOG', 'ColemanLiau', 'ARI', 'DaleChall'
 
           use_goodreads - only applies to PageCount, whether to retrieve from
                           Goodreads rather than using an estimation algorithm.
@@ -146,60 +223,252 @@ class CountPagesAction(InterfaceAction):
 
         self._do_count_pages(book_ids, statistics_cols_map, use_goodreads)
 
-    def _do_count_pages(self, book_ids, statistics_cols_map, use_goodreads):
+    def count_statistics_async(self, book_ids, statistics_to_run, use_goodreads=False,
+                               pages_algorithm=None, overwrite_existing=None,
+                               auto_apply=True, on_book=None, on_complete=None):
+        '''
+        This function is designed to be called from other plugins which need
+        the statistics as they are counted. It returns at once, with a
+        CountStatisticsRequest handle giving the results of each book as
+        they arrive, without asking the user anything.
+
+          book_ids, statistics_to_run, use_goodreads - as for count_statistics.
+                          Statistics without a custom column configured are
+                          not counted, and ValueError is raised if none have.
+                          With no books the request is finished at once.
+
+          pages_algorithm - the index of the page count algorithm to use,
+                            rather than the one configured for the library
+
+          overwrite_existing - whether to count books which already have a
+                               value, rather than the configured option
+
+          auto_apply - whether to store the statistics in the custom columns.
+                       If False they are only given to the callbacks.
+
+          on_book, on_complete - callbacks as described on the request
+        '''
+        from calibre_plugins.count_pages.api import CountStatisticsRequest
+        if not statistics_to_run:
+            raise ValueError('No statistics requested')
+        any_valid, statistics_cols_map = self._get_column_validity(statistics_to_run)
+        if not any_valid:
+            raise ValueError('No custom columns configured for the statistics requested')
+        request = CountStatisticsRequest(book_ids, statistics_to_run, pages_algorithm,
+                                         overwrite_existing, auto_apply)
+        if on_book is not None:
+            request.add_book_callback(on_book)
+        if on_complete is not None:
+            request.add_done_callback(on_complete)
+        if not request.book_ids:
+            request.finish()
+            return request
+        self._do_count_pages(request.book_ids, statistics_cols_map, use_goodreads, request)
+        return request
+
+    def _do_count_pages(self, book_ids, statistics_cols_map, use_goodreads, request=None):
+        from calibre_plugins.count_pages.journal import (ResultsJournal, get_journal_path,
+                                                         get_journal_run)
+        from calibre_plugins.count_pages.queueing import BookQueuer
+        from calibre_plugins.count_pages.fingerprints import (FingerprintStore, get_fingerprints_path,
+                                                             get_statistic_versions)
+        db = self.gui.current_db
+        journal = None
+        if self._is_streaming_results(request):
+            # Skip any books already counted by this same run if it did not
+            # finish, discarding the results of any other run
+            journal = ResultsJournal(get_journal_path(db.library_id),
+                                     get_journal_run(book_ids, statistics_cols_map))
+            book_statistics_map = {}
+            if journal.read_run() == journal.run:
+                book_statistics_map = journal.read_all()
+            else:
+                journal.remove()
+            if book_statistics_map:
+                self._write_statistics(db, statistics_cols_map, book_statistics_map)
+                if request is not None:
+                    for book_id in request.book_ids:
+                        if book_id in book_statistics_map:
+                            request.book_counted(book_id, book_statistics_map[book_id])
+                book_ids = [book_id for book_id in book_ids if book_id not in book_statistics_map]
+                if not book_ids:
+                    journal.remove()
+                    if request is not None:
+                        return request.finish(applied=True)
+                    self.gui.status_bar.show_message('All books were already counted by the previous run', 5000)
+                    return
+                self.gui.status_bar.show_message('Skipping %d books already counted by the previous run' %
+                                                 len(book_statistics_map), 5000)
+
         # Create a temporary directory to copy all the ePubs to while scanning
         tdir = PersistentTemporaryDirectory('_count_pages', prefix='')
 
         # Queue all the books and kick off the job
         c = cfg.plugin_prefs[cfg.STORE_NAME]
-        db = self.gui.current_db
         library_config = cfg.get_library_config(db)
         pages_algorithm = library_config.get(cfg.KEY_PAGES_ALGORITHM,
                                 cfg.DEFAULT_LIBRARY_VALUES[cfg.KEY_PAGES_ALGORITHM])
+        readability_options = cfg.get_readability_options(library_config)
         overwrite_existing = c.get(cfg.KEY_OVERWRITE_EXISTING,
                                    cfg.DEFAULT_STORE_VALUES[cfg.KEY_OVERWRITE_EXISTING])
-        QueueProgressDialog(self.gui, book_ids, tdir, statistics_cols_map,
-                            pages_algorithm, use_goodreads,
-                            overwrite_existing, self._queue_job, db)
-
-    def _queue_job(self, tdir, books_to_scan, statistics_cols_map,
-                   pages_algorithm, use_goodreads):
-        if not books_to_scan:
-            if tdir:
-                # All failed so cleanup our temp directory
-                remove_dir(tdir)
-            return
-
-        func = 'arbitrary_n'
-        cpus = self.gui.job_manager.server.pool_size
-        args = ['calibre_plugins.count_pages.jobs', 'do_count_statistics',
-                (books_to_scan, pages_algorithm, use_goodreads,
-                 self.nltk_pickle, cpus)]
+        if request is not None:
+            if request.pages_algorithm is not None:
+                pages_algorithm = request.pages_algorithm
+            if request.overwrite_existing is not None:
+                overwrite_existing = request.overwrite_existing
+        book_handoff = c.get(cfg.KEY_BOOK_HANDOFF, cfg.DEFAULT_STORE_VALUES[cfg.KEY_BOOK_HANDOFF])
+        force_recount = c.get(cfg.KEY_FORCE_RECOUNT, cfg.DEFAULT_STORE_VALUES[cfg.KEY_FORCE_RECOUNT])
+        fingerprint_store = FingerprintStore(get_fingerprints_path(db.library_id))
+        versions = get_statistic_versions(pages_algorithm, readability_options)
+        queuer = BookQueuer(db, book_ids, tdir, statistics_cols_map, use_goodreads,
+                            overwrite_existing, book_handoff, fingerprint_store, versions,
+                            force_recount,
+                            self.Dispatcher(partial(self._queueing_finished, request)))
+        self._queue_job(tdir, queuer, statistics_cols_map, pages_algorithm,
+                        readability_options, use_goodreads, journal, request)
+
+    def _queue_job(self, tdir, queuer, statistics_cols_map, pages_algorithm,
+                   readability_options, use_goodreads, journal, request=None):
+        # The job starts counting books as soon as the queuer has them ready
+        from calibre.gui2.threaded_jobs import ThreadedJob
+        from calibre_plugins.count_pages.jobs import do_count_statistics
+        c = cfg.plugin_prefs[cfg.STORE_NAME]
+        time_limit = 60 * c.get(cfg.KEY_BOOK_TIME_LIMIT, cfg.DEFAULT_STORE_VALUES[cfg.KEY_BOOK_TIME_LIMIT])
+        memory_limit = c.get(cfg.KEY_BOOK_MEMORY_LIMIT, cfg.DEFAULT_STORE_VALUES[cfg.KEY_BOOK_MEMORY_LIMIT])
+        nltk_pickle = self._get_nltk_resource(statistics_cols_map, readability_options)
+        args = (self._get_executor(nltk_pickle), queuer.books, pages_algorithm, readability_options,
+                use_goodreads, nltk_pickle)
+        fallbacks = dict()
+        kwargs = { 'time_limit': time_limit, 'memory_limit': memory_limit, 'temp_dir': tdir,
+                   'book_count': len(queuer.book_ids), 'fallbacks': fallbacks,
+                   'goodreads_cache': cfg.get_goodreads_cache(use_goodreads) }
+        if journal is not None:
+            # Anything already in the journal has been written by _do_count_pages
+            kwargs['journal'] = journal
+        if request is not None:
+            from calibre_plugins.count_pages.api import ResultsRelay
+            # Give the caller the statistics of each book as it is counted
+            kwargs['journal'] = ResultsRelay(journal, self.Dispatcher(request.book_counted))
         desc = 'Count Page/Word Statistics'
-        job = self.gui.job_manager.run_job(
-                self.Dispatcher(self._get_statistics_completed), func, args=args,
-                    description=desc)
+        job = ThreadedJob('count_pages', desc, do_count_statistics, args, kwargs,
+                          self.Dispatcher(self._get_statistics_completed))
         job.tdir = tdir
         job.statistics_cols_map = statistics_cols_map
         job.use_goodreads = use_goodreads
-        self.gui.status_bar.show_message('Counting statistics in %d books'%len(books_to_scan))
+        job.journal = journal
+        job.queuer = queuer
+        job.fallbacks = fallbacks
+        job.db = self.gui.current_db
+        job.request = request
+        if request is not None:
+            request.job = job
+            if request.cancelled():
+                job.abort.set()
+        if journal is not None:
+            job.journal_timer = QTimer(self.gui)
+            job.journal_timer.timeout.connect(partial(self._write_journaled_statistics, job))
+            job.journal_timer.start(JOURNAL_WRITE_INTERVAL)
+        self.gui.job_manager.run_threaded_job(job)
+        queuer.start(job.abort)
+        self.gui.status_bar.show_message('Counting statistics in %d books'%len(queuer.book_ids))
+
+    def _queueing_finished(self, request, queuer):
+        if request is not None:
+            request.skipped.update(queuer.bad)
+            return
+        if not queuer.bad:
+            return
+        res = []
+        for book_id, error in queuer.bad.iteritems():
+            title = queuer.titles.get(book_id, 'Book ID %d' % book_id)
+            res.append('%s (%s)'%(title, error))
+        msg = '%s' % '\n'.join(res)
+        summary_msg = 'Could not analyse %d of %d books, for reasons shown in details below.'
+        warning_dialog(self.gui, 'Page/word/statistics warnings',
+            summary_msg % (len(res), len(queuer.book_ids)), msg).exec_()
+
+    def _get_executor(self, nltk_pickle):
+        # Child jobs run either in a new worker process for each book, or in
+        # the warm worker processes kept running between runs by our pool
+        from calibre_plugins.count_pages.pool import ServerExecutor, WorkerPool
+        c = cfg.plugin_prefs[cfg.STORE_NAME]
+        # Leave a core for calibre itself, rather than adding a full size pool
+        # of workers on top of calibre's own
+        cpus = max(1, min(self.gui.job_manager.server.pool_size, cpu_count() - 1))
+        if not c.get(cfg.KEY_KEEP_WORKERS, cfg.DEFAULT_STORE_VALUES[cfg.KEY_KEEP_WORKERS]):
+            return ServerExecutor(cpus)
+        idle_timeout = 60 * c.get(cfg.KEY_WORKER_IDLE_MINUTES,
+                                  cfg.DEFAULT_STORE_VALUES[cfg.KEY_WORKER_IDLE_MINUTES])
+        if self.worker_pool is None:
+            self.worker_pool = WorkerPool(cpus, idle_timeout, nltk_pickle)
+        self.worker_pool.idle_timeout = idle_timeout
+        if nltk_pickle is not None:
+            # Workers started from now on load the NLTK data up front
+            self.worker_pool.nltk_pickle = nltk_pickle
+        return self.worker_pool.executor()
+
+    def shutting_down(self):
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+
+    def _is_streaming_results(self, request=None):
+        if request is not None and not request.auto_apply:
+            # The statistics are only given to the caller
+            return False
+        c = cfg.plugin_prefs[cfg.STORE_NAME]
+        return c.get(cfg.KEY_STREAM_RESULTS, cfg.DEFAULT_STORE_VALUES[cfg.KEY_STREAM_RESULTS])
+
+    def _write_journaled_statistics(self, job):
+        # Results for a library no longer open are left in the journal to be
+        # written if the same books are next counted in that library
+        if job.db is not self.gui.current_db:
+            return False
+        book_statistics_map = job.journal.read_new()
+        if book_statistics_map:
+            self._write_statistics(job.db, job.statistics_cols_map, book_statistics_map)
+            job.queuer.fingerprint_store.put(self._get_fingerprints(job, book_statistics_map))
+        return True
+
+    def _get_fingerprints(self, job, book_statistics_map):
+        from calibre_plugins.count_pages.fingerprints import get_counted_fingerprints
+        return get_counted_fingerprints(job.queuer.fingerprints, job.fallbacks, book_statistics_map)
 
     def _get_statistics_completed(self, job):
         if job.tdir:
             remove_dir(job.tdir)
+        if job.journal is not None:
+            job.journal_timer.stop()
+            written = self._write_journaled_statistics(job)
+            if written and not job.failed and not job.abort.is_set():
+                job.journal.remove()
+        if job.request is not None:
+            return self._request_completed(job)
         if job.failed:
             return self.gui.job_exception(job, dialog_title='Failed to count statistics')
         self.gui.status_bar.show_message('Counting statistics completed', 3000)
         book_statistics_map = job.result
+        if job.queuer.queued == 0:
+            # Nothing to count, for the reasons already shown when queueing
+            return
 
         if len(book_statistics_map) == 0:
             # Must have been some sort of error in processing this book
             msg = 'Failed to generate any statistics. <b>View Log</b> for details'
+            from calibre.gui2.dialogs.message_box import ErrorNotification
             p = ErrorNotification(job.details, 'Count log', 'Count Pages failed', msg,
                     show_copy_button=False, parent=self.gui)
             p.show()
+        elif job.journal is not None:
+            self.gui.status_bar.show_message('Count Pages stored statistics for %d books' %
+                                             len(book_statistics_map), 5000)
+        elif not cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_CONFIRM_UPDATE,
+                                    cfg.DEFAULT_STORE_VALUES[cfg.KEY_CONFIRM_UPDATE]):
+            self._update_database_columns((job.statistics_cols_map, book_statistics_map,
+                                           job.queuer.fingerprint_store,
+                                           self._get_fingerprints(job, book_statistics_map)))
         else:
-            payload = (job.statistics_cols_map, book_statistics_map)
+            payload = (job.statistics_cols_map, book_statistics_map, job.queuer.fingerprint_store,
+                       self._get_fingerprints(job, book_statistics_map))
             all_ids = set(book_statistics_map.keys())
             msg = '<p>Count Pages plugin found <b>%d statistics(s)</b>. ' % len(all_ids) + \
                   'Proceed with updating columns in your library?'
@@ -208,27 +477,37 @@ class CountPagesAction(InterfaceAction):
                     'Count log', 'Count complete', msg,
                     show_copy_button=False)
 
+    def _request_completed(self, job):
+        # Requests from other plugins are applied without asking the user
+        request = job.request
+        if job.failed:
+            return request.finish(error=getattr(job, 'exception', None) or
+                                  Exception('Failed to count statistics'))
+        book_statistics_map = job.result
+        # Statistics for a library no longer open are not stored
+        applied = request.auto_apply and job.db is self.gui.current_db
+        if applied and job.journal is None and book_statistics_map:
+            self._write_statistics(job.db, job.statistics_cols_map, book_statistics_map)
+            job.queuer.fingerprint_store.put(self._get_fingerprints(job, book_statistics_map))
+        request.finish(applied=applied)
+
     def _update_database_columns(self, payload):
-        (statistics_cols_map, book_statistics_map) = payload
+        from calibre_plugins.count_pages.dialogs import WriteProgressDialog
+        (statistics_cols_map, book_statistics_map, fingerprint_store, fingerprints) = payload
+        WriteProgressDialog(self.gui, self.gui.current_db, statistics_cols_map, book_statistics_map)
+        fingerprint_store.put(fingerprints)
 
-        db = self.gui.current_db
-        custom_cols = db.field_metadata.custom_field_metadata()
-
-        # At this point we want to re-use code in edit_metadata to go ahead and
-        # apply the changes. So we will create empty Metadata objects so only
-        # the custom column field gets updated
-        id_map = {}
-        for book_id, statistics in book_statistics_map.iteritems():
-            mi = Metadata(_('Unknown'))
-            for statistic, value in statistics.iteritems():
-                col_name = statistics_cols_map[statistic]
-                col = custom_cols[col_name]
-                col['#value#'] = value
-                mi.set_user_metadata(col_name, col)
-            id_map[book_id] = mi
-
-        edit_metadata_action = self.gui.iactions['Edit Metadata']
-        edit_metadata_action.apply_metadata_changes(id_map)
+    def _write_statistics(self, db, statistics_cols_map, book_statistics_map):
+        '''
+        Write statistics straight into the custom columns, without a progress
+        dialog, as this happens every few seconds while results are streamed
+        from the journal
+        '''
+        from calibre_plugins.count_pages.library import write_statistics
+        book_ids = write_statistics(db, statistics_cols_map, book_statistics_map)
+        db.commit()
+        db.notify('metadata', book_ids)
+        self.gui.library_view.model().refresh_ids(book_ids)
 
     def show_configuration(self):
         self.interface_action_base_plugin.do_user_config(self.gui)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import traceback
+
+
+class CountStatisticsRequest(object):
+    '''
+    The handle returned by CountPagesAction.count_statistics_async, through
+    which other plugins get the statistics of each book as it is counted.
+
+    Callbacks are always called on the GUI thread, so they can use the
+    library and the GUI directly:
+      on_book(request, book_id, statistics) - as each book is counted, with a
+                                              dict of statistic name to value
+      on_complete(request)                  - once the request has finished,
+                                              failed or been cancelled
+    '''
+    def __init__(self, book_ids, statistics_to_run, pages_algorithm=None,
+                 overwrite_existing=None, auto_apply=True):
+        self.book_ids = list(book_ids)
+        self.statistics_to_run = list(statistics_to_run)
+        self.pages_algorithm = pages_algorithm
+        self.overwrite_existing = overwrite_existing
+        self.auto_apply = auto_apply
+        # The statistics for each book counted so far
+        self.results = {}
+        # The reason for each book not counted
+        self.skipped = {}
+        # The exception if the job failed
+        self.error = None
+        self.applied = False
+        self.job = None
+        self._done = False
+        self._cancelled = False
+        self._book_callbacks = []
+        self._done_callbacks = []
+
+    def done(self):
+        return self._done
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        '''
+        Stop counting. Statistics of books already counted are still given to
+        the callbacks, and applied if auto_apply was requested.
+        '''
+        if self._done:
+            return False
+        self._cancelled = True
+        if self.job is not None:
+            self.job.abort.set()
+        return True
+
+    def result(self):
+        '''
+        The dict of statistics for each book counted. This does not wait, so
+        may only be called once done, such as from the on_complete callback.
+        '''
+        if not self._done:
+            raise RuntimeError('Counting statistics has not finished')
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+    def add_book_callback(self, fn):
+        self._book_callbacks.append(fn)
+        for book_id, statistics in self.results.items():
+            self._call(fn, book_id, statistics)
+
+    def add_done_callback(self, fn):
+        if self._done:
+            self._call(fn)
+        else:
+            self._done_callbacks.append(fn)
+
+    def _call(self, fn, *args):
+        # A broken callback of another plugin must not stop us counting
+        try:
+            fn(self, *args)
+        except:
+            traceback.print_exc()
+
+    def book_counted(self, book_id, statistics):
+        self.results[book_id] = statistics
+        for fn in self._book_callbacks:
+            self._call(fn, book_id, statistics)
+
+    def finish(self, error=None, applied=False):
+        self.error, self.applied = error, applied
+        self._done = True
+        self.job = None
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        for fn in callbacks:
+            self._call(fn)
+
+
+class ResultsRelay(object):
+    '''
+    Takes the place of the results journal for the master job, passing the
+    statistics of each book to a callback as well as on to the journal when
+    results are being streamed
+    '''
+    def __init__(self, journal, callback):
+        self.journal, self.callback = journal, callback
+
+    def append(self, book_id, statistics):
+        if self.journal is not None:
+            self.journal.append(book_id, statistics)
+        self.callback(book_id, statistics)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
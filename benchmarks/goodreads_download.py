@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2012, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+Measure downloading page counts against the local stand-in for Goodreads:
+with nothing cached, with every page count cached and fresh, and with every
+one cached but expired so that each is revalidated with a conditional
+request, checking the page counts are the same each time.
+
+Run from the plugin source directory with the plugin installed:
+    calibre-debug -e benchmarks/goodreads_download.py
+'''
+
+import os, sys, time, shutil, tempfile
+
+from calibre_plugins.count_pages.download import GoodreadsDownloader, GoodreadsCache
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from goodreads_server import StubGoodreadsServer
+
+BOOKS = 100
+LATENCY = 0.05
+INTERVAL = 0.01
+
+def download_all(server, cache):
+    downloader = GoodreadsDownloader(interval=INTERVAL, cache=cache, host='127.0.0.1',
+                                     port=server.port, https=False)
+    server.reset()
+    start = time.time()
+    for i in range(BOOKS):
+        downloader.submit(i, unicode(i))
+    results = {}
+    while len(results) < BOOKS:
+        for book_id, page_count, details in downloader.get_finished():
+            results[book_id] = page_count
+        time.sleep(0.005)
+    elapsed = time.time() - start
+    downloader.close()
+    return results, elapsed
+
+def main():
+    tdir = tempfile.mkdtemp()
+    server = StubGoodreadsServer(latency=LATENCY).start()
+    try:
+        path = os.path.join(tdir, 'cache.sqlite')
+        print('Downloading page counts for %d books, %.0fms per page' % (BOOKS, LATENCY * 1000))
+        expected = dict((i, 100 + i) for i in range(BOOKS))
+        for name, ttl in [('No cache', None), ('Cache empty', 3600), ('Cache fresh', 3600),
+                          ('Cache expired', 0)]:
+            cache = GoodreadsCache(path, ttl) if ttl is not None else None
+            results, elapsed = download_all(server, cache)
+            counts = server.counts
+            print('  %-14s %6.2fs, %3d requests (%3d unchanged) on %d connections%s' % (
+                    name, elapsed, counts['requests'], counts['not_modified'],
+                    counts['connections'], '' if results == expected else ', WRONG PAGE COUNTS'))
+    finally:
+        server.stop()
+        shutil.rmtree(tdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
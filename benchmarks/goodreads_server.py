@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2012, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+A local stand-in for the Goodreads book pages, for trying out and timing the
+page count downloads without touching Goodreads itself. The book with
+goodreads id N has 100 + N pages, the page taking latency seconds to send.
+Pages are about the size of real ones, with the page count in the book
+details near the top followed by the reviews, and are gzipped if the client
+accepts it. Pages have an ETag, so conditional requests are answered with a
+304.
+
+Run on its own to serve until interrupted:
+    python benchmarks/goodreads_server.py [PORT]
+'''
+
+import sys, time, gzip, random, threading
+from StringIO import StringIO
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+# Reviews of made up words, so that the page compresses about as well as a real one
+WORDS = ['%s%s' % (a, b) for a in ('ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki')
+         for b in ('la', 'mer', 'nos', 'pi', 'ret', 'sun', 'tov', 'wyn')]
+RANDOM = random.Random(0)
+REVIEWS = ''.join('<div class="review"><a href="/user/show/%d">Reader</a> rated it '
+                  '<span class="staticStars">really liked it</span><span>%s</span></div>\n' % (
+                    i, ' '.join(RANDOM.choice(WORDS) for j in range(40))) for i in range(1000))
+BOOK_PAGE = '''<html><head><title>Book %(id)s</title></head><body>
+<div id="details"><div class="row"><span itemprop="numberOfPages">%(pages)d pages</span></div></div>
+''' + REVIEWS.replace('%', '%%') + '</body></html>'
+
+
+class GoodreadsHandler(BaseHTTPRequestHandler):
+
+    # Keep connections open between requests, as Goodreads does
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def do_GET(self):
+        self.server.count('requests')
+        prefix = '/book/show/'
+        goodreads_id = self.path[len(prefix):]
+        if not self.path.startswith(prefix) or not goodreads_id.isdigit():
+            return self.send_body(404, '<html><head><title>404 - Not found</title></head></html>')
+        etag = '"%s-1"' % goodreads_id
+        time.sleep(self.server.latency)
+        if self.headers.getheader('if-none-match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(200, BOOK_PAGE % dict(id=goodreads_id, pages=100 + int(goodreads_id)), etag)
+
+    def send_body(self, status, body, etag=None):
+        body = body.encode('utf-8')
+        gzipped = 'gzip' in (self.headers.getheader('accept-encoding') or '')
+        if gzipped:
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubGoodreadsServer(ThreadingMixIn, HTTPServer):
+    '''
+    Serves the stand-in book pages on a thread of its own, counting the
+    connections made, the requests and those answered with a 304
+    '''
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.05):
+        HTTPServer.__init__(self, ('127.0.0.1', port), GoodreadsHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counts = dict(connections=0, requests=0, not_modified=0)
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever, name='StubGoodreadsServer')
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    server = StubGoodreadsServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print('Serving stand-in Goodreads pages on http://127.0.0.1:%d/book/show/<id>' % server.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
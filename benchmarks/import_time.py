@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2012, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+Measure what each kind of child job costs a newly started worker process
+before it can begin counting: the time taken by importing and loading data
+on the first book, found by counting a second book straight after, and the
+number of modules imported. Each kind of job is run in a process of its own.
+
+Run from the plugin source directory with the plugin installed:
+    calibre-debug -e benchmarks/import_time.py
+'''
+
+import os, sys, time, shutil, zipfile, tempfile, subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The statistics and readability algorithm for each kind of job
+JOB_TYPES = [
+    ('CBZ page count',          'cbz',  ['PageCount'],   0),
+    ('EPUB page count',         'epub', ['PageCount'],   0),
+    ('EPUB word count',         'epub', ['WordCount'],   0),
+    ('Readability, fast',       'epub', ['FleschGrade'], 2),
+    ('Readability, full text',  'epub', ['FleschGrade'], 0),
+]
+
+def make_cbz(path):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for i in range(20):
+            zf.writestr('page%02d.png' % i, b'')
+
+def run_job_type(index, tdir):
+    name, fmt, statistics, algorithm = JOB_TYPES[index]
+    sys.path.insert(0, BENCHMARK_DIR)
+    from worker_overhead import make_small_epub
+    paths = [os.path.join(tdir, 'book%d.%s' % (i, fmt)) for i in range(2)]
+    for path in paths:
+        (make_cbz if fmt == 'cbz' else make_small_epub)(path)
+    nltk_pickle = None
+    if 'FleschGrade' in statistics and algorithm != 2:
+        with open(os.path.join(os.path.dirname(BENCHMARK_DIR), 'nltk_lite', 'english.pickle'), 'rb') as f:
+            nltk_pickle = f.read()
+    readability_options = {'algorithmReadability': algorithm}
+
+    modules = len(sys.modules)
+    times = []
+    for path in paths:
+        start = time.time()
+        from calibre_plugins.count_pages.jobs import do_statistics_for_book
+        do_statistics_for_book(path, 0, readability_options, None, False, statistics, nltk_pickle)
+        times.append(time.time() - start)
+    print('  %-23s %.3fs before counting, %d modules imported' % (
+                name, times[0] - times[1], len(sys.modules) - modules))
+
+def main():
+    if len(sys.argv) > 1:
+        return run_job_type(int(sys.argv[1]), sys.argv[2])
+    tdir = tempfile.mkdtemp()
+    try:
+        print('Worker start up cost of each kind of job')
+        for i in range(len(JOB_TYPES)):
+            # Discard the output of counting the books themselves
+            output = subprocess.check_output(['calibre-debug', '-e', os.path.abspath(__file__),
+                                              str(i), tdir])
+            print(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(tdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2012, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+Measure how many Goodreads book pages per second the page count can be
+found in: by parsing the whole page, by scanning the whole page, and by
+scanning the page a chunk at a time as it is read, stopping once found.
+Pages are made up to about the size of real ones, with the page count in
+the microdata of the book details part way down, and optionally also in
+JSON-LD in the head of the page as newer Goodreads pages have it.
+
+Run from the plugin source directory with the plugin installed:
+    calibre-debug -e benchmarks/page_count_parsing.py
+'''
+
+import time
+
+from calibre_plugins.count_pages.download import (parse_page_count, parse_page_count_html,
+                                                 PageCountScanner, READ_CHUNK_SIZE)
+
+PAGES = 200
+PAGE_COUNT = 412
+
+JSON_LD = ('<script type="application/ld+json">{"@context":"https://schema.org","@type":"Book",'
+           '"name":"Benchmark","bookFormat":"Paperback","numberOfPages":%d,"inLanguage":"English"}'
+           '</script>' % PAGE_COUNT)
+FILLER = ('<div class="review"><a href="/user/show/1">Reader</a> rated it '
+          '<span class="staticStars">really liked it</span><span>%s</span></div>\n')
+DETAILS = ('<div id="details"><div class="row"><span itemprop="bookFormat">Paperback</span>, '
+           '<span itemprop="numberOfPages">%d pages</span></div></div>\n' % PAGE_COUNT)
+
+def make_page(json_ld):
+    head = '<html><head><title>Benchmark</title>%s</head><body>\n' % (JSON_LD if json_ld else '')
+    filler = ''.join(FILLER % ('Lorem ipsum dolor sit amet ' * 8) for i in range(300))
+    return (head + filler[:len(filler) // 3] + DETAILS + filler + '</body></html>').encode('utf-8')
+
+def scan_chunks(raw):
+    scanner = PageCountScanner()
+    for i in range(0, len(raw), READ_CHUNK_SIZE):
+        if scanner.feed(raw[i:i + READ_CHUNK_SIZE]):
+            return scanner.page_count, i + READ_CHUNK_SIZE
+    return scanner.page_count, len(raw)
+
+def time_method(fn, raw):
+    start = time.time()
+    for i in range(PAGES):
+        result = fn(raw)
+    return PAGES / (time.time() - start), result
+
+def main():
+    def log(msg):
+        pass
+    for name, json_ld in [('Microdata only', False), ('With JSON-LD', True)]:
+        raw = make_page(json_ld)
+        print('%s, %d KB page:' % (name, len(raw) // 1024))
+        rate, result = time_method(lambda r: parse_page_count_html(r, 'benchmark', log), raw)
+        print('  Full parse       %8.0f pages/sec, %d pages' % (rate, result))
+        rate, result = time_method(lambda r: parse_page_count(r, 'benchmark', log), raw)
+        print('  Scan whole page  %8.0f pages/sec, %d pages' % (rate, result))
+        rate, (result, read) = time_method(scan_chunks, raw)
+        print('  Scan as read     %8.0f pages/sec, %d pages, stopping after %d KB' % (
+                rate, result, read // 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2012, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+Compare the speed and accuracy of counting sentences with Punkt against the
+fast readability algorithm, using the reference corpus in this directory
+which has one sentence per line and a blank line between paragraphs.
+
+Run from the plugin source directory with the plugin installed:
+    calibre-debug -e benchmarks/sentence_counting.py
+'''
+
+import os, time, codecs
+
+from calibre_plugins.count_pages.nltk_lite.textanalyzer import TextAnalyzer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPEAT_WORDS = 200000
+
+def read_reference_corpus():
+    with codecs.open(os.path.join(BENCHMARK_DIR, 'reference_sentences.txt'), 'r', 'utf-8') as f:
+        paragraphs = f.read().strip().split('\n\n')
+    return [p.strip().split('\n') for p in paragraphs]
+
+def time_it(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+def main():
+    pickle_path = os.path.join(os.path.dirname(BENCHMARK_DIR), 'nltk_lite', 'english.pickle')
+    t = TextAnalyzer(open(pickle_path, 'rb').read())
+    paragraphs = read_reference_corpus()
+
+    # Accuracy, measured per paragraph so errors cannot cancel each other out
+    expected = punkt_errors = fast_errors = 0
+    for sentences in paragraphs:
+        text = ' '.join(sentences)
+        expected += len(sentences)
+        punkt_errors += abs(len(t.getSentences(text)) - len(sentences))
+        fast_errors += abs(t.getWordsAndSentencesFast(text)[1] - len(sentences))
+    print('Reference corpus: %d paragraphs, %d sentences' % (len(paragraphs), expected))
+    print('  Punkt miscounted sentences: %d (%.1f%%)' % (punkt_errors, 100 * punkt_errors / expected))
+    print('  Fast  miscounted sentences: %d (%.1f%%)' % (fast_errors, 100 * fast_errors / expected))
+
+    # Speed, on the corpus repeated to make a book sized text
+    corpus = '\n\n'.join(' '.join(sentences) for sentences in paragraphs)
+    repeats = max(1, REPEAT_WORDS // len(corpus.split()))
+    text = '\n\n'.join([corpus] * repeats)
+    print('Timing text of %d words' % len(text.split()))
+    punkt_sentences, sentences = time_it(t.getSentences, text)
+    words_time, words = time_it(t.getWords, text)
+    fast_time, fast = time_it(t.getWordsAndSentencesFast, text)
+    print('  Punkt sentences + words: %.2fs (%d sentences)' % (punkt_sentences + words_time, len(sentences)))
+    print('  Fast sentences + words:  %.2fs (%d sentences)' % (fast_time, fast[1]))
+    punkt_analysis, result = time_it(t.analyzeText, text)
+    fast_analysis, result = time_it(t.analyzeText, text, True)
+    print('  Punkt full analysis:     %.2fs' % punkt_analysis)
+    print('  Fast full analysis:      %.2fs' % fast_analysis)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2012, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+Compare tokenizing the words of a 1M word text with the original findall
+based tokenizer (which returns every run of whitespace and punctuation as a
+token to be filtered out) against the streaming and count-only variants of
+the word tokenizer.
+
+Run from the plugin source directory with the plugin installed:
+    calibre-debug -e benchmarks/word_tokenizing.py
+'''
+
+import os, time, codecs
+
+from calibre_plugins.count_pages.nltk_lite.regexp import RegexpTokenizer, WordTokenizer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+TEXT_WORDS = 1000000
+
+def make_text():
+    with codecs.open(os.path.join(BENCHMARK_DIR, 'reference_sentences.txt'), 'r', 'utf-8') as f:
+        corpus = f.read().strip()
+    repeats = max(1, TEXT_WORDS // len(corpus.split()))
+    return '\n\n'.join([corpus] * repeats)
+
+def findall_words(text):
+    tokenizer = RegexpTokenizer('(?u)\W+|\$[\d\.]+|\S+')
+    words = []
+    for word in tokenizer.tokenize(text):
+        if word not in ['.', ',', '!', '?', ' ']:
+            words.append(word)
+    return len(words)
+
+def streaming_words(text):
+    count = 0
+    for word in WordTokenizer().iter_tokenize(text):
+        count += 1
+    return count
+
+def count_only_words(text):
+    return WordTokenizer().count_tokens(text)
+
+def main():
+    text = make_text()
+    print('Tokenizing text of %d words' % len(text.split()))
+    for name, func in [('findall + filter', findall_words),
+                       ('streaming (iter_tokenize)', streaming_words),
+                       ('count only (count_tokens)', count_only_words)]:
+        start = time.time()
+        count = func(text)
+        print('  %-26s %.2fs  %d tokens' % (name, time.time() - start, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2012, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+Measure the per-book overhead of running child jobs in a new worker process
+for each book, against the warm worker pool kept running between runs, for
+small books where that overhead dominates the time spent counting.
+
+Run from the plugin source directory with the plugin installed:
+    calibre-debug -e benchmarks/worker_overhead.py
+'''
+
+import os, time, shutil, zipfile, tempfile, codecs
+
+import calibre_plugins.count_pages.config as cfg
+from calibre_plugins.count_pages.jobs import do_statistics_for_book
+from calibre_plugins.count_pages.pool import ServerExecutor, WorkerPool
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BOOKS = 40
+WORKERS = 2
+STATISTICS = [cfg.STATISTIC_PAGE_COUNT, cfg.STATISTIC_WORD_COUNT, cfg.STATISTIC_FLESCH_GRADE]
+
+CONTAINER = '''<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>'''
+
+OPF = '''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>Benchmark</dc:title><dc:identifier id="id">benchmark</dc:identifier><dc:language>en</dc:language>
+  </metadata>
+  <manifest><item id="text" href="text.html" media-type="application/xhtml+xml"/></manifest>
+  <spine><itemref idref="text"/></spine>
+</package>'''
+
+def make_small_epub(path):
+    with codecs.open(os.path.join(BENCHMARK_DIR, 'reference_sentences.txt'), 'r', 'utf-8') as f:
+        paragraphs = f.read().strip().split('\n\n')
+    body = ''.join('<p>%s</p>' % ' '.join(p.split('\n')) for p in paragraphs)
+    html = '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title></head><body>%s</body></html>' % body
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+        zf.writestr('META-INF/container.xml', CONTAINER)
+        zf.writestr('content.opf', OPF)
+        zf.writestr('text.html', html.encode('utf-8'))
+
+def book_copies(source, tdir, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(tdir, '%d.epub' % i)
+        shutil.copyfile(source, path)
+        paths.append(path)
+    return paths
+
+def run_books(executor, paths, nltk_pickle):
+    start = time.time()
+    for i, path in enumerate(paths):
+        executor.submit(i, 'do_statistics_for_book',
+                        (path, 0, None, None, False, STATISTICS, nltk_pickle))
+    finished = 0
+    while finished < len(paths):
+        if executor.get_finished(timeout=1) is not None:
+            finished += 1
+    executor.close()
+    return time.time() - start
+
+def main():
+    pickle_path = os.path.join(os.path.dirname(BENCHMARK_DIR), 'nltk_lite', 'english.pickle')
+    nltk_pickle = open(pickle_path, 'rb').read()
+    tdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tdir, 'source.epub')
+        make_small_epub(source)
+
+        # The time to count a book with no process overhead at all
+        paths = book_copies(source, tdir, 3)
+        do_statistics_for_book(paths[0], 0, None, None, False, STATISTICS, nltk_pickle)
+        start = time.time()
+        for path in paths[1:]:
+            do_statistics_for_book(path, 0, None, None, False, STATISTICS, nltk_pickle)
+        in_process = (time.time() - start) / 2
+
+        print('Counting %d small books with %d workers' % (BOOKS, WORKERS))
+        print('  In process:             %.3fs per book' % in_process)
+        fresh = run_books(ServerExecutor(WORKERS), book_copies(source, tdir, BOOKS), nltk_pickle)
+        pool = WorkerPool(WORKERS, 60, nltk_pickle)
+        cold = run_books(pool.executor(), book_copies(source, tdir, BOOKS), nltk_pickle)
+        warm = run_books(pool.executor(), book_copies(source, tdir, BOOKS), nltk_pickle)
+        pool.shutdown()
+        for name, elapsed in [('New process per book:', fresh),
+                              ('Pool, first run:', cold),
+                              ('Pool, already warm:', warm)]:
+            per_book = elapsed * WORKERS / BOOKS
+            print('  %-23s %.3fs per book, overhead %.3fs' % (name, per_book, per_book - in_process))
+    finally:
+        shutil.rmtree(tdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
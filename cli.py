@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+'''
+Count the statistics for the books of a library without starting calibre,
+such as from a scheduled job on a server. Run with:
+    calibre-debug -r "Count Pages" -- [options] LIBRARY_PATH
+
+Progress is written to stdout as one JSON object per line, and the log of
+the counting to stderr.
+'''
+
+import os, sys, json, time, shutil, tempfile
+from optparse import OptionParser
+from threading import Event, Lock
+from Queue import Queue
+from multiprocessing import cpu_count
+
+from calibre import prints
+
+import calibre_plugins.count_pages.config as cfg
+from calibre_plugins.count_pages.fingerprints import (FingerprintStore, get_fingerprints_path,
+                                                     get_statistic_versions, get_counted_fingerprints)
+from calibre_plugins.count_pages.library import write_statistics, WRITE_CHUNK_SIZE
+
+_emit_lock = Lock()
+
+def emit(event, **fields):
+    # The queueing threads report books they skip while the master is
+    # reporting those counted, so keep each line whole
+    fields['event'] = event
+    with _emit_lock:
+        sys.stdout.write(json.dumps(fields, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+def log(msg):
+    prints(msg, file=sys.stderr)
+
+
+class LibraryWriter(object):
+    '''
+    Takes the place of the results journal for the master job, storing the
+    statistics of the books counted in the library a chunk at a time and
+    reporting the progress of the run
+    '''
+    def __init__(self, db, statistics_cols_map, queuer, fallbacks, book_count):
+        self.db, self.statistics_cols_map = db, statistics_cols_map
+        self.queuer, self.fallbacks = queuer, fallbacks
+        self.book_count = book_count
+        self.pending = {}
+        self.counted = 0
+        self.start = time.time()
+
+    def append(self, book_id, statistics):
+        self.pending[book_id] = statistics
+        self.counted += 1
+        elapsed = time.time() - self.start
+        emit('counted', book_id=book_id, statistics=statistics, counted=self.counted,
+             skipped=len(self.queuer.bad), total=self.book_count, elapsed=round(elapsed, 3),
+             books_per_second=round(self.counted / elapsed, 3) if elapsed else None)
+        if len(self.pending) >= WRITE_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        written = write_statistics(self.db, self.statistics_cols_map, self.pending)
+        self.db.commit()
+        self.queuer.fingerprint_store.put(get_counted_fingerprints(
+                self.queuer.fingerprints, self.fallbacks, self.pending))
+        emit('stored', books=len(written))
+        self.pending = {}
+
+    def close(self):
+        self.flush()
+
+
+def option_parser():
+    parser = OptionParser(usage='calibre-debug -r "Count Pages" -- [options] LIBRARY_PATH',
+        description='Count the statistics for the books in the calibre library at '
+                    'LIBRARY_PATH, storing them in the custom columns configured for '
+                    'the library in the plugin.')
+    parser.add_option('-s', '--search', default='',
+        help='Only count the books matching this calibre search, such as '
+             '"date:>7daysago". All books are counted by default.')
+    parser.add_option('--statistics', default='',
+        help='Comma separated list of the statistics to count, of: %s. '
+             'By default all those with a custom column configured are counted.' %
+             ', '.join(sorted(cfg.ALL_STATISTICS)))
+    parser.add_option('-w', '--workers', type='int', default=max(1, cpu_count() - 1),
+        help='The number of worker processes to count books in. Default: %default')
+    parser.add_option('--goodreads', action='store_true', default=False,
+        help='Download the page count from Goodreads for books with a Goodreads id, '
+             'rather than counting it')
+    parser.add_option('--force', action='store_true', default=False,
+        help='Recount books even if not changed since last counted')
+    return parser
+
+def get_nltk_pickle(statistics_cols_map, readability_options, load_resources):
+    readability = set(statistic for statistic, col_name in statistics_cols_map.iteritems()
+                      if col_name) - set([cfg.STATISTIC_PAGE_COUNT, cfg.STATISTIC_WORD_COUNT])
+    # The fast algorithm counts sentences without the NLTK data
+    if not readability or readability_options[cfg.KEY_READABILITY_ALGORITHM] == 2:
+        return None
+    ENGLISH_PICKLE_FILE = 'nltk_lite/english.pickle'
+    return load_resources([ENGLISH_PICKLE_FILE])[ENGLISH_PICKLE_FILE]
+
+def main(args, load_resources):
+    from calibre.library.database2 import LibraryDatabase2
+    from calibre_plugins.count_pages.jobs import do_count_statistics
+    from calibre_plugins.count_pages.pool import WorkerPool
+    from calibre_plugins.count_pages.queueing import BookQueuer
+
+    parser = option_parser()
+    opts, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.print_help()
+        return 1
+    statistics_to_run = [s.strip() for s in opts.statistics.split(',') if s.strip()]
+    unknown = set(statistics_to_run) - set(cfg.ALL_STATISTICS)
+    if unknown:
+        parser.error('Unknown statistics: %s' % ', '.join(sorted(unknown)))
+    if not statistics_to_run:
+        statistics_to_run = list(cfg.ALL_STATISTICS)
+
+    db = LibraryDatabase2(os.path.abspath(args[0]))
+    any_valid, statistics_cols_map = cfg.get_statistics_cols_map(db, statistics_to_run)
+    if not any_valid:
+        log('No custom columns are configured in the plugin for these statistics in this library')
+        return 1
+    if opts.search:
+        book_ids = list(db.search_getting_ids(opts.search, None))
+    else:
+        book_ids = list(db.all_ids())
+    if not book_ids:
+        log('No books match the search')
+        emit('finished', counted=0, skipped=0, total=0, elapsed=0, books_per_second=None)
+        return 0
+
+    c = cfg.plugin_prefs[cfg.STORE_NAME]
+    library_config = cfg.get_library_config(db)
+    pages_algorithm = library_config.get(cfg.KEY_PAGES_ALGORITHM,
+                            cfg.DEFAULT_LIBRARY_VALUES[cfg.KEY_PAGES_ALGORITHM])
+    readability_options = cfg.get_readability_options(library_config)
+    overwrite_existing = c.get(cfg.KEY_OVERWRITE_EXISTING,
+                               cfg.DEFAULT_STORE_VALUES[cfg.KEY_OVERWRITE_EXISTING])
+    book_handoff = c.get(cfg.KEY_BOOK_HANDOFF, cfg.DEFAULT_STORE_VALUES[cfg.KEY_BOOK_HANDOFF])
+    time_limit = 60 * c.get(cfg.KEY_BOOK_TIME_LIMIT, cfg.DEFAULT_STORE_VALUES[cfg.KEY_BOOK_TIME_LIMIT])
+    memory_limit = c.get(cfg.KEY_BOOK_MEMORY_LIMIT, cfg.DEFAULT_STORE_VALUES[cfg.KEY_BOOK_MEMORY_LIMIT])
+    fingerprint_store = FingerprintStore(get_fingerprints_path(db.library_id))
+    versions = get_statistic_versions(pages_algorithm, readability_options)
+    nltk_pickle = get_nltk_pickle(statistics_cols_map, readability_options, load_resources)
+
+    def skipped(queuer):
+        for book_id, reason in queuer.bad.iteritems():
+            emit('skipped', book_id=book_id, title=queuer.titles.get(book_id), reason=reason)
+
+    tdir = tempfile.mkdtemp(prefix='count_pages_')
+    pool = WorkerPool(opts.workers, 60, nltk_pickle)
+    abort = Event()
+    fallbacks = dict()
+    queuer = BookQueuer(db, book_ids, tdir, statistics_cols_map, opts.goodreads,
+                        overwrite_existing, book_handoff, fingerprint_store, versions,
+                        opts.force, skipped)
+    writer = LibraryWriter(db, statistics_cols_map, queuer, fallbacks, len(book_ids))
+    emit('started', total=len(book_ids), workers=opts.workers,
+         statistics=sorted(s for s, col_name in statistics_cols_map.iteritems() if col_name))
+    try:
+        queuer.start(abort)
+        do_count_statistics(pool.executor(), queuer.books, pages_algorithm, readability_options,
+                            opts.goodreads, nltk_pickle, time_limit=time_limit,
+                            memory_limit=memory_limit, journal=writer, temp_dir=tdir,
+                            book_count=len(book_ids), fallbacks=fallbacks,
+                            goodreads_cache=cfg.get_goodreads_cache(opts.goodreads), log=log,
+                            abort=abort, notifications=Queue())
+    finally:
+        abort.set()
+        pool.shutdown()
+        shutil.rmtree(tdir, ignore_errors=True)
+    elapsed = time.time() - writer.start
+    emit('finished', counted=writer.counted, skipped=len(queuer.bad), total=len(book_ids),
+         elapsed=round(elapsed, 3),
+         books_per_second=round(writer.counted / elapsed, 3) if elapsed else None)
+    return 0
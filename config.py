@@ -9,13 +9,20 @@ __docformat__ = 'restructuredtext en'
 
 import copy
 from PyQt4.Qt import (QWidget, QGridLayout, QLabel, QPushButton, QUrl,
-                      QGroupBox, QComboBox, QVBoxLayout, QCheckBox)
+                      QGroupBox, QComboBox, QVBoxLayout, QCheckBox,
+                      QSpinBox, QDoubleSpinBox)
 
 from calibre.gui2 import open_url
 from calibre.utils.config import JSONConfig
 
 from calibre_plugins.count_pages.common_utils import (get_library_uuid, CustomColumnComboBox,
                                      KeyboardConfigDialog, KeyValueComboBox, PrefsViewerDialog)
+from calibre_plugins.count_pages.constants import (KEY_READABILITY_ALGORITHM,
+                                     KEY_READABILITY_SAMPLE_WORDS, KEY_READABILITY_MAX_INTERVAL,
+                                     STATISTIC_PAGE_COUNT, STATISTIC_WORD_COUNT,
+                                     STATISTIC_FLESCH_READING, STATISTIC_FLESCH_GRADE,
+                                     STATISTIC_GUNNING_FOG, STATISTIC_SMOG, STATISTIC_COLEMAN_LIAU,
+                                     STATISTIC_ARI, STATISTIC_DALE_CHALL)
 
 PREFS_NAMESPACE = 'CountPagesPlugin'
 PREFS_KEY_SETTINGS = 'settings'
@@ -25,42 +32,77 @@ KEY_WORDS_CUSTOM_COLUMN = 'customColumnWords'
 KEY_FLESCH_READING_CUSTOM_COLUMN = 'customColumnFleschReading'
 KEY_FLESCH_GRADE_CUSTOM_COLUMN = 'customColumnFleschGrade'
 KEY_GUNNING_FOG_CUSTOM_COLUMN = 'customColumnGunningFog'
+KEY_SMOG_CUSTOM_COLUMN = 'customColumnSMOG'
+KEY_COLEMAN_LIAU_CUSTOM_COLUMN = 'customColumnColemanLiau'
+KEY_ARI_CUSTOM_COLUMN = 'customColumnARI'
+KEY_DALE_CHALL_CUSTOM_COLUMN = 'customColumnDaleChall'
 
 KEY_BUTTON_DEFAULT = 'buttonDefault'
 KEY_OVERWRITE_EXISTING = 'overwriteExisting'
+KEY_KEEP_WORKERS = 'keepWorkers'
+KEY_WORKER_IDLE_MINUTES = 'workerIdleMinutes'
+KEY_BOOK_TIME_LIMIT = 'bookTimeLimit'
+KEY_BOOK_MEMORY_LIMIT = 'bookMemoryLimit'
+KEY_STREAM_RESULTS = 'streamResults'
+KEY_BOOK_HANDOFF = 'bookHandoff'
+KEY_CONFIRM_UPDATE = 'confirmUpdate'
+KEY_FORCE_RECOUNT = 'forceRecount'
+KEY_GOODREADS_CACHE_DAYS = 'goodreadsCacheDays'
 
 STORE_NAME = 'Options'
+# How long books actually took to count, relative to the estimate for their format
+COST_MODEL_STORE_NAME = 'CostModel'
 KEY_PAGES_ALGORITHM = 'algorithmPages'
 
 PAGE_ALGORITHMS = ['Paragraphs (APNX accurate)', 'E-book Viewer (calibre)', 'Adobe Digital Editions (ADE)']
+READABILITY_ALGORITHMS = ['Full text', 'Sample of text', 'Fast (approximate sentences)']
+BOOK_HANDOFFS = ['Copy to a temporary folder', 'Link where possible, otherwise copy',
+                 'Read directly from the library']
+HANDOFF_COPY, HANDOFF_LINK, HANDOFF_DIRECT = range(3)
 BUTTON_DEFAULTS = {
                    'Estimate':      'Estimate page/word counts',
                    'Goodreads':     'Download page/word counts',
+                   'Offline':       'Lookup page counts (offline)',
                   }
 
-STATISTIC_PAGE_COUNT = 'PageCount'
-STATISTIC_WORD_COUNT = 'WordCount'
-STATISTIC_FLESCH_READING = 'FleschReading'
-STATISTIC_FLESCH_GRADE = 'FleschGrade'
-STATISTIC_GUNNING_FOG = 'GunningFog'
 ALL_STATISTICS = {
                   STATISTIC_PAGE_COUNT: KEY_PAGES_CUSTOM_COLUMN,
                   STATISTIC_WORD_COUNT: KEY_WORDS_CUSTOM_COLUMN,
                   STATISTIC_FLESCH_READING: KEY_FLESCH_READING_CUSTOM_COLUMN,
                   STATISTIC_FLESCH_GRADE: KEY_FLESCH_GRADE_CUSTOM_COLUMN,
-                  STATISTIC_GUNNING_FOG: KEY_GUNNING_FOG_CUSTOM_COLUMN
+                  STATISTIC_GUNNING_FOG: KEY_GUNNING_FOG_CUSTOM_COLUMN,
+                  STATISTIC_SMOG: KEY_SMOG_CUSTOM_COLUMN,
+                  STATISTIC_COLEMAN_LIAU: KEY_COLEMAN_LIAU_CUSTOM_COLUMN,
+                  STATISTIC_ARI: KEY_ARI_CUSTOM_COLUMN,
+                  STATISTIC_DALE_CHALL: KEY_DALE_CHALL_CUSTOM_COLUMN
                  }
 
 DEFAULT_STORE_VALUES = {
                         KEY_BUTTON_DEFAULT: 'Estimate',
-                        KEY_OVERWRITE_EXISTING: True
+                        KEY_OVERWRITE_EXISTING: True,
+                        KEY_KEEP_WORKERS: True,
+                        KEY_WORKER_IDLE_MINUTES: 10,
+                        KEY_BOOK_TIME_LIMIT: 10,
+                        KEY_BOOK_MEMORY_LIMIT: 2048,
+                        KEY_STREAM_RESULTS: False,
+                        KEY_BOOK_HANDOFF: 0,
+                        KEY_CONFIRM_UPDATE: True,
+                        KEY_FORCE_RECOUNT: False,
+                        KEY_GOODREADS_CACHE_DAYS: 30
                        }
 DEFAULT_LIBRARY_VALUES = { KEY_PAGES_ALGORITHM: 0,
+                           KEY_READABILITY_ALGORITHM: 0,
+                           KEY_READABILITY_SAMPLE_WORDS: 20000,
+                           KEY_READABILITY_MAX_INTERVAL: 1.0,
                            KEY_PAGES_CUSTOM_COLUMN: '',
                            KEY_WORDS_CUSTOM_COLUMN: '',
                            KEY_FLESCH_READING_CUSTOM_COLUMN: '',
                            KEY_FLESCH_GRADE_CUSTOM_COLUMN: '',
-                           KEY_GUNNING_FOG_CUSTOM_COLUMN: '' }
+                           KEY_GUNNING_FOG_CUSTOM_COLUMN: '',
+                           KEY_SMOG_CUSTOM_COLUMN: '',
+                           KEY_COLEMAN_LIAU_CUSTOM_COLUMN: '',
+                           KEY_ARI_CUSTOM_COLUMN: '',
+                           KEY_DALE_CHALL_CUSTOM_COLUMN: '' }
 
 
 KEY_SCHEMA_VERSION = 'SchemaVersion'
@@ -72,6 +114,7 @@ plugin_prefs = JSONConfig('plugins/Count Pages')
 
 # Set defaults
 plugin_prefs.defaults[STORE_NAME] = DEFAULT_STORE_VALUES
+plugin_prefs.defaults[COST_MODEL_STORE_NAME] = {}
 
 
 def migrate_library_config_if_required(db, library_config):
@@ -126,6 +169,47 @@ def get_library_config(db):
 def set_library_config(db, library_config):
     db.prefs.set_namespaced(PREFS_NAMESPACE, PREFS_KEY_SETTINGS, library_config)
 
+def get_statistics_cols_map(db, statistics_to_run):
+    '''
+    Given a list of algorithms requested to be run, lookup what custom
+    columns are configured and return a dict for each possible statistic
+    and its associated custom column (blank if not to be run).
+    '''
+    all_cols = db.field_metadata.custom_field_metadata()
+
+    library_config = get_library_config(db)
+    statistics_cols_map = {}
+    any_valid = False
+    for statistic, statistic_col_key in ALL_STATISTICS.iteritems():
+        col = library_config.get(statistic_col_key, '')
+        is_requested = statistic in statistics_to_run
+        is_valid = is_requested and len(col) > 0 and col in all_cols
+        if not is_valid or not col:
+            statistics_cols_map[statistic] = ''
+        else:
+            any_valid = True
+            statistics_cols_map[statistic] = col
+    return any_valid, statistics_cols_map
+
+def get_goodreads_cache(use_goodreads):
+    '''
+    The cache of page counts downloaded from Goodreads, or None if not
+    downloading or configured not to reuse them
+    '''
+    c = plugin_prefs[STORE_NAME]
+    days = c.get(KEY_GOODREADS_CACHE_DAYS, DEFAULT_STORE_VALUES[KEY_GOODREADS_CACHE_DAYS])
+    if not use_goodreads or not days:
+        return None
+    from calibre_plugins.count_pages.download import GoodreadsCache, get_goodreads_cache_path
+    return GoodreadsCache(get_goodreads_cache_path(), days * 24 * 60 * 60)
+
+def get_readability_options(library_config):
+    '''
+    The readability settings are passed through to the jobs as a dict
+    '''
+    keys = [KEY_READABILITY_ALGORITHM, KEY_READABILITY_SAMPLE_WORDS, KEY_READABILITY_MAX_INTERVAL]
+    return dict((k, library_config.get(k, DEFAULT_LIBRARY_VALUES[k])) for k in keys)
+
 
 class AlgorithmComboBox(QComboBox):
 
@@ -203,8 +287,13 @@ class ConfigWidget(QWidget):
         readability_layout = QGridLayout()
         readability_group_box.setLayout(readability_layout)
 
-        readability_label = QLabel('Readability statistics available are <a href="http://en.wikipedia.org/wiki/Flesch–Kincaid_readability_test">Flesch-Kincaid</a> '
-                                   'or <a href="http://en.wikipedia.org/wiki/Gunning_fog_index">Gunning Fog Index</a>.', self)
+        readability_label = QLabel('Readability statistics available are <a href="http://en.wikipedia.org/wiki/Flesch–Kincaid_readability_test">Flesch-Kincaid</a>, '
+                                   '<a href="http://en.wikipedia.org/wiki/Gunning_fog_index">Gunning Fog Index</a>, '
+                                   '<a href="http://en.wikipedia.org/wiki/SMOG">SMOG</a>, '
+                                   '<a href="http://en.wikipedia.org/wiki/Coleman-Liau_index">Coleman-Liau</a>, '
+                                   '<a href="http://en.wikipedia.org/wiki/Automated_Readability_Index">ARI</a> '
+                                   'or <a href="http://en.wikipedia.org/wiki/Dale-Chall_readability_formula">Dale-Chall</a>.', self)
+        readability_label.setWordWrap(True)
         readability_layout.addWidget(readability_label, 0, 0, 1, 3)
         readability_label.linkActivated.connect(self._link_activated)
 
@@ -235,6 +324,80 @@ class ConfigWidget(QWidget):
         readability_layout.addWidget(gunning_fog_column_label, 3, 0, 1, 1)
         readability_layout.addWidget(self.gunning_fog_column_combo, 3, 1, 1, 2)
 
+        smog_column_label = QLabel('S&MOG Index:', self)
+        smog_column_label.setToolTip('Specify the custom column to store a computed SMOG Index score.\n'
+                                     'Leave this blank if you do not want to calculate it')
+        smog_col = library_config.get(KEY_SMOG_CUSTOM_COLUMN, '')
+        self.smog_column_combo = CustomColumnComboBox(self, avail_columns, smog_col)
+        smog_column_label.setBuddy(self.smog_column_combo)
+        readability_layout.addWidget(smog_column_label, 4, 0, 1, 1)
+        readability_layout.addWidget(self.smog_column_combo, 4, 1, 1, 2)
+
+        coleman_liau_column_label = QLabel('C&oleman-Liau Index:', self)
+        coleman_liau_column_label.setToolTip('Specify the custom column to store a computed Coleman-Liau Index score.\n'
+                                     'Leave this blank if you do not want to calculate it')
+        coleman_liau_col = library_config.get(KEY_COLEMAN_LIAU_CUSTOM_COLUMN, '')
+        self.coleman_liau_column_combo = CustomColumnComboBox(self, avail_columns, coleman_liau_col)
+        coleman_liau_column_label.setBuddy(self.coleman_liau_column_combo)
+        readability_layout.addWidget(coleman_liau_column_label, 5, 0, 1, 1)
+        readability_layout.addWidget(self.coleman_liau_column_combo, 5, 1, 1, 2)
+
+        ari_column_label = QLabel('Automated &Readability Index:', self)
+        ari_column_label.setToolTip('Specify the custom column to store a computed Automated Readability Index score.\n'
+                                     'Leave this blank if you do not want to calculate it')
+        ari_col = library_config.get(KEY_ARI_CUSTOM_COLUMN, '')
+        self.ari_column_combo = CustomColumnComboBox(self, avail_columns, ari_col)
+        ari_column_label.setBuddy(self.ari_column_combo)
+        readability_layout.addWidget(ari_column_label, 6, 0, 1, 1)
+        readability_layout.addWidget(self.ari_column_combo, 6, 1, 1, 2)
+
+        dale_chall_column_label = QLabel('&Dale-Chall Score:', self)
+        dale_chall_column_label.setToolTip('Specify the custom column to store a computed Dale-Chall readability score.\n'
+                                     'Leave this blank if you do not want to calculate it')
+        dale_chall_col = library_config.get(KEY_DALE_CHALL_CUSTOM_COLUMN, '')
+        self.dale_chall_column_combo = CustomColumnComboBox(self, avail_columns, dale_chall_col)
+        dale_chall_column_label.setBuddy(self.dale_chall_column_combo)
+        readability_layout.addWidget(dale_chall_column_label, 7, 0, 1, 1)
+        readability_layout.addWidget(self.dale_chall_column_combo, 7, 1, 1, 2)
+
+        readability_algorithm_label = QLabel('A&lgorithm:', self)
+        readability_algorithm_label.setToolTip('Choose whether to analyse all of the text in a book, or to estimate\n'
+                                     'the readability statistics from a sample of paragraphs taken\n'
+                                     'from throughout the book.\n'
+                                     'The fast algorithm analyses all of the text, but counts sentences\n'
+                                     'using just punctuation and a list of common abbreviations. It is\n'
+                                     'much quicker but less accurate, suiting a quick triage of a library.')
+        readability_algorithm = library_config.get(KEY_READABILITY_ALGORITHM, DEFAULT_LIBRARY_VALUES[KEY_READABILITY_ALGORITHM])
+        self.readability_algorithm_combo = AlgorithmComboBox(self, READABILITY_ALGORITHMS, readability_algorithm)
+        readability_algorithm_label.setBuddy(self.readability_algorithm_combo)
+        readability_layout.addWidget(readability_algorithm_label, 8, 0, 1, 1)
+        readability_layout.addWidget(self.readability_algorithm_combo, 8, 1, 1, 2)
+
+        sample_words_label = QLabel('&Sample size (words):', self)
+        sample_words_label.setToolTip('When sampling, the approximate number of words to analyse from each book')
+        self.sample_words_spin = QSpinBox(self)
+        self.sample_words_spin.setRange(1000, 1000000)
+        self.sample_words_spin.setSingleStep(1000)
+        self.sample_words_spin.setValue(library_config.get(KEY_READABILITY_SAMPLE_WORDS,
+                                        DEFAULT_LIBRARY_VALUES[KEY_READABILITY_SAMPLE_WORDS]))
+        sample_words_label.setBuddy(self.sample_words_spin)
+        readability_layout.addWidget(sample_words_label, 9, 0, 1, 1)
+        readability_layout.addWidget(self.sample_words_spin, 9, 1, 1, 2)
+
+        max_interval_label = QLabel('Ma&ximum uncertainty:', self)
+        max_interval_label.setToolTip('When sampling, the whole book is analysed instead if the 95% confidence interval\n'
+                                     'for the Flesch-Kincaid Grade computed from the sample is wider than this')
+        self.max_interval_spin = QDoubleSpinBox(self)
+        self.max_interval_spin.setRange(0.1, 20.0)
+        self.max_interval_spin.setSingleStep(0.1)
+        self.max_interval_spin.setDecimals(1)
+        self.max_interval_spin.setSuffix(' grades')
+        self.max_interval_spin.setValue(library_config.get(KEY_READABILITY_MAX_INTERVAL,
+                                        DEFAULT_LIBRARY_VALUES[KEY_READABILITY_MAX_INTERVAL]))
+        max_interval_label.setBuddy(self.max_interval_spin)
+        readability_layout.addWidget(max_interval_label, 10, 0, 1, 1)
+        readability_layout.addWidget(self.max_interval_spin, 10, 1, 1, 2)
+
         # --- Other options ---
         layout.addSpacing(5)
         other_group_box = QGroupBox('Other options:', self)
@@ -259,6 +422,98 @@ class ConfigWidget(QWidget):
         self.overwrite_checkbox.setChecked(overwrite_existing)
         other_group_box_layout.addWidget(self.overwrite_checkbox, 1, 0, 1, 3)
 
+        self.keep_workers_checkbox = QCheckBox('Keep &worker processes running between counts', self)
+        self.keep_workers_checkbox.setToolTip('Reuse the same worker processes for every book, rather than starting\n'
+                                              'a new process for each one. Saves several seconds per book as\n'
+                                              'calibre and the NLTK data are only loaded once, at the cost of\n'
+                                              'the memory used by the workers while they are kept running.')
+        self.keep_workers_checkbox.setChecked(c.get(KEY_KEEP_WORKERS, DEFAULT_STORE_VALUES[KEY_KEEP_WORKERS]))
+        other_group_box_layout.addWidget(self.keep_workers_checkbox, 2, 0, 1, 3)
+
+        idle_minutes_label = QLabel('S&top idle workers after:', self)
+        idle_minutes_label.setToolTip('Worker processes with no books to count for this long are stopped')
+        self.idle_minutes_spin = QSpinBox(self)
+        self.idle_minutes_spin.setRange(1, 240)
+        self.idle_minutes_spin.setSuffix(' minutes')
+        self.idle_minutes_spin.setValue(c.get(KEY_WORKER_IDLE_MINUTES, DEFAULT_STORE_VALUES[KEY_WORKER_IDLE_MINUTES]))
+        idle_minutes_label.setBuddy(self.idle_minutes_spin)
+        other_group_box_layout.addWidget(idle_minutes_label, 3, 0, 1, 1)
+        other_group_box_layout.addWidget(self.idle_minutes_spin, 3, 1, 1, 2)
+        self.keep_workers_checkbox.toggled.connect(self.idle_minutes_spin.setEnabled)
+        self.idle_minutes_spin.setEnabled(self.keep_workers_checkbox.isChecked())
+
+        time_limit_label = QLabel('T&ime limit per book:', self)
+        time_limit_label.setToolTip('If counting a book takes longer than this it is stopped, and retried using\n'
+                                    'the ADE page count and fast readability, and then without\n'
+                                    'readability statistics. The log shows which books needed this.')
+        self.time_limit_spin = QSpinBox(self)
+        self.time_limit_spin.setRange(0, 240)
+        self.time_limit_spin.setSuffix(' minutes')
+        self.time_limit_spin.setSpecialValueText('No limit')
+        self.time_limit_spin.setValue(c.get(KEY_BOOK_TIME_LIMIT, DEFAULT_STORE_VALUES[KEY_BOOK_TIME_LIMIT]))
+        time_limit_label.setBuddy(self.time_limit_spin)
+        other_group_box_layout.addWidget(time_limit_label, 4, 0, 1, 1)
+        other_group_box_layout.addWidget(self.time_limit_spin, 4, 1, 1, 2)
+
+        memory_limit_label = QLabel('M&emory limit per worker:', self)
+        memory_limit_label.setToolTip('If a worker process uses more memory than this while counting a book it is\n'
+                                      'stopped, and the book retried the same way as for the time limit')
+        self.memory_limit_spin = QSpinBox(self)
+        self.memory_limit_spin.setRange(0, 65536)
+        self.memory_limit_spin.setSingleStep(256)
+        self.memory_limit_spin.setSuffix(' MB')
+        self.memory_limit_spin.setSpecialValueText('No limit')
+        self.memory_limit_spin.setValue(c.get(KEY_BOOK_MEMORY_LIMIT, DEFAULT_STORE_VALUES[KEY_BOOK_MEMORY_LIMIT]))
+        memory_limit_label.setBuddy(self.memory_limit_spin)
+        other_group_box_layout.addWidget(memory_limit_label, 5, 0, 1, 1)
+        other_group_box_layout.addWidget(self.memory_limit_spin, 5, 1, 1, 2)
+
+        self.stream_results_checkbox = QCheckBox('Store statistics as each book is &finished', self)
+        self.stream_results_checkbox.setToolTip('Write the statistics into your custom columns every so often while\n'
+                                                'counting, rather than asking to store them all at the end.\n'
+                                                'If calibre is closed or the job cancelled part way through,\n'
+                                                'counting the same books again skips those already counted.')
+        self.stream_results_checkbox.setChecked(c.get(KEY_STREAM_RESULTS, DEFAULT_STORE_VALUES[KEY_STREAM_RESULTS]))
+        other_group_box_layout.addWidget(self.stream_results_checkbox, 6, 0, 1, 3)
+
+        book_handoff_label = QLabel('Book &handoff to workers:', self)
+        book_handoff_label.setToolTip('How the books to count are passed to the worker processes, none of\n'
+                                      'which change the book. Copying is safest if you will be editing\n'
+                                      'books while they are counted, but for a large selection can mean\n'
+                                      'many GB of writes. Linking is instant when the temporary folder is\n'
+                                      'on the same drive as your library, and copies otherwise.')
+        book_handoff = c.get(KEY_BOOK_HANDOFF, DEFAULT_STORE_VALUES[KEY_BOOK_HANDOFF])
+        self.book_handoff_combo = AlgorithmComboBox(self, BOOK_HANDOFFS, book_handoff)
+        book_handoff_label.setBuddy(self.book_handoff_combo)
+        other_group_box_layout.addWidget(book_handoff_label, 7, 0, 1, 1)
+        other_group_box_layout.addWidget(self.book_handoff_combo, 7, 1, 1, 2)
+
+        self.confirm_update_checkbox = QCheckBox('Ask before u&pdating columns with the statistics found', self)
+        self.confirm_update_checkbox.setToolTip('Uncheck this option to store the statistics in your custom columns\n'
+                                                'as soon as counting completes, without being asked first.')
+        self.confirm_update_checkbox.setChecked(c.get(KEY_CONFIRM_UPDATE, DEFAULT_STORE_VALUES[KEY_CONFIRM_UPDATE]))
+        other_group_box_layout.addWidget(self.confirm_update_checkbox, 8, 0, 1, 3)
+
+        self.force_recount_checkbox = QCheckBox('Recount books even if &not changed since last counted', self)
+        self.force_recount_checkbox.setToolTip('Books whose format file has not changed since their statistics were\n'
+                                               'counted with the same algorithm are skipped when overwriting.\n'
+                                               'Check this option to count them again anyway.')
+        self.force_recount_checkbox.setChecked(c.get(KEY_FORCE_RECOUNT, DEFAULT_STORE_VALUES[KEY_FORCE_RECOUNT]))
+        other_group_box_layout.addWidget(self.force_recount_checkbox, 9, 0, 1, 3)
+
+        cache_days_label = QLabel('Reuse Goodreads page counts alread&y downloaded for:', self)
+        cache_days_label.setToolTip('Page counts downloaded from Goodreads within this many days are used\n'
+                                    'again without asking Goodreads. Older ones are only downloaded\n'
+                                    'again if the Goodreads page has changed since.')
+        self.cache_days_spin = QSpinBox(self)
+        self.cache_days_spin.setRange(0, 3650)
+        self.cache_days_spin.setSuffix(' days')
+        self.cache_days_spin.setSpecialValueText('Do not reuse')
+        self.cache_days_spin.setValue(c.get(KEY_GOODREADS_CACHE_DAYS, DEFAULT_STORE_VALUES[KEY_GOODREADS_CACHE_DAYS]))
+        cache_days_label.setBuddy(self.cache_days_spin)
+        other_group_box_layout.addWidget(cache_days_label, 10, 0, 1, 1)
+        other_group_box_layout.addWidget(self.cache_days_spin, 10, 1, 1, 2)
+
         keyboard_shortcuts_button = QPushButton('Keyboard shortcuts...', self)
         keyboard_shortcuts_button.setToolTip(_(
                     'Edit the keyboard shortcuts associated with this plugin'))
@@ -275,6 +530,15 @@ class ConfigWidget(QWidget):
         new_prefs = {}
         new_prefs[KEY_BUTTON_DEFAULT] = self.button_default_combo.selected_key()
         new_prefs[KEY_OVERWRITE_EXISTING] = self.overwrite_checkbox.isChecked()
+        new_prefs[KEY_KEEP_WORKERS] = self.keep_workers_checkbox.isChecked()
+        new_prefs[KEY_WORKER_IDLE_MINUTES] = self.idle_minutes_spin.value()
+        new_prefs[KEY_BOOK_TIME_LIMIT] = self.time_limit_spin.value()
+        new_prefs[KEY_BOOK_MEMORY_LIMIT] = self.memory_limit_spin.value()
+        new_prefs[KEY_STREAM_RESULTS] = self.stream_results_checkbox.isChecked()
+        new_prefs[KEY_BOOK_HANDOFF] = self.book_handoff_combo.currentIndex()
+        new_prefs[KEY_CONFIRM_UPDATE] = self.confirm_update_checkbox.isChecked()
+        new_prefs[KEY_FORCE_RECOUNT] = self.force_recount_checkbox.isChecked()
+        new_prefs[KEY_GOODREADS_CACHE_DAYS] = self.cache_days_spin.value()
         plugin_prefs[STORE_NAME] = new_prefs
 
         db = self.plugin_action.gui.current_db
@@ -285,6 +549,13 @@ class ConfigWidget(QWidget):
         library_config[KEY_FLESCH_READING_CUSTOM_COLUMN] = self.flesch_reading_column_combo.get_selected_column()
         library_config[KEY_FLESCH_GRADE_CUSTOM_COLUMN] = self.flesch_grade_column_combo.get_selected_column()
         library_config[KEY_GUNNING_FOG_CUSTOM_COLUMN] = self.gunning_fog_column_combo.get_selected_column()
+        library_config[KEY_SMOG_CUSTOM_COLUMN] = self.smog_column_combo.get_selected_column()
+        library_config[KEY_COLEMAN_LIAU_CUSTOM_COLUMN] = self.coleman_liau_column_combo.get_selected_column()
+        library_config[KEY_ARI_CUSTOM_COLUMN] = self.ari_column_combo.get_selected_column()
+        library_config[KEY_DALE_CHALL_CUSTOM_COLUMN] = self.dale_chall_column_combo.get_selected_column()
+        library_config[KEY_READABILITY_ALGORITHM] = self.readability_algorithm_combo.currentIndex()
+        library_config[KEY_READABILITY_SAMPLE_WORDS] = self.sample_words_spin.value()
+        library_config[KEY_READABILITY_MAX_INTERVAL] = self.max_interval_spin.value()
         set_library_config(db, library_config)
 
     def get_custom_columns(self):
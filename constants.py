@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+# The names of the statistics and options needed by the worker processes,
+# kept apart from config so that the workers do not have to import Qt
+
+KEY_READABILITY_ALGORITHM = 'algorithmReadability'
+KEY_READABILITY_SAMPLE_WORDS = 'readabilitySampleWords'
+KEY_READABILITY_MAX_INTERVAL = 'readabilityMaxInterval'
+
+STATISTIC_PAGE_COUNT = 'PageCount'
+STATISTIC_WORD_COUNT = 'WordCount'
+STATISTIC_FLESCH_READING = 'FleschReading'
+STATISTIC_FLESCH_GRADE = 'FleschGrade'
+STATISTIC_GUNNING_FOG = 'GunningFog'
+STATISTIC_SMOG = 'SMOG'
+STATISTIC_COLEMAN_LIAU = 'ColemanLiau'
+STATISTIC_ARI = 'ARI'
+STATISTIC_DALE_CHALL = 'DaleChall'
@@ -7,78 +7,384 @@ __license__   = 'GPL v3'
 __copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
 __docformat__ = 'restructuredtext en'
 
-import socket
+import os, re, socket, time, httplib, zlib, sqlite3, traceback
+from threading import Thread, Lock, local
+from Queue import Queue, Empty
 
 from lxml.html import fromstring, tostring
-from calibre import browser
+from calibre.constants import config_dir
 from calibre.utils.cleantext import clean_ascii_chars
 
-class GoodreadsPagesWorker():
+GOODREADS_HOST = 'www.goodreads.com'
+GOODREADS_BOOK_PATH = '/book/show/%s'
+# How many lookups to make at once, and the least time in seconds between
+# starting each, so as not to hammer Goodreads with a large library
+DOWNLOAD_THREADS = 4
+DOWNLOAD_INTERVAL = 0.5
+DOWNLOAD_TIMEOUT = 20
+MAX_REDIRECTS = 3
+USER_AGENT = 'Mozilla/5.0 (compatible; calibre Count Pages plugin)'
+# How much of a book page to read at a time when looking for the page count
+READ_CHUNK_SIZE = 16 * 1024
+# The page count in the microdata of the book details, or in the JSON-LD
+# description of the book, only matched once the number is complete
+PAGE_COUNT_PATTERNS = [
+    re.compile(br'itemprop\s*=\s*["\']numberOfPages["\'][^>]*>\s*(\d[\d,]*)(?=[^\d,])'),
+    re.compile(br'"numberOfPages"\s*:\s*"?(\d[\d,]*)(?=[^\d,])'),
+]
+
+
+class PageCountScanner(object):
     '''
-    Get page count from Goodreads book page
+    Looks for the page count in the raw html of a Goodreads book page as it
+    is read, without parsing the page, so that reading can stop as soon as
+    it is found
     '''
-    def __init__(self, goodreads_id, timeout=20):
-        self.goodreads_id = goodreads_id
-        self.timeout = timeout
+    # Enough of the end of each chunk to keep for a match spanning two chunks
+    OVERLAP = 512
+
+    def __init__(self):
+        self.tail = b''
         self.page_count = None
-        self.run()
 
-    def run(self):
-        try:
-            self.url = 'http://www.goodreads.com/book/show/%s'%self.goodreads_id
-            self._get_details()
-        except:
-            print('get_details failed for url: %r'%self.url)
+    def feed(self, data):
+        '''
+        Scan the next chunk of the page, returning True once the page count is found
+        '''
+        text = self.tail + data
+        for pattern in PAGE_COUNT_PATTERNS:
+            match = pattern.search(text)
+            if match is not None:
+                self.page_count = int(match.group(1).replace(b',', b''))
+                return True
+        self.tail = text[-self.OVERLAP:]
+        return False
 
-    def _get_details(self):
-        try:
-            print('Goodreads book url: %r'%self.url)
-            br = browser()
-            raw = br.open_novisit(self.url, timeout=self.timeout).read().strip()
-        except Exception as e:
-            if callable(getattr(e, 'getcode', None)) and \
-                    e.getcode() == 404:
-                print('URL malformed: %r'%self.url)
-                return
-            attr = getattr(e, 'args', [None])
-            attr = attr if attr else [None]
-            if isinstance(attr[0], socket.timeout):
-                msg = 'Goodreads timed out. Try again later.'
-                print(msg)
-            else:
-                msg = 'Failed to make details query: %r'%self.url
-                print(msg)
-            return
 
-        raw = raw.decode('utf-8', errors='replace')
-        #open('E:\\t.html', 'wb').write(raw)
+def parse_page_count(raw, url, log):
+    '''
+    Returns the page count from the raw html of a Goodreads book page, or
+    None if it does not have one, logging why not. The page is only parsed
+    if the page count cannot be found by scanning it.
+    '''
+    scanner = PageCountScanner()
+    if scanner.feed(raw):
+        return scanner.page_count
+    return parse_page_count_html(raw, url, log)
+
 
-        if '<title>404 - ' in raw:
-            print('URL malformed: %r'%self.url)
-            return
+def parse_page_count_html(raw, url, log):
+    '''
+    Returns the page count from the raw html of a Goodreads book page by
+    parsing the whole page, logging why if there is none
+    '''
+    raw = raw.decode('utf-8', errors='replace')
+
+    if '<title>404 - ' in raw:
+        log('URL malformed: %r'%url)
+        return None
+
+    try:
+        root = fromstring(clean_ascii_chars(raw))
+    except:
+        msg = 'Failed to parse goodreads details page: %r'%url
+        log(msg)
+        return None
+
+    errmsg = root.xpath('//*[@id="errorMessage"]')
+    if errmsg:
+        msg = 'Failed to parse goodreads details page: %r'%url
+        msg += tostring(errmsg, method='text', encoding=unicode).strip()
+        log(msg)
+        return None
+
+    try:
+        # <div class="row"><span itemprop="numberOfPages">412 pages</span></div>
+        pages = root.xpath('//div[@id="details"]/div[@class="row"]/span[@itemprop="numberOfPages"]/text()')
+        if pages:
+            pages_text = ''.join(pages).strip().partition(' ')
+            return int(pages_text[0])
+    except:
+        log('Error parsing page count for url: %r'%url)
+    return None
+
+
+def get_goodreads_cache_path():
+    return os.path.join(config_dir, 'plugins', 'Count Pages goodreads cache.sqlite')
+
+
+class GoodreadsCache(object):
+    '''
+    The page counts downloaded from Goodreads for each goodreads id, with when
+    they were downloaded and the validators Goodreads sent with the page, so
+    that a page downloaded within the last ttl seconds is not requested
+    again, and an older one is only sent again if it has changed.
+    '''
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
 
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE IF NOT EXISTS pages ('
+                     'goodreads_id TEXT PRIMARY KEY, page_count INTEGER, fetched REAL, '
+                     'etag TEXT, last_modified TEXT)')
+        return conn
+
+    def get_all(self):
+        '''
+        Returns a dict of (page_count, fetched, etag, last_modified) for each
+        goodreads id
+        '''
+        conn = self._connect()
         try:
-            root = fromstring(clean_ascii_chars(raw))
-        except:
-            msg = 'Failed to parse goodreads details page: %r'%self.url
-            print(msg)
-            return
+            return dict((row[0], tuple(row[1:])) for row in conn.execute(
+                    'SELECT goodreads_id, page_count, fetched, etag, last_modified FROM pages'))
+        finally:
+            conn.close()
 
-        errmsg = root.xpath('//*[@id="errorMessage"]')
-        if errmsg:
-            msg = 'Failed to parse goodreads details page: %r'%self.url
-            msg += tostring(errmsg, method='text', encoding=unicode).strip()
-            print(msg)
+    def put(self, entries):
+        '''
+        Record a list of (goodreads_id, (page_count, fetched, etag, last_modified))
+        '''
+        if not entries:
             return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?)',
+                                 [(goodreads_id,) + tuple(entry) for goodreads_id, entry in entries])
+        finally:
+            conn.close()
 
-        self._parse_page_count(root)
+    def is_fresh(self, entry, now=None):
+        return (now or time.time()) - entry[1] < self.ttl
 
-    def _parse_page_count(self, root):
-        try:
-            # <div class="row"><span itemprop="numberOfPages">412 pages</span></div>
-            pages = root.xpath('//div[@id="details"]/div[@class="row"]/span[@itemprop="numberOfPages"]/text()')
-            if pages:
-                pages_text = ''.join(pages).strip().partition(' ')
-                self.page_count = int(pages_text[0])
-        except:
-            print('Error parsing page count for url: %r'%self.url)
+
+class RateLimiter(object):
+    '''
+    Spaces out the requests made by all the download threads
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = Lock()
+        self.next_time = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            at = max(now, self.next_time)
+            self.next_time = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class GoodreadsDownloader(object):
+    '''
+    Looks up the page counts of books on Goodreads from the master job,
+    rather than starting a worker process for each book. A few threads make
+    the requests, each keeping its connection to Goodreads open between
+    books, with the requests of all of them limited to a polite rate.
+
+    If given a cache, page counts downloaded recently enough are taken from
+    it without a request at all, and older ones requested only if changed.
+    '''
+    def __init__(self, threads=DOWNLOAD_THREADS, interval=DOWNLOAD_INTERVAL,
+                 timeout=DOWNLOAD_TIMEOUT, cache=None, host=GOODREADS_HOST, port=None,
+                 https=True):
+        self.timeout = timeout
+        self.host, self.port, self.https = host, port, https
+        self.limiter = RateLimiter(interval)
+        self.cache = cache
+        self.cached = cache.get_all() if cache is not None else {}
+        # Cache entries downloaded or revalidated during this run
+        self.updates = []
+        self.lock = Lock()
+        self.requests = Queue()
+        self.results = Queue()
+        self.connections = local()
+        self.outstanding = 0
+        self.threads = []
+        for i in range(threads):
+            t = Thread(target=self.run, name='CountPagesGoodreads')
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, book_id, goodreads_id):
+        self.outstanding += 1
+        entry = self.cached.get(goodreads_id)
+        if entry is not None and self.cache.is_fresh(entry):
+            days = (time.time() - entry[1]) / 86400
+            self.results.put((book_id, entry[0],
+                              'Goodreads page count downloaded %.1f days ago, from the cache' % days))
+        else:
+            self.requests.put((book_id, goodreads_id, entry))
+
+    def get_finished(self):
+        '''
+        Returns a list of (book_id, page_count, log) for the lookups finished
+        since last called, without waiting
+        '''
+        finished = []
+        while True:
+            try:
+                finished.append(self.results.get_nowait())
+            except Empty:
+                break
+        self.outstanding -= len(finished)
+        return finished
+
+    def close(self):
+        # Drop any lookups not yet started, such as when aborted
+        while True:
+            try:
+                self.requests.get_nowait()
+            except Empty:
+                break
+        for t in self.threads:
+            self.requests.put(None)
+        if self.cache is not None:
+            with self.lock:
+                updates, self.updates = self.updates, []
+            self.cache.put(updates)
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            book_id, goodreads_id, entry = request
+            messages = []
+            try:
+                page_count = self.get_page_count(goodreads_id, entry, messages.append)
+            except:
+                messages.append(traceback.format_exc())
+                page_count = None
+            self.results.put((book_id, page_count, '\n'.join(messages)))
+        conn = getattr(self.connections, 'conn', None)
+        if conn is not None:
+            conn.close()
+
+    def get_page_count(self, goodreads_id, entry, log):
+        path = GOODREADS_BOOK_PATH % goodreads_id
+        url = '%s://%s%s' % ('https' if self.https else 'http', self.host, path)
+        log('Goodreads book url: %r'%url)
+        headers = {}
+        if entry is not None:
+            # Only have the page sent if it changed since last downloaded
+            if entry[2]:
+                headers['If-None-Match'] = entry[2]
+            if entry[3]:
+                headers['If-Modified-Since'] = entry[3]
+        for i in range(MAX_REDIRECTS + 1):
+            self.limiter.wait()
+            try:
+                status, response_headers, raw, page_count = self._request(path, headers)
+            except socket.timeout:
+                log('Goodreads timed out. Try again later.')
+                return None
+            except (socket.error, httplib.HTTPException):
+                log('Failed to make details query: %r'%url)
+                return None
+            location = response_headers.get('location')
+            if status in (301, 302, 303, 307) and location:
+                # Only follow redirects to other pages of the same site, as
+                # the connection is to Goodreads
+                path = location.partition(self.host)[2] if '://' in location else location
+                if not path.startswith('/'):
+                    break
+                continue
+            if status == 304 and entry is not None:
+                log('Goodreads page unchanged since last downloaded')
+                self._cache(goodreads_id, (entry[0], time.time(), entry[2], entry[3]))
+                return entry[0]
+            if status == 404:
+                log('URL malformed: %r'%url)
+                return None
+            if status != 200:
+                log('Failed to make details query: %r (HTTP %d)'%(url, status))
+                return None
+            if page_count is None:
+                # Not found by scanning the page, so parse all of it
+                page_count = parse_page_count_html(raw.strip(), url, log)
+            if page_count is not None:
+                self._cache(goodreads_id, (page_count, time.time(), response_headers.get('etag'),
+                                           response_headers.get('last-modified')))
+            return page_count
+        log('Failed to make details query: %r (redirected away)'%url)
+        return None
+
+    def _cache(self, goodreads_id, entry):
+        if self.cache is not None:
+            with self.lock:
+                self.updates.append((goodreads_id, entry))
+
+    def _request(self, path, extra_headers):
+        '''
+        Make a request on this thread's open connection, opening a new one if
+        there is none or the server has since closed it. Returns a tuple of
+        (status, headers, body, page_count), with the header names in lower
+        case. A book page is scanned for the page count as it is read,
+        stopping as soon as it is found, in which case the body is only the
+        part scanned. A connection left part way through a response cannot
+        be reused, so is closed.
+        '''
+        headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip',
+                   'Connection': 'keep-alive'}
+        headers.update(extra_headers)
+        connection_class = httplib.HTTPSConnection if self.https else httplib.HTTPConnection
+        for attempt in range(2):
+            conn = getattr(self.connections, 'conn', None)
+            reused = conn is not None
+            if conn is None:
+                conn = self.connections.conn = connection_class(self.host, self.port,
+                                                                timeout=self.timeout)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                gzipped = response.getheader('content-encoding', '') == 'gzip'
+                if response.status == 200:
+                    raw, page_count = self._read_page(response, gzipped)
+                else:
+                    raw, page_count = response.read(), None
+                    if gzipped and raw:
+                        raw = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                self.connections.conn = None
+                if reused and attempt == 0 and not isinstance(e, socket.timeout):
+                    # Goodreads closed the connection while it was idle
+                    continue
+                raise
+            if response.will_close or not response.isclosed():
+                conn.close()
+                self.connections.conn = None
+            return response.status, dict(response.getheaders()), raw, page_count
+
+    def _read_page(self, response, gzipped):
+        '''
+        Read a book page a chunk at a time until the page count is found,
+        returning a tuple of the page as far as scanned and the page count.
+        The rest of the page is still read unless the server is closing the
+        connection anyway, as that is much quicker than opening a new one.
+        '''
+        scanner = PageCountScanner()
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        chunks = []
+        while True:
+            data = response.read(READ_CHUNK_SIZE)
+            finished = not data
+            if decompressor is not None:
+                data = decompressor.flush() if finished else decompressor.decompress(data)
+            chunks.append(data)
+            if scanner.feed(data):
+                if not response.will_close:
+                    # Read the rest of the page without decompressing or
+                    # scanning it, so that the connection can be reused
+                    while response.read(READ_CHUNK_SIZE):
+                        pass
+                break
+            if finished:
+                break
+        return b''.join(chunks), scanner.page_count
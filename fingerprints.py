@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import os, hashlib, sqlite3
+
+from calibre.constants import config_dir
+
+import calibre_plugins.count_pages.config as cfg
+from calibre_plugins.count_pages.scheduler import NATIVE_PAGE_COUNT_FORMATS
+
+# Increase this when a change to how statistics are counted means those
+# stored by earlier versions of the plugin should be counted again
+ALGORITHM_VERSION = 1
+# How much of the start and of the end of a file to hash
+HASH_BYTES = 64 * 1024
+# How many books to look up fingerprints for in each query, within the
+# limit SQLite has on the number of parameters of a statement
+QUERY_CHUNK_SIZE = 500
+
+
+def get_fingerprints_path(library_id):
+    return os.path.join(config_dir, 'plugins', 'Count Pages fingerprints %s.sqlite' % library_id)
+
+
+def get_statistic_versions(pages_algorithm, readability_options):
+    '''
+    A string for each statistic identifying the algorithm and options it is
+    counted with, so that changing them causes the books to be counted again
+    '''
+    readability = ','.join('%s=%s' % (k, readability_options[k]) for k in sorted(readability_options))
+    versions = {}
+    for statistic in cfg.ALL_STATISTICS:
+        if statistic == cfg.STATISTIC_PAGE_COUNT:
+            versions[statistic] = '%d:%d' % (ALGORITHM_VERSION, pages_algorithm)
+        elif statistic == cfg.STATISTIC_WORD_COUNT:
+            versions[statistic] = '%d' % ALGORITHM_VERSION
+        else:
+            versions[statistic] = '%d:%s' % (ALGORITHM_VERSION, readability)
+    return versions
+
+
+def get_format_version(versions, statistic, fmt):
+    '''
+    The version of a statistic counted from this format. A page count read
+    from a PDF or comic itself does not depend on the page count algorithm,
+    so changing that does not cause them to be counted again.
+    '''
+    if statistic == cfg.STATISTIC_PAGE_COUNT and fmt in NATIVE_PAGE_COUNT_FORMATS:
+        return '%d' % ALGORITHM_VERSION
+    return versions[statistic]
+
+
+def get_file_fingerprint(path, previous=None):
+    '''
+    Returns a tuple of (size, mtime, hash) for the file, the hash being of
+    its first and last HASH_BYTES only. If the size and modified time are the
+    same as those of the previous fingerprint, it is returned unchanged
+    without reading the file at all.
+    '''
+    st = os.stat(path)
+    if previous is not None and previous[0] == st.st_size and previous[1] == st.st_mtime:
+        return previous
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        h.update(f.read(HASH_BYTES))
+        if st.st_size > HASH_BYTES:
+            f.seek(max(HASH_BYTES, st.st_size - HASH_BYTES))
+            h.update(f.read(HASH_BYTES))
+    return (st.st_size, st.st_mtime, h.hexdigest())
+
+
+def get_counted_fingerprints(book_fingerprints, fallbacks, book_statistics_map):
+    '''
+    The list of fingerprints to record for the statistics counted, from those
+    kept by the queuer. Books counted using a fallback are not recorded, so
+    that they are counted properly next time.
+    '''
+    fingerprints = []
+    for book_id, statistics in book_statistics_map.iteritems():
+        if book_id in fallbacks:
+            continue
+        statistic_fingerprints = book_fingerprints.get(book_id, {})
+        for statistic, value in statistics.iteritems():
+            if value is not None and statistic in statistic_fingerprints:
+                fmt, fingerprint, version = statistic_fingerprints[statistic]
+                fingerprints.append((book_id, statistic, fmt, fingerprint, version))
+    return fingerprints
+
+
+def fingerprints_match(a, b):
+    # A file copied or restored with a new modified time is still the same
+    return a[0] == b[0] and a[2] == b[2]
+
+
+class FingerprintStore(object):
+    '''
+    A database of the fingerprint of the format file each statistic of each
+    book was counted from, and the version of the algorithm used, so that
+    books which have not changed since can be skipped.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE IF NOT EXISTS fingerprints ('
+                     'book INTEGER NOT NULL, statistic TEXT NOT NULL, format TEXT, '
+                     'size INTEGER, mtime REAL, hash TEXT, version TEXT, '
+                     'PRIMARY KEY (book, statistic))')
+        return conn
+
+    def get(self, book_ids):
+        '''
+        Returns a dict for each of these books of the (format, fingerprint,
+        version) recorded for each statistic
+        '''
+        book_ids = list(book_ids)
+        book_fingerprints = {}
+        conn = self._connect()
+        try:
+            for i in range(0, len(book_ids), QUERY_CHUNK_SIZE):
+                chunk = book_ids[i:i + QUERY_CHUNK_SIZE]
+                for book_id, statistic, fmt, size, mtime, digest, version in conn.execute(
+                        'SELECT book, statistic, format, size, mtime, hash, version FROM fingerprints '
+                        'WHERE book IN (%s)' % ','.join('?' * len(chunk)), chunk):
+                    book_fingerprints.setdefault(book_id, {})[statistic] = \
+                            (fmt, (size, mtime, digest), version)
+        finally:
+            conn.close()
+        return book_fingerprints
+
+    def put(self, fingerprints):
+        '''
+        Record a list of (book_id, statistic, format, fingerprint, version)
+        '''
+        if not fingerprints:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO fingerprints VALUES (?,?,?,?,?,?,?)',
+                                 [(book_id, statistic, fmt, fp[0], fp[1], fp[2], version)
+                                  for book_id, statistic, fmt, fp, version in fingerprints])
+        finally:
+            conn.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import os, re, json, gzip, time, sqlite3
+
+from calibre.constants import config_dir
+
+# How many editions to insert into the index in each statement
+INSERT_CHUNK_SIZE = 10000
+# How many lines of the dump to read between progress updates
+PROGRESS_LINES = 100000
+# The number of pages in the free text pagination of an edition, such as "xii, 345 p."
+PAGINATION_PATTERN = re.compile(r'(\d+)\s*p')
+
+
+def get_isbn_index_path():
+    return os.path.join(config_dir, 'plugins', 'Count Pages ISBN index.sqlite')
+
+
+def normalize_isbn(value):
+    '''
+    Returns the ISBN-13 for an ISBN-10 or ISBN-13 as an integer, so that
+    either finds the same edition, or None if it is not an ISBN
+    '''
+    digits = re.sub(r'[^0-9X]', '', value.upper())
+    if len(digits) == 10 and digits[:9].isdigit():
+        digits = '978' + digits[:9]
+        total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(digits))
+        return int(digits + str((10 - total % 10) % 10))
+    if len(digits) == 13 and digits.isdigit():
+        return int(digits)
+    return None
+
+
+def _get_edition_pages(edition):
+    pages = edition.get('number_of_pages')
+    if isinstance(pages, int) and pages > 0:
+        return pages
+    numbers = [int(n) for n in PAGINATION_PATTERN.findall(edition.get('pagination') or '')]
+    if numbers and max(numbers) > 0:
+        return max(numbers)
+    return None
+
+
+def build_index(dump_path, index_path, log=None, abort=None, notifications=None):
+    '''
+    Job to build the index of page counts by ISBN from an Open Library style
+    bulk dump of editions, plain or gzipped, with one edition on each line as
+    tab separated fields ending in its JSON record. The index is built
+    alongside and replaces any existing one only once complete. Returns the
+    number of ISBNs in the index.
+    '''
+    tmp_path = index_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    # The ISBN is the rowid, so looking one up is a single search of the
+    # table itself, with no separate index to read
+    conn.execute('CREATE TABLE pages (isbn INTEGER PRIMARY KEY, pages INTEGER NOT NULL)')
+    conn.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+    # Nothing is lost if building is interrupted, so skip the journal
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+
+    size = os.path.getsize(dump_path)
+    raw = open(dump_path, 'rb')
+    f = gzip.GzipFile(fileobj=raw) if dump_path.lower().endswith('.gz') else raw
+    start = time.time()
+    editions = 0
+    rows = []
+    try:
+        for i, line in enumerate(f):
+            if i % PROGRESS_LINES == 0:
+                if abort is not None and abort.is_set():
+                    if log is not None:
+                        log('Aborted, the offline index has not been changed')
+                    conn.close()
+                    os.remove(tmp_path)
+                    return 0
+                if notifications is not None:
+                    notifications.put((raw.tell() / max(size, 1), 'Building offline index'))
+            # Most editions have no ISBN or no page count, so skip parsing them
+            if b'isbn_1' not in line or (b'"number_of_pages"' not in line and
+                                         b'"pagination"' not in line):
+                continue
+            try:
+                edition = json.loads(line.rpartition(b'\t')[2])
+            except ValueError:
+                continue
+            pages = _get_edition_pages(edition)
+            if pages is None:
+                continue
+            isbns = set()
+            for value in (edition.get('isbn_13') or []) + (edition.get('isbn_10') or []):
+                isbn = normalize_isbn(value)
+                if isbn is not None:
+                    isbns.add(isbn)
+            if isbns:
+                editions += 1
+                rows.extend((isbn, pages) for isbn in isbns)
+            if len(rows) >= INSERT_CHUNK_SIZE:
+                conn.executemany('INSERT OR REPLACE INTO pages VALUES (?,?)', rows)
+                rows = []
+        conn.executemany('INSERT OR REPLACE INTO pages VALUES (?,?)', rows)
+        count = conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        conn.executemany('INSERT INTO info VALUES (?,?)',
+                         [('source', os.path.basename(dump_path)), ('built', unicode(time.time())),
+                          ('isbns', unicode(count))])
+        conn.commit()
+        conn.close()
+    finally:
+        f.close()
+        raw.close()
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    os.rename(tmp_path, index_path)
+    if log is not None:
+        log('Indexed %d ISBNs of %d editions from %s in %.0f seconds' % (
+                count, editions, dump_path, time.time() - start))
+    return count
+
+
+def get_book_isbns(db, book_ids):
+    '''
+    Returns a dict of the ISBN of each of these books which has one
+    '''
+    wanted = set(book_ids)
+    isbns = {}
+    for book_id, val in db.conn.get('SELECT book, val FROM identifiers WHERE type=?', ('isbn',)):
+        if book_id in wanted:
+            isbn = normalize_isbn(val)
+            if isbn is not None:
+                isbns[book_id] = isbn
+    return isbns
+
+
+class IsbnIndex(object):
+    '''
+    The page count of each ISBN in the index built from a bulk dump
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def lookup(self, book_isbns):
+        '''
+        Given a dict of the ISBN of each book, returns a dict of the page
+        count of each book found in the index
+        '''
+        book_pages = {}
+        conn = sqlite3.connect(self.path)
+        try:
+            for book_id, isbn in book_isbns.iteritems():
+                row = conn.execute('SELECT pages FROM pages WHERE isbn=?', (isbn,)).fetchone()
+                if row is not None:
+                    book_pages[book_id] = row[0]
+        finally:
+            conn.close()
+        return book_pages
@@ -7,108 +7,409 @@ __license__ = 'GPL v3'
 __copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
 __docformat__ = 'restructuredtext en'
 
-import os, traceback, time
+import os, sys, traceback, time
+from threading import Thread
+from Queue import Empty
+from StringIO import StringIO
 
 from calibre.customize.ui import quick_metadata
 from calibre.ebooks import DRMError
 from calibre.ptempfile import cleanup
-from calibre.utils.ipc.server import Server
-from calibre.utils.ipc.job import ParallelJob
 
-import calibre_plugins.count_pages.config as cfg
-from calibre_plugins.count_pages.download import GoodreadsPagesWorker
+import calibre_plugins.count_pages.constants as const
+from calibre_plugins.count_pages.sysinfo import get_process_memory_mb
 from calibre_plugins.count_pages.statistics import (get_page_count, get_pdf_page_count,
                                     get_word_count, get_text_analysis, get_gunning_fog_index,
                                     get_flesch_reading_ease, get_flesch_kincaid_grade_level,
+                                    get_smog_index, get_coleman_liau_index,
+                                    get_automated_readability_index, get_dale_chall_score,
                                     get_cbr_page_count, get_cbz_page_count)
 
-def do_count_statistics(books_to_scan, pages_algorithm, use_goodreads,
-                        nltk_pickle, cpus, notification=lambda x, y:x):
+# The cheaper ways to count a book tried in turn if it exceeds the time or memory limit
+FALLBACKS = ['ADE page count and fast readability', 'ADE page count and no readability']
+READABILITY_STATISTICS = [const.STATISTIC_FLESCH_READING, const.STATISTIC_FLESCH_GRADE,
+                          const.STATISTIC_GUNNING_FOG, const.STATISTIC_SMOG,
+                          const.STATISTIC_COLEMAN_LIAU, const.STATISTIC_ARI, const.STATISTIC_DALE_CHALL]
+
+def do_count_statistics(executor, books, pages_algorithm, readability_options,
+                        use_goodreads, nltk_pickle, time_limit=0, memory_limit=0,
+                        journal=None, temp_dir=None, book_count=0, fallbacks=None,
+                        goodreads_cache=None, log=None, abort=None, notifications=None):
     '''
-    Master job, to launch child jobs to count pages in this list of books
+    Master job, run as a thread in the calibre GUI, to run child jobs on the
+    executor to count statistics for the books taken from the books queue.
+    Books are counted as soon as they are put on the queue, while the rest
+    are still being queued, until None is taken from it. Cheap books are
+    grouped so that each child job counts several of them, and the scheduler
+    decides the order in which the jobs are run. Page counts are downloaded
+    from Goodreads by this job itself, so a book needing nothing else is
+    never handed to a child job, taking those downloaded recently from the
+    goodreads_cache if given.
+
+    A job taking longer than time_limit seconds is killed, as is a worker
+    using more than memory_limit MB. As jobs of several books only hold a few
+    seconds of work, the books of the job are then retried one at a time so
+    that each has the time limit to itself, falling back to cheaper
+    algorithms for a book which fails on its own.
+
+    If given a journal, the statistics for each book are appended to it as
+    soon as the book is finished. If given a fallbacks dict, the fallback
+    used for each book counted with one is put in it.
     '''
-    server = Server(pool_size=cpus)
-
-    # Queue all the jobs
-    for book_id, title, book_path, goodreads_id, statistics_to_run in books_to_scan:
-        args = ['calibre_plugins.count_pages.jobs', 'do_statistics_for_book',
-                (book_path, pages_algorithm, goodreads_id,
-                 use_goodreads, statistics_to_run, nltk_pickle)]
-        job = ParallelJob('arbitrary', str(book_id), done=None, args=args)
-        job._book_id = book_id
-        job._title = title
-        job._pages_algorithm = pages_algorithm
-        job._goodreads_id = goodreads_id
-        job._use_goodreads = use_goodreads
-        job._statistics_to_run = statistics_to_run
-        server.add_job(job)
-
-    # This server is an arbitrary_n job, so there is a notifier available.
+    from calibre_plugins.count_pages.scheduler import CostModel, Scheduler, ConcurrencyController
+    start_time = time.time()
+    books_map = dict()
+    model = CostModel()
+    scheduler = Scheduler(use_goodreads, executor.pool_size, model)
+    log('Counting statistics for up to %d books with %d workers' % (book_count, executor.pool_size))
+
+    running = dict()
+    if fallbacks is None:
+        fallbacks = dict()
+    controller = ConcurrencyController(executor.pool_size)
+    waiting_reason = [None]
+    job_count = [0]
+    downloader = None
+    if use_goodreads:
+        from calibre_plugins.count_pages.download import GoodreadsDownloader
+        downloader = GoodreadsDownloader(cache=goodreads_cache)
+    # The results and log of the parts of each book counted so far, for books
+    # whose page count is downloaded while the rest is counted by a child job
+    book_parts = dict()
+    def start_batches():
+        # Start jobs while there are cores and memory to spare for them,
+        # letting the scheduler choose the next job each time
+        while scheduler.has_batches():
+            batch = scheduler.next_batch(running.values())
+            reason = controller.can_start(running.values(), batch)
+            if reason is not None:
+                scheduler.put_back(batch)
+                if reason != waiting_reason[0] and reason != 'all workers busy':
+                    log('Waiting to start more jobs with %d running: %s' % (len(running), reason))
+                waiting_reason[0] = reason
+                break
+            waiting_reason[0] = None
+            batch.started = time.time()
+            batch.killed = False
+            task_id = id(batch)
+            running[task_id] = batch
+            job_count[0] += 1
+            job_books = [_get_book_job_args(book, pages_algorithm, readability_options,
+                                            fallbacks.get(book[0], -1))
+                         for book in batch.books]
+            executor.submit(task_id, 'do_statistics_for_books',
+                            (job_books, use_goodreads, nltk_pickle, memory_limit))
     # Set the % complete to a small number to avoid the 'unavailable' indicator
-    notification(0.01, 'Counting Statistics')
+    notifications.put((0.01, 'Counting Statistics'))
 
     # dequeue the job results as they arrive, saving the results
-    total = len(books_to_scan)
+    queueing = True
+    total = 0
     count = 0
+    work_time = 0
     book_stats_map = dict()
-    while True:
-        job = server.changed_jobs_queue.get()
-        # A job can 'change' when it is not finished, for example if it
-        # produces a notification. Ignore these.
-        job.update()
-        if not job.is_finished:
-            continue
-        # A job really finished. Get the information.
-        results = job.result
-        book_id = job._book_id
-        book_stats_map[book_id] = results
+    try:
+        while queueing or count < total:
+            if abort.is_set():
+                log('Aborting, statistics not yet counted will not be stored')
+                break
+            if queueing:
+                new_books = []
+                while True:
+                    try:
+                        book = books.get_nowait()
+                    except Empty:
+                        break
+                    if book is None:
+                        queueing = False
+                        break
+                    new_books.append(book)
+                job_books = []
+                for book in new_books:
+                    book_id, title, book_path, goodreads_id, statistics_to_run, pages_path = book
+                    books_map[book_id] = (title, book_path, goodreads_id, statistics_to_run, pages_path)
+                    parts = 0
+                    if downloader is not None and goodreads_id and \
+                            const.STATISTIC_PAGE_COUNT in statistics_to_run:
+                        downloader.submit(book_id, goodreads_id)
+                        parts += 1
+                        statistics_to_run = [s for s in statistics_to_run
+                                             if s != const.STATISTIC_PAGE_COUNT]
+                        book = (book_id, title, book_path, None, statistics_to_run, pages_path)
+                    if statistics_to_run:
+                        job_books.append(book)
+                        parts += 1
+                    book_parts[book_id] = [parts, None, []]
+                scheduler.add_books(job_books)
+                total += len(new_books)
+                if not queueing:
+                    log('All %d books queued, predicted %s of work remaining, taking about %s' % (
+                        total, _format_duration(scheduler.remaining_cost()),
+                        _format_duration(scheduler.predicted_elapsed())))
+                if job_books:
+                    start_batches()
+                elif count == total and not queueing:
+                    break
+            if time_limit:
+                for task_id, batch in running.iteritems():
+                    if not batch.killed and time.time() - batch.started > time_limit:
+                        log('A job counting %d books exceeded the time limit, stopping it' % len(batch.books))
+                        batch.killed = True
+                        executor.kill(task_id)
+            if downloader is not None:
+                finished_books = []
+                for book_id, pages, details in downloader.get_finished():
+                    finished_books.extend(_part_finished(book_parts, book_id,
+                                          {const.STATISTIC_PAGE_COUNT: pages}, details))
+                if finished_books:
+                    count = _finish_books(finished_books, count, books_map, book_stats_map, journal,
+                                          fallbacks, use_goodreads, temp_dir, log)
+                    notifications.put((float(count) / (max(total, book_count) if queueing else total),
+                                       'Counting Statistics'))
+            # Look for more books often while there is nothing else to wait for
+            waiting = (queueing or (downloader is not None and downloader.outstanding)) and not running
+            finished = executor.get_finished(timeout=0.1 if waiting else 1)
+            if finished is None:
+                # Memory or cores may have been freed up for waiting jobs
+                start_batches()
+                continue
+            task_id, batch_results, details = finished
+            batch = running.pop(task_id)
+            if batch_results is None:
+                if len(batch.books) > 1:
+                    # The worker process died or was killed, so retry each of its
+                    # books on its own in order to lose only the book responsible
+                    log('A job counting %d books failed, retrying each book separately:' % len(batch.books))
+                    log(details)
+                    scheduler.retry_separately(batch)
+                    start_batches()
+                    continue
+                book_id = batch.books[0][0]
+                fallback = fallbacks.get(book_id, -1) + 1
+                if fallback < len(FALLBACKS) and \
+                        _get_book_job_args(batch.books[0], pages_algorithm, readability_options, fallback):
+                    log('Counting book ID %d (%s) failed, retrying with %s:' % (
+                        book_id, books_map[book_id][0], FALLBACKS[fallback]))
+                    log(details)
+                    fallbacks[book_id] = fallback
+                    scheduler.retry_separately(batch)
+                    start_batches()
+                    continue
+                batch_results = [(book_id, None, details, 0)]
+            start_batches()
+
+            finished_books = []
+            for (book_id, results, book_details, elapsed), (kind, estimate) in \
+                    zip(batch_results, batch.estimates):
+                if results is not None:
+                    if book_id not in fallbacks:
+                        model.observe(kind, estimate, elapsed)
+                    work_time += elapsed
+                finished_books.extend(_part_finished(book_parts, book_id, results, book_details))
+            count = _finish_books(finished_books, count, books_map, book_stats_map, journal,
+                                  fallbacks, use_goodreads, temp_dir, log)
+            notifications.put((float(count) / (max(total, book_count) if queueing else total),
+                               'Counting Statistics'))
+    finally:
+        executor.close()
+        if downloader is not None:
+            downloader.close()
+        if journal is not None:
+            journal.close()
+    model.save()
+    log('-------------------------------')
+    if fallbacks:
+        log('Counted %d books using a fallback after exceeding the time or memory limit:' % len(fallbacks))
+        for book_id, fallback in fallbacks.iteritems():
+            log('\tBook ID %d (%s): %s' % (book_id, books_map[book_id][0], FALLBACKS[fallback]))
+    log('Counted statistics for %d books in %d jobs' % (count, job_count[0]))
+    log('Actual %s of work, taking %s' % (_format_duration(work_time),
+                                         _format_duration(time.time() - start_time)))
+    # return the map as the job result
+    return book_stats_map
+
+
+def _part_finished(book_parts, book_id, results, details):
+    '''
+    Record the results of counting part of a book, returning a list of the
+    (book_id, results, log) of the book if that was the last part
+    '''
+    parts = book_parts[book_id]
+    parts[0] -= 1
+    if results is not None:
+        parts[1] = dict(parts[1] or {}, **results)
+    if details:
+        parts[2].append(details)
+    if parts[0] > 0:
+        return []
+    del book_parts[book_id]
+    return [(book_id, parts[1], '\n'.join(parts[2]))]
+
+
+def _finish_books(finished_books, count, books_map, book_stats_map, journal,
+                  fallbacks, use_goodreads, temp_dir, log):
+    '''
+    Store and log the results of the books completely counted, returning the
+    number of books now finished
+    '''
+    for book_id, results, book_details in finished_books:
+        if results is not None:
+            book_stats_map[book_id] = results
+            if journal is not None:
+                journal.append(book_id, results)
         count = count + 1
-        notification(float(count) / total, 'Counting Statistics')
-
-        # Add this job's output to the current log
-        print('-------------------------------')
-        print('Logfile for book ID %d (%s)' % (book_id, job._title))
-
-        for stat in job._statistics_to_run:
-            if stat == cfg.STATISTIC_PAGE_COUNT:
-                if job._use_goodreads:
-                    if job._goodreads_id is not None:
-                        if stat in results and results[stat]:
-                            print('\tGoodreads edition has %d pages' % results[stat])
-                        else:
-                            print('\tFAILED TO GET PAGE COUNT FROM GOODREADS')
-                else:
+        title, book_path, goodreads_id, statistics_to_run, pages_path = books_map[book_id]
+        _log_book_results(log, book_id, title, goodreads_id, use_goodreads,
+                          statistics_to_run, results or {}, book_details)
+        if book_id in fallbacks:
+            log('\tCounted using the fallback of %s' % FALLBACKS[fallbacks[book_id]])
+        _remove_book_file(book_path, temp_dir)
+        _remove_book_file(pages_path, temp_dir)
+    return count
+
+
+def _get_book_job_args(book, pages_algorithm, readability_options, fallback):
+    '''
+    The arguments for counting a book with the given fallback, or None if
+    the fallback would leave nothing to count
+    '''
+    book_id, title, book_path, goodreads_id, statistics_to_run, pages_path = book
+    if fallback >= 0:
+        pages_algorithm = 2
+        readability_options = dict(readability_options)
+        # Fast readability never falls back to analysing the full text with Punkt
+        readability_options[const.KEY_READABILITY_ALGORITHM] = 2
+    if fallback >= 1:
+        statistics_to_run = [s for s in statistics_to_run if s not in READABILITY_STATISTICS]
+        if not statistics_to_run:
+            return None
+    return (book_id, book_path, goodreads_id, statistics_to_run, pages_algorithm,
+            readability_options, pages_path)
+
+
+def _remove_book_file(book_path, temp_dir):
+    # The copy of the book is only removed once finished with, as it is
+    # needed again if the book has to be retried. Books read directly from
+    # the library must of course be left alone.
+    if book_path is None or temp_dir is None:
+        return
+    if os.path.dirname(os.path.abspath(book_path)) != os.path.abspath(temp_dir):
+        return
+    if os.path.exists(book_path):
+        try:
+            cleanup(book_path)
+        except:
+            pass
+
+
+def _format_duration(seconds):
+    if seconds < 60:
+        return '%.1f seconds' % seconds
+    return '%d min %02d sec' % divmod(int(seconds), 60)
+
+
+def _log_book_results(log, book_id, title, goodreads_id, use_goodreads,
+                      statistics_to_run, results, details):
+    # Add this job's output to the current log
+    log('-------------------------------')
+    log('Logfile for book ID %d (%s)' % (book_id, title))
+
+    for stat in statistics_to_run:
+        if stat == const.STATISTIC_PAGE_COUNT:
+            if use_goodreads:
+                if goodreads_id is not None:
                     if stat in results and results[stat]:
-                        print('\tFound %d pages' % results[stat])
-            elif stat == cfg.STATISTIC_WORD_COUNT:
-                if stat in results and results[stat]:
-                    print('\tFound %d words' % results[stat])
-            elif stat == cfg.STATISTIC_FLESCH_READING:
-                if stat in results and results[stat]:
-                    print('\tComputed %.1f Flesch Reading' % results[stat])
-            elif stat == cfg.STATISTIC_FLESCH_GRADE:
-                if stat in results and results[stat]:
-                    print('\tComputed %.1f Flesch-Kincaid Grade' % results[stat])
-            elif stat == cfg.STATISTIC_GUNNING_FOG:
+                        log('\tGoodreads edition has %d pages' % results[stat])
+                    else:
+                        log('\tFAILED TO GET PAGE COUNT FROM GOODREADS')
+            else:
                 if stat in results and results[stat]:
-                    print('\tComputed %.1f Gunning Fog Index' % results[stat])
+                    log('\tFound %d pages' % results[stat])
+        elif stat == const.STATISTIC_WORD_COUNT:
+            if stat in results and results[stat]:
+                log('\tFound %d words' % results[stat])
+        elif stat == const.STATISTIC_FLESCH_READING:
+            if stat in results and results[stat]:
+                log('\tComputed %.1f Flesch Reading' % results[stat])
+        elif stat == const.STATISTIC_FLESCH_GRADE:
+            if stat in results and results[stat]:
+                log('\tComputed %.1f Flesch-Kincaid Grade' % results[stat])
+        elif stat == const.STATISTIC_GUNNING_FOG:
+            if stat in results and results[stat]:
+                log('\tComputed %.1f Gunning Fog Index' % results[stat])
+        elif stat == const.STATISTIC_SMOG:
+            if stat in results and results[stat]:
+                log('\tComputed %.1f SMOG Index' % results[stat])
+        elif stat == const.STATISTIC_COLEMAN_LIAU:
+            if stat in results and results[stat]:
+                log('\tComputed %.1f Coleman-Liau Index' % results[stat])
+        elif stat == const.STATISTIC_ARI:
+            if stat in results and results[stat]:
+                log('\tComputed %.1f Automated Readability Index' % results[stat])
+        elif stat == const.STATISTIC_DALE_CHALL:
+            if stat in results and results[stat]:
+                log('\tComputed %.1f Dale-Chall Score' % results[stat])
 
-        print(job.details)
+    log(details)
 
-        if count >= total:
-            # All done!
-            break
 
-    server.close()
-    # return the map as the job result
-    return book_stats_map
+def do_statistics_for_books(books, use_goodreads, nltk_pickle, memory_limit=0):
+    '''
+    Child job, to count statistics in each of these books in turn, returning
+    a list of (book_id, results, log, seconds taken) for the books
+    '''
+    if memory_limit:
+        _start_memory_watchdog(memory_limit)
+    batch_results = []
+    for book_id, book_path, goodreads_id, statistics_to_run, pages_algorithm, \
+            readability_options, pages_path in books:
+        start_time = time.time()
+        # Capture the output for each book, to show in the log for that book
+        output = StringIO()
+        old_stdout = sys.stdout
+        sys.stdout = output
+        try:
+            results = do_statistics_for_book(book_path, pages_algorithm, readability_options,
+                                             goodreads_id, use_goodreads, statistics_to_run,
+                                             nltk_pickle, pages_path)
+        finally:
+            sys.stdout = old_stdout
+        batch_results.append((book_id, results, output.getvalue(), time.time() - start_time))
+    return batch_results
+
+
+_memory_watchdog = []
+
+def _start_memory_watchdog(memory_limit):
+    '''
+    Kill this worker process if it uses more than memory_limit MB, which the
+    master sees as the job failing
+    '''
+    if _memory_watchdog:
+        _memory_watchdog[0] = memory_limit
+        return
+    _memory_watchdog.append(memory_limit)
+    def watch():
+        while True:
+            memory = get_process_memory_mb()
+            if memory is not None and memory > _memory_watchdog[0]:
+                sys.__stdout__.write('Worker using %d MB exceeded the memory limit, stopping\n' % memory)
+                sys.__stdout__.flush()
+                os._exit(1)
+            time.sleep(1)
+    t = Thread(target=watch, name='CountPagesMemoryWatchdog')
+    t.daemon = True
+    t.start()
 
 
-def do_statistics_for_book(book_path, pages_algorithm,
+def do_statistics_for_book(book_path, pages_algorithm, readability_options,
                            goodreads_id, use_goodreads, statistics_to_run,
-                           nltk_pickle):
+                           nltk_pickle, pages_path=None):
     '''
-    Child job, to count statistics in this specific book
+    Child job, to count statistics in this specific book, reading the page
+    count from pages_path instead if given. Goodreads page counts are
+    downloaded by the master job, so goodreads_id and use_goodreads are
+    only kept for the arguments of the job to stay the same.
     '''
     results = {}
     try:
@@ -122,13 +423,17 @@ def do_statistics_for_book(book_path, pages_algorithm,
                     extension = os.path.splitext(book_path)[1].lower()
                     is_comic = extension in ['.cbr', '.cbz']
                 stats = list(statistics_to_run)
-                if cfg.STATISTIC_PAGE_COUNT in stats:
+                if const.STATISTIC_PAGE_COUNT in stats:
                     pages = None
-                    stats.remove(cfg.STATISTIC_PAGE_COUNT)
-                    if use_goodreads:
-                        if goodreads_id:
-                            goodreads_worker = GoodreadsPagesWorker(goodreads_id)
-                            pages = goodreads_worker.page_count
+                    stats.remove(const.STATISTIC_PAGE_COUNT)
+                    if pages_path:
+                        pages_extension = os.path.splitext(pages_path)[1].lower()
+                        if pages_extension == '.pdf':
+                            pages = get_pdf_page_count(pages_path)
+                        elif pages_extension == '.cbr':
+                            pages = get_cbr_page_count(pages_path)
+                        elif pages_extension == '.cbz':
+                            pages = get_cbz_page_count(pages_path)
                     else:
                         if extension == '.pdf':
                             # As an optimisation for PDFs we will read the page count directly
@@ -139,44 +444,49 @@ def do_statistics_for_book(book_path, pages_algorithm,
                             pages = get_cbz_page_count(book_path)
                         else:
                             iterator, pages = get_page_count(iterator, book_path, pages_algorithm)
-                    results[cfg.STATISTIC_PAGE_COUNT] = pages
+                    results[const.STATISTIC_PAGE_COUNT] = pages
 
                 if is_comic:
-                    if not (len(stats) == 1 and cfg.STATISTIC_PAGE_COUNT in stats):
+                    if not (len(stats) == 1 and const.STATISTIC_PAGE_COUNT in stats):
                         print('Skipping non page count statistics for CBR/CBZ')
                 else:
-                    if cfg.STATISTIC_WORD_COUNT in stats:
-                        stats.remove(cfg.STATISTIC_WORD_COUNT)
+                    if const.STATISTIC_WORD_COUNT in stats:
+                        stats.remove(const.STATISTIC_WORD_COUNT)
                         iterator, words = get_word_count(iterator, book_path)
                         if words == 0:
                             # Something dodgy about the conversion - no point in calculating remaining stats
                             print('ERROR: No words found in this book (conversion error?), word count will not be stored')
                             return results
-                        results[cfg.STATISTIC_WORD_COUNT] = words
+                        results[const.STATISTIC_WORD_COUNT] = words
 
                     if stats:
                         # The remaining stats are all reading level based
                         # As an optimisation, we will run the text analysis once and
                         # then add the relevant results
-                        iterator, text_analysis = get_text_analysis(iterator, book_path, nltk_pickle)
+                        iterator, text_analysis = get_text_analysis(iterator, book_path, nltk_pickle,
+                                                                    readability_options)
                         if text_analysis['wordCount'] == 0:
                             # Something dodgy about the conversion - no point in calculating remaining stats
                             print('ERROR: No words found in this book (conversion error?) - readability statistics will not be calculated')
                             return results
-                        if cfg.STATISTIC_FLESCH_READING in statistics_to_run:
-                            results[cfg.STATISTIC_FLESCH_READING] = get_flesch_reading_ease(text_analysis)
-                        if cfg.STATISTIC_FLESCH_GRADE in statistics_to_run:
-                            results[cfg.STATISTIC_FLESCH_GRADE] = get_flesch_kincaid_grade_level(text_analysis)
-                        if cfg.STATISTIC_GUNNING_FOG in statistics_to_run:
-                            results[cfg.STATISTIC_GUNNING_FOG] = get_gunning_fog_index(text_analysis)
+                        if const.STATISTIC_FLESCH_READING in statistics_to_run:
+                            results[const.STATISTIC_FLESCH_READING] = get_flesch_reading_ease(text_analysis)
+                        if const.STATISTIC_FLESCH_GRADE in statistics_to_run:
+                            results[const.STATISTIC_FLESCH_GRADE] = get_flesch_kincaid_grade_level(text_analysis)
+                        if const.STATISTIC_GUNNING_FOG in statistics_to_run:
+                            results[const.STATISTIC_GUNNING_FOG] = get_gunning_fog_index(text_analysis)
+                        if const.STATISTIC_SMOG in statistics_to_run:
+                            results[const.STATISTIC_SMOG] = get_smog_index(text_analysis)
+                        if const.STATISTIC_COLEMAN_LIAU in statistics_to_run:
+                            results[const.STATISTIC_COLEMAN_LIAU] = get_coleman_liau_index(text_analysis)
+                        if const.STATISTIC_ARI in statistics_to_run:
+                            results[const.STATISTIC_ARI] = get_automated_readability_index(text_analysis)
+                        if const.STATISTIC_DALE_CHALL in statistics_to_run:
+                            results[const.STATISTIC_DALE_CHALL] = get_dale_chall_score(text_analysis)
             finally:
                 if iterator:
                     iterator.__exit__()
                     iterator = None
-                if book_path is not None:
-                    if os.path.exists(book_path):
-                        time.sleep(0.1)
-                        cleanup(book_path)
         return results
     except DRMError:
         print('\tCannot read pages due to DRM Encryption')
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import os, json
+
+from calibre.constants import config_dir
+
+
+def get_journal_path(library_id):
+    return os.path.join(config_dir, 'plugins', 'Count Pages journal %s.jsonl' % library_id)
+
+
+def get_journal_run(book_ids, statistics_cols_map):
+    '''
+    Identifies a run by the books it counts and the statistics with a column
+    '''
+    return {'book_ids': sorted(book_ids),
+            'statistics': sorted(s for s, col_name in statistics_cols_map.iteritems() if col_name)}
+
+
+class ResultsJournal(object):
+    '''
+    A file of the statistics counted for each book, one line of JSON per
+    book, written as each book finishes so that the results of a run
+    survive calibre crashing or the run being cancelled. The first line
+    records the run the results belong to, so that only the same run is
+    resumed from them.
+    '''
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run
+        self.offset = 0
+        self.f = None
+
+    def append(self, book_id, statistics):
+        if self.f is None:
+            started = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+            unfinished = started and not self._ends_with_newline()
+            self.f = open(self.path, 'ab')
+            if unfinished:
+                # Finish off a line left partly written by a crash
+                self.f.write(b'\n')
+            if not started:
+                self.f.write(json.dumps({'run': self.run}) + b'\n')
+        self.f.write(json.dumps({'book_id': book_id, 'statistics': statistics}) + b'\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def read_new(self):
+        '''
+        Returns a dict of the statistics for each book appended since the
+        last time this was called
+        '''
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # Leave any line still being written for next time
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        book_statistics_map = {}
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A partly written line, from calibre crashing while writing it
+                continue
+            if 'book_id' not in entry:
+                # The line recording the run
+                continue
+            book_statistics_map[entry['book_id']] = entry['statistics']
+        return book_statistics_map
+
+    def read_run(self):
+        '''
+        Returns the run recorded in the journal, or None if there is none
+        '''
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            line = f.readline()
+        try:
+            return json.loads(line).get('run')
+        except ValueError:
+            return None
+
+    def read_all(self):
+        self.offset = 0
+        return self.read_new()
+
+    def remove(self):
+        self.close()
+        self.offset = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
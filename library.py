@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+from collections import defaultdict
+
+# How many books to store the statistics of in each transaction
+WRITE_CHUNK_SIZE = 1000
+
+
+def write_statistics(db, statistics_cols_map, book_statistics_map):
+    '''
+    Store the statistics for the books still in the library in their custom
+    columns, with one statement for each column rather than a transaction for
+    every value of every book. The changes are not committed, so that the
+    caller can commit them in chunks. Returns the ids of the books written.
+    '''
+    custom_cols = db.field_metadata.custom_field_metadata()
+    book_ids = [book_id for book_id in book_statistics_map.keys() if db.data.has_id(book_id)]
+    column_values = defaultdict(list)
+    for book_id in book_ids:
+        for statistic, value in book_statistics_map[book_id].iteritems():
+            col_name = statistics_cols_map.get(statistic)
+            if col_name:
+                column_values[col_name].append((book_id, value))
+
+    for col_name, values in column_values.iteritems():
+        # The same conversion and storage as set_custom uses for a single value
+        data = db.custom_column_label_map[custom_cols[col_name]['label']]
+        adapt = db.custom_data_adapters[data['datatype']]
+        values = [(book_id, adapt(value, data)) for book_id, value in values]
+        db.conn.executemany('DELETE FROM %s WHERE book=?' % data['table'],
+                            [(book_id,) for book_id, value in values if value is None])
+        db.conn.executemany('INSERT OR REPLACE INTO %s(book,value) VALUES (?,?)' % data['table'],
+                            [(book_id, value) for book_id, value in values if value is not None])
+        idx = db.FIELD_MAP[data['num']]
+        for book_id, value in values:
+            db.data.set(book_id, idx, value, row_is_id=True)
+    db.dirtied(book_ids, commit=False)
+    return book_ids
@@ -281,6 +281,36 @@ class RegexpTokenizer(TokenizerI):
         else:
             for m in re.finditer(self._regexp, text):
                 yield m.span()
+
+    def iter_tokenize(self, text):
+        """
+        Generate the tokens one at a time, rather than building a list
+        of every token in the text as L{tokenize()} does.
+
+        @rtype: C{iter} of C{str}
+        """
+        if self._gaps:
+            for left, right in self.span_tokenize(text):
+                yield text[left:right]
+        else:
+            for m in self._regexp.finditer(text):
+                yield m.group()
+
+    def count_tokens(self, text):
+        """
+        Count the tokens in the text without creating a string for any
+        of them.
+
+        @rtype: C{int}
+        """
+        if self._gaps:
+            spans = self.span_tokenize(text)
+        else:
+            spans = self._regexp.finditer(text)
+        count = 0
+        for span in spans:
+            count += 1
+        return count
     
     def __repr__(self):
         return ('%s(pattern=%r, gaps=%r, discard_empty=%r, flags=%r)' %
@@ -327,6 +357,22 @@ class WordPunctTokenizer(RegexpTokenizer):
         RegexpTokenizer.__init__(self, r'\w+|[^\w\s]+')
 
 
+class WordTokenizer(RegexpTokenizer):
+    r"""
+    A tokenizer that only matches words, being a run of non-whitespace
+    characters that starts with a word character.  Any leading
+    punctuation is discarded while any trailing punctuation is kept.
+    These are the same words as those found by
+    C{RegexpTokenizer('\W+|\$[\d\.]+|\S+')}, without the runs of
+    whitespace and punctuation between them.  E.g.:
+
+        >>> WordTokenizer().tokenize('She said "hello."  Then left.')
+        ['She', 'said', 'hello."', 'Then', 'left.']
+    """
+    def __init__(self):
+        RegexpTokenizer.__init__(self, r'\w\S*')
+
+
 ######################################################################
 #{ Tokenization Functions
 ######################################################################
@@ -2,43 +2,104 @@
 # Sets the encoding to utf-8 to avoid problems with æøå
 
 import pickle
+import re
 import syllables_en
-from regexp import RegexpTokenizer
+import familiar_en
+from regexp import WordTokenizer
+
+RE_LEADING_TOKEN = re.compile(r'\S*', re.UNICODE)
+
+# For the fast analysis, a sentence ends at a token ending in terminal
+# punctuation (allowing for closing quotes and brackets), unless the token
+# is a common abbreviation or an initial.
+RE_SENTENCE_END = re.compile(u'[.!?]+[\'"\u2019\u201d)\\]]*$', re.UNICODE)
+RE_INITIAL = re.compile(r'^\w\.$', re.UNICODE)
+FAST_ABBREVIATIONS = frozenset(['mr.', 'mrs.', 'ms.', 'dr.', 'st.', 'jr.', 'sr.', 'prof.',
+                                'rev.', 'hon.', 'capt.', 'col.', 'gen.', 'lt.', 'sgt.', 'mt.',
+                                'ft.', 'vs.', 'etc.', 'e.g.', 'i.e.', 'no.', 'vol.', 'ch.',
+                                'fig.', 'co.', 'inc.', 'ltd.', 'u.s.', 'u.k.', 'a.m.', 'p.m.'])
 
 class TextAnalyzer(object):
 
-    tokenizer = RegexpTokenizer('(?u)\W+|\$[\d\.]+|\S+')
-    special_chars = ['.', ',', '!', '?']
-
-    def __init__(self, eng_tokenizer_pickle):
-        self.eng_tokenizer = pickle.loads(eng_tokenizer_pickle)
-
-    def analyzeText(self, text=''):
-        words = self.getWords(text)
-        charCount = self.getCharacterCount(words)
-        wordCount = len(words)
-        sentences = self.getSentences(text)
-        sentenceCount = len(sentences)
-        syllableCount = self.countSyllables(words)
-        complexwordsCount = self.countComplexWords(text, sentences, words)
-        averageWordsPerSentence = wordCount/sentenceCount
-        print '\tResults of NLTK text analysis:'
-        print '\t  Number of characters: ' + str(charCount)
-        print '\t  Number of words: ' + str(wordCount)
-        print '\t  Number of sentences: ' + str(sentenceCount)
-        print '\t  Number of syllables: ' + str(syllableCount)
-        print '\t  Number of complex words: ' + str(complexwordsCount)
-        print '\t  Average words per sentence: ' + str(averageWordsPerSentence)
-        analyzedVars = {}
+    tokenizer = WordTokenizer()
+
+    def __init__(self, eng_tokenizer_pickle=None):
+        # The Punkt sentence tokenizer is not needed for the fast analysis
+        if eng_tokenizer_pickle is not None:
+            self.eng_tokenizer = pickle.loads(eng_tokenizer_pickle)
+
+    def analyzeText(self, text='', fast=False):
+        '''
+        Analyse the whole text in a single pass over its words. This is the
+        same as analysing it as one chunk. If fast is True, sentences are
+        counted from terminal punctuation while tokenizing the words rather
+        than by using Punkt.
+        '''
+        words, chunkVars = self._analyzeWords(text, fast)
+        analyzedVars = mergeChunkAnalyses([chunkVars])
         analyzedVars['words'] = words
-        analyzedVars['charCount'] = float(charCount)
-        analyzedVars['wordCount'] = float(wordCount)
-        analyzedVars['sentenceCount'] = float(sentenceCount)
-        analyzedVars['syllableCount'] = float(syllableCount)
-        analyzedVars['complexwordCount'] = float(complexwordsCount)
-        analyzedVars['averageWordsPerSentence'] = float(averageWordsPerSentence)
         return analyzedVars
 
+    def analyzeTextChunk(self, text='', fast=False):
+        '''
+        Analyse one chunk of a larger text, returning just the numeric
+        aggregates so the results for each chunk can be combined with
+        mergeChunkAnalyses(). Since the proper noun check for complex words
+        needs to know the sentence starts across the whole text, capitalised
+        complex words and the first token of each sentence are returned
+        for that check to be done when merging.
+        '''
+        return self._analyzeWords(text, fast)[1]
+
+    def _analyzeWords(self, text, fast=False):
+        if fast:
+            words, sentenceCount, sentenceStartWords = self.getWordsAndSentencesFast(text)
+            sentences = []
+        else:
+            words = self.getWords(text)
+            sentences = self.getSentences(text)
+            sentenceCount = len(sentences)
+        charCount = 0
+        syllableCount = 0
+        complexwordCount = 0
+        polysyllableCount = 0
+        letterCount = 0
+        familiarWordCount = 0
+        properComplexWords = {}
+        for index, word in enumerate(words):
+            charCount += len(word.decode("utf-8"))
+            letterCount += sum(1 for c in word if c.isalnum())
+            if familiar_en.is_familiar(word):
+                familiarWordCount += 1
+            syllables = syllables_en.count(word)
+            syllableCount += syllables
+            if syllables >= 3:
+                polysyllableCount += 1
+                if not(word[0].isupper()):
+                    complexwordCount += 1
+                elif fast:
+                    if index in sentenceStartWords:
+                        complexwordCount += 1
+                else:
+                    properComplexWords[word] = properComplexWords.get(word, 0) + 1
+        sentenceStarts = set()
+        for sentence in sentences:
+            start = RE_LEADING_TOKEN.match(sentence).group()
+            if start:
+                sentenceStarts.add(start)
+        chunkVars = {}
+        chunkVars['charCount'] = charCount
+        chunkVars['wordCount'] = len(words)
+        chunkVars['sentenceCount'] = sentenceCount
+        chunkVars['syllableCount'] = syllableCount
+        chunkVars['complexwordCount'] = complexwordCount
+        chunkVars['polysyllableCount'] = polysyllableCount
+        chunkVars['letterCount'] = letterCount
+        chunkVars['familiarWordCount'] = familiarWordCount
+        chunkVars['properComplexWords'] = properComplexWords
+        chunkVars['sentenceStarts'] = sentenceStarts
+        return words, chunkVars
+
     def getCharacterCount(self, words):
         characters = 0
         for word in words:
@@ -50,15 +111,11 @@ class TextAnalyzer(object):
     def getWords(self, text=''):
         #Grant
         #text = self._setEncoding(text)
-        words = self.tokenizer.tokenize(text)
         filtered_words = []
-        for word in words:
-            if word in self.special_chars or word == " ":
-                pass
-            else:
-                new_word = word.replace(",","").replace(".","")
-                new_word = new_word.replace("!","").replace("?","")
-                filtered_words.append(new_word)
+        for word in self.tokenizer.iter_tokenize(text):
+            new_word = word.replace(",","").replace(".","")
+            new_word = new_word.replace("!","").replace("?","")
+            filtered_words.append(new_word)
         #print('Filtered words:', filtered_words)
         return filtered_words
 
@@ -66,6 +123,33 @@ class TextAnalyzer(object):
         sentences = self.eng_tokenizer.tokenize(text)
         return sentences
 
+    def getWordsAndSentencesFast(self, text=''):
+        '''
+        Tokenize the text into the same words as getWords(), counting the
+        sentences in the same pass by looking for terminal punctuation.
+        Returns the words, the sentence count and the set of indexes of the
+        words which start a sentence.
+        '''
+        words = []
+        sentenceCount = 0
+        sentenceStartWords = set()
+        atSentenceStart = True
+        for word in self.tokenizer.iter_tokenize(text):
+            new_word = word.replace(",","").replace(".","")
+            new_word = new_word.replace("!","").replace("?","")
+            if atSentenceStart:
+                sentenceStartWords.add(len(words))
+                atSentenceStart = False
+            words.append(new_word)
+            if RE_SENTENCE_END.search(word):
+                lowerWord = word.lower()
+                if word[-1] != '.' or not (lowerWord in FAST_ABBREVIATIONS or RE_INITIAL.match(lowerWord)):
+                    sentenceCount += 1
+                    atSentenceStart = True
+        if not atSentenceStart:
+            sentenceCount += 1
+        return words, sentenceCount, sentenceStartWords
+
     def countSyllables(self, words = []):
         syllableCount = 0
         syllableCounter = {}
@@ -122,3 +206,74 @@ class TextAnalyzer(object):
             except UnicodeError:
                 text = unicode(text, "ascii", "replace").encode("utf8")
         return text
+
+
+def mergeChunkAnalyses(chunks):
+    '''
+    Combine the results of TextAnalyzer.analyzeTextChunk() for each chunk of
+    a text into the same statistics analyzeText() would return for the whole
+    text (less the list of words). Provided the chunks were split at
+    whitespace the word, character, syllable and complex word counts are
+    identical. The sentence count can differ slightly, only where Punkt
+    would have treated text either side of a chunk boundary as a single
+    sentence.
+    '''
+    charCount = wordCount = sentenceCount = syllableCount = 0
+    polysyllableCount = letterCount = familiarWordCount = 0
+    for chunk in chunks:
+        charCount += chunk['charCount']
+        wordCount += chunk['wordCount']
+        sentenceCount += chunk['sentenceCount']
+        syllableCount += chunk['syllableCount']
+        polysyllableCount += chunk['polysyllableCount']
+        letterCount += chunk['letterCount']
+        familiarWordCount += chunk['familiarWordCount']
+    complexwordCount = sum(countChunkComplexWords(chunks))
+
+    averageWordsPerSentence = wordCount/sentenceCount
+    analyzedVars = {}
+    analyzedVars['charCount'] = float(charCount)
+    analyzedVars['wordCount'] = float(wordCount)
+    analyzedVars['sentenceCount'] = float(sentenceCount)
+    analyzedVars['syllableCount'] = float(syllableCount)
+    analyzedVars['complexwordCount'] = float(complexwordCount)
+    analyzedVars['polysyllableCount'] = float(polysyllableCount)
+    analyzedVars['letterCount'] = float(letterCount)
+    analyzedVars['familiarWordCount'] = float(familiarWordCount)
+    analyzedVars['averageWordsPerSentence'] = float(averageWordsPerSentence)
+    printAnalysis(analyzedVars)
+    return analyzedVars
+
+def countChunkComplexWords(chunks):
+    '''
+    Return the number of complex words in each chunk, where a capitalised
+    complex word only counts if a sentence in any of the chunks starts with
+    it. Words contain no whitespace, so this is the same as the word being a
+    prefix of the first token of a sentence.
+    '''
+    sentenceStarts = set()
+    lengths = set()
+    for chunk in chunks:
+        sentenceStarts.update(chunk['sentenceStarts'])
+        lengths.update(len(word) for word in chunk['properComplexWords'])
+    prefixes = set(start[:length] for start in sentenceStarts for length in lengths)
+    counts = []
+    for chunk in chunks:
+        complexwordCount = chunk['complexwordCount']
+        for word, count in chunk['properComplexWords'].iteritems():
+            if word in prefixes:
+                complexwordCount += count
+        counts.append(complexwordCount)
+    return counts
+
+def printAnalysis(analyzedVars):
+    print '\tResults of NLTK text analysis:'
+    print '\t  Number of characters: ' + str(int(analyzedVars['charCount']))
+    print '\t  Number of words: ' + str(int(analyzedVars['wordCount']))
+    print '\t  Number of sentences: ' + str(int(analyzedVars['sentenceCount']))
+    print '\t  Number of syllables: ' + str(int(analyzedVars['syllableCount']))
+    print '\t  Number of complex words: ' + str(int(analyzedVars['complexwordCount']))
+    print '\t  Number of polysyllabic words: ' + str(int(analyzedVars['polysyllableCount']))
+    print '\t  Number of letters: ' + str(int(analyzedVars['letterCount']))
+    print '\t  Number of familiar words: ' + str(int(analyzedVars['familiarWordCount']))
+    print '\t  Average words per sentence: ' + str(int(analyzedVars['averageWordsPerSentence']))
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import os, sys, threading, traceback
+from Queue import Queue, Empty
+from StringIO import StringIO
+from multiprocessing.connection import Listener, Client
+
+from calibre import prints
+from calibre.utils.ipc.server import Server
+from calibre.utils.ipc.job import ParallelJob
+
+# Input formats whose conversion plugins a warm worker loads up front
+PRELOAD_INPUT_FORMATS = ['epub', 'mobi', 'azw3', 'lit', 'pdb', 'rtf', 'txt', 'docx', 'fb2']
+
+# Give up on the pool if this many worker processes in a row die before connecting
+MAX_FAILED_LAUNCHES = 3
+
+
+class PoolNltkPickle(object):
+    '''
+    Stands in for the NLTK data in the arguments of a task run on the
+    WorkerPool, as each worker is sent the data only once rather than with
+    every task
+    '''
+
+
+class ServerExecutor(object):
+    '''
+    Runs each child job in a new worker process which exits once the job
+    has finished, using a calibre Server for the duration of one run.
+    '''
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self.server = Server(pool_size=pool_size)
+        self.jobs = {}
+
+    def submit(self, task_id, func_name, args):
+        job = ParallelJob('arbitrary', str(task_id), done=None,
+                          args=['calibre_plugins.count_pages.jobs', func_name, args])
+        job._task_id = task_id
+        self.jobs[task_id] = job
+        self.server.add_job(job)
+
+    def kill(self, task_id):
+        '''
+        Kill the worker process running a job, which then finishes as failed
+        '''
+        job = self.jobs.get(task_id, None)
+        if job is not None:
+            self.server.kill_job(job)
+
+    def get_finished(self, timeout=None):
+        '''
+        Returns a tuple of (task_id, result, details) for the next job to
+        finish, or None if no job finished within the timeout. The result
+        is None if the job failed.
+        '''
+        try:
+            job = self.server.changed_jobs_queue.get(timeout=timeout)
+        except Empty:
+            return None
+        # A job can 'change' when it is not finished, for example if it
+        # produces a notification. Ignore these.
+        job.update()
+        if not job.is_finished:
+            return None
+        self.jobs.pop(job._task_id, None)
+        return job._task_id, job.result, job.details
+
+    def close(self):
+        self.server.close()
+
+
+class PoolExecutor(object):
+    '''
+    Runs child jobs for one run on the shared WorkerPool, with the same
+    interface as the ServerExecutor.
+    '''
+    def __init__(self, pool):
+        self.pool = pool
+        self.pool_size = pool.pool_size
+        self.results = Queue()
+
+    def submit(self, task_id, func_name, args):
+        nltk_pickle = self.pool.nltk_pickle
+        if nltk_pickle is not None:
+            args = tuple(PoolNltkPickle() if arg is nltk_pickle else arg for arg in args)
+        self.pool.submit(task_id, func_name, args, self.results)
+
+    def kill(self, task_id):
+        self.pool.kill(task_id, self.results)
+
+    def get_finished(self, timeout=None):
+        try:
+            return self.results.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        # Once a run is cancelled or aborted none of its tasks are wanted,
+        # and without the run there is nothing to enforce the time limit on
+        # those still running. After a run finishes there are none left.
+        # The workers stay running for the next run until they are idle
+        # for longer than the pool's idle timeout.
+        self.pool.cancel(self.results)
+
+
+class WorkerPool(object):
+    '''
+    A pool of long lived worker processes which have already imported
+    calibre, the conversion plugins and NLTK, and loaded the Punkt model, so
+    that each book does not pay for launching a new process. Lives in the
+    calibre GUI process and is reused across runs. Each worker stops once
+    there has been no work for it for idle_timeout seconds.
+    '''
+    def __init__(self, pool_size, idle_timeout, nltk_pickle):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.nltk_pickle = nltk_pickle
+        self.tasks = Queue()
+        self.lock = threading.RLock()
+        self.server = self.listener = None
+        self.workers = {}
+        self.busy = {}
+        self.next_worker_id = 0
+        self.failed_launches = 0
+
+    def executor(self):
+        return PoolExecutor(self)
+
+    def submit(self, task_id, func_name, args, results):
+        '''
+        Queue a call of func_name in calibre_plugins.count_pages.jobs. When
+        it finishes (task_id, result, details) is put on the results queue,
+        with a result of None if the worker process died.
+        '''
+        self.tasks.put((task_id, func_name, args, results))
+        with self.lock:
+            if self.listener is None:
+                self._start()
+            while len(self.workers) < self.pool_size:
+                self._launch_worker()
+
+    def kill(self, task_id, results):
+        '''
+        Kill the worker process running this task, which then finishes as
+        failed. A new worker is started in its place if there is more to do.
+        '''
+        with self.lock:
+            for worker_id, task in self.busy.items():
+                if task[0] == task_id and task[3] is results and worker_id in self.workers:
+                    self.server.kill_job(self.workers[worker_id])
+
+    def cancel(self, results):
+        '''
+        Drop the tasks for this results queue not yet started, and kill the
+        worker processes running the rest
+        '''
+        with self.tasks.mutex:
+            remaining = [task for task in self.tasks.queue if task[3] is not results]
+            self.tasks.queue.clear()
+            self.tasks.queue.extend(remaining)
+        with self.lock:
+            if self.server is None:
+                return
+            for worker_id, task in self.busy.items():
+                if task[3] is results and worker_id in self.workers:
+                    self.server.kill_job(self.workers[worker_id])
+
+    def shutdown(self):
+        with self.lock:
+            if self.listener is None:
+                return
+            server, listener = self.server, self.listener
+            self.server = self.listener = None
+            self.workers = {}
+        # Killing the worker processes will end each connection thread
+        server.close()
+        try:
+            listener.close()
+        except:
+            pass
+
+    def _start(self):
+        self.authkey = os.urandom(32)
+        self.listener = Listener(authkey=self.authkey)
+        self.server = Server(pool_size=self.pool_size)
+        for target in (self._accept_connections, self._monitor_workers):
+            t = threading.Thread(target=target, args=(self.server, self.listener),
+                                 name='CountPagesWorkerPool')
+            t.daemon = True
+            t.start()
+
+    def _launch_worker(self):
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        args = ['calibre_plugins.count_pages.pool', 'serve_worker',
+                (self.listener.address, self.authkey, worker_id, self.nltk_pickle)]
+        job = ParallelJob('arbitrary', 'Count Pages worker %d' % worker_id, done=None, args=args)
+        job._worker_id = worker_id
+        job._connected = False
+        job._nltk_pickle = self.nltk_pickle
+        self.workers[worker_id] = job
+        self.server.add_job(job)
+
+    def _accept_connections(self, server, listener):
+        while True:
+            try:
+                conn = listener.accept()
+                worker_id = conn.recv()
+            except:
+                # The listener has been closed by a shutdown
+                return
+            with self.lock:
+                if worker_id in self.workers:
+                    self.workers[worker_id]._connected = True
+                    self.failed_launches = 0
+            t = threading.Thread(target=self._serve_connection, args=(conn, server, worker_id),
+                                 name='CountPagesWorker%d' % worker_id)
+            t.daemon = True
+            t.start()
+
+    def _serve_connection(self, conn, server, worker_id):
+        with self.lock:
+            job = self.workers.get(worker_id, None)
+        # The NLTK data the worker has, only sent again if the pool's changes
+        worker_pickle = job._nltk_pickle if job is not None else None
+        while True:
+            try:
+                task = self.tasks.get(timeout=self.idle_timeout)
+            except Empty:
+                # No work for a while, so let this worker exit
+                try:
+                    conn.send(None)
+                except:
+                    pass
+                break
+            task_id, func_name, args, results = task
+            if self.server is not server:
+                # The pool was shut down while this thread was waiting
+                self.tasks.put(task)
+                break
+            nltk_pickle = None
+            if worker_pickle is not self.nltk_pickle and \
+                    any(isinstance(arg, PoolNltkPickle) for arg in args):
+                nltk_pickle = worker_pickle = self.nltk_pickle
+            self.busy[worker_id] = task
+            try:
+                conn.send((func_name, args, nltk_pickle))
+            except:
+                # The worker died while idle, so leave the task for another
+                self.busy.pop(worker_id, None)
+                self.tasks.put(task)
+                break
+            try:
+                result, details = conn.recv()
+            except:
+                results.put((task_id, None, 'Worker process died while counting statistics'))
+                break
+            finally:
+                self.busy.pop(worker_id, None)
+            results.put((task_id, result, details))
+        conn.close()
+
+    def _monitor_workers(self, server, listener):
+        while self.server is server:
+            try:
+                job = server.changed_jobs_queue.get(timeout=1)
+            except Empty:
+                continue
+            job.update()
+            if not job.is_finished:
+                continue
+            with self.lock:
+                if self.server is not server:
+                    break
+                self.workers.pop(job._worker_id, None)
+                if not job._connected:
+                    self.failed_launches += 1
+                    prints('Count Pages worker failed to start:')
+                    prints(job.details)
+                if self.failed_launches >= MAX_FAILED_LAUNCHES:
+                    self._fail_queued_tasks()
+                elif not self.tasks.empty():
+                    while len(self.workers) < self.pool_size:
+                        self._launch_worker()
+                elif not self.workers:
+                    # Every worker has stopped through being idle
+                    self.shutdown()
+
+    def _fail_queued_tasks(self):
+        while True:
+            try:
+                task_id, func_name, args, results = self.tasks.get_nowait()
+            except Empty:
+                break
+            results.put((task_id, None, 'Unable to start worker processes'))
+        self.failed_launches = 0
+
+
+def serve_worker(address, authkey, worker_id, nltk_pickle):
+    '''
+    Child job, which stays running to run one child job after another as
+    they are sent to it by the WorkerPool, until it is told to stop or the
+    pool goes away.
+    '''
+    _preload_worker(nltk_pickle)
+    import calibre_plugins.count_pages.jobs as jobs
+
+    conn = Client(address, authkey=authkey)
+    conn.send(worker_id)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        func_name, args, new_pickle = task
+        if new_pickle is not None:
+            nltk_pickle = new_pickle
+        args = [nltk_pickle if isinstance(arg, PoolNltkPickle) else arg for arg in args]
+        # Capture the output of the job to return as its details, as the
+        # worker's own log covers every job it has run
+        output = StringIO()
+        old_stdout = sys.stdout
+        sys.stdout = output
+        try:
+            result = getattr(jobs, func_name)(*args)
+        except:
+            traceback.print_exc(file=output)
+            result = None
+        finally:
+            sys.stdout = old_stdout
+        conn.send((result, output.getvalue()))
+    conn.close()
+
+
+def _preload_worker(nltk_pickle):
+    '''
+    Import everything a book might need up front, so it is only done once
+    '''
+    import lxml.html
+    import calibre.ebooks.oeb.iterator
+    import calibre.ebooks.conversion.plumber
+    from calibre.customize.ui import plugin_for_input_format
+    for fmt in PRELOAD_INPUT_FORMATS:
+        plugin_for_input_format(fmt)
+    from calibre_plugins.count_pages.statistics import get_text_analyzer
+    get_text_analyzer(nltk_pickle)
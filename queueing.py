@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__   = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import os, traceback
+from collections import OrderedDict
+from threading import Thread, Lock
+from Queue import Queue, Empty
+
+from calibre.constants import islinux
+from calibre.utils.config import prefs
+
+import calibre_plugins.count_pages.config as cfg
+from calibre_plugins.count_pages.scheduler import plan_formats
+from calibre_plugins.count_pages.fingerprints import (get_file_fingerprint, get_format_version,
+                                                      fingerprints_match)
+
+# How many books to read from the library and copy at the same time
+QUEUEING_THREADS = 4
+
+# The ioctl to share the data of one file with another on filesystems such
+# as btrfs and XFS, from linux/fs.h
+FICLONE = 0x40049409
+
+def link_file(source, dest):
+    '''
+    Make dest a hard link to or a copy-on-write clone of source, returning
+    False if the filesystem cannot do either
+    '''
+    try:
+        os.link(source, dest)
+        return True
+    except (AttributeError, OSError):
+        # Windows has no os.link, and links cannot cross filesystems
+        pass
+    if islinux:
+        import fcntl
+        try:
+            with open(source, 'rb') as src, open(dest, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return True
+        except (IOError, OSError):
+            if os.path.exists(dest):
+                os.remove(dest)
+    return False
+
+
+class BookQueuer(object):
+    '''
+    Works out which statistics to count for each book and which format to
+    count them from, on background threads so that calibre stays responsive.
+    Each book is put on the books queue as soon as it is ready, so counting
+    can start while the remaining books are being queued, with None put
+    once every book has been visited.
+
+    Statistics last counted from a format file which has not changed since,
+    using the same algorithm, are skipped unless force_recount is set. The
+    fingerprints of the files the other statistics are counted from are kept
+    to be recorded once they are stored.
+    '''
+    def __init__(self, db, book_ids, tdir, statistics_cols_map, use_goodreads,
+                 overwrite_existing, book_handoff, fingerprint_store, versions,
+                 force_recount, finished):
+        self.db, self.book_ids, self.tdir = db, book_ids, tdir
+        self.statistics_cols_map = statistics_cols_map
+        self.use_goodreads = use_goodreads
+        self.overwrite_existing = overwrite_existing
+        self.book_handoff = book_handoff
+        self.fingerprint_store = fingerprint_store
+        self.versions = versions
+        self.force_recount = force_recount
+        self.finished = finished
+        self.books = Queue()
+        self.queued = 0
+        self.bad = OrderedDict()
+        self.fingerprints = {}
+        self.input_order = [f.lower() for f in prefs['input_format_order']]
+        self.labels_map = dict((col_name, db.field_metadata.key_to_label(col_name))
+                               for col_name in statistics_cols_map.itervalues() if col_name)
+        self.lock = Lock()
+
+    def start(self, abort):
+        '''
+        Start queueing the books, stopping early if the abort event is set
+        '''
+        self.prefetch()
+        self.pending = Queue()
+        for book_id in self.book_ids:
+            self.pending.put(book_id)
+        self.running = min(QUEUEING_THREADS, len(self.book_ids))
+        if not self.running:
+            # No threads to put None once done, so there is nothing to count
+            self.finished(self)
+            self.books.put(None)
+            return
+        for i in range(self.running):
+            t = Thread(target=self.queue_books, args=(abort,), name='CountPagesQueueing')
+            t.daemon = True
+            t.start()
+
+    def prefetch(self):
+        '''
+        Read everything queue_book needs to know about the books from the
+        library at once, rather than looking up each column of each book
+        separately. This is done before the queueing threads start, as the
+        library's cache of book metadata is only read on the GUI thread.
+        '''
+        db, fm = self.db, self.db.FIELD_MAP
+        col_indexes = dict((col_name, fm[db.custom_column_label_map[lbl]['num']])
+                           for col_name, lbl in self.labels_map.iteritems())
+        self.titles, self.existing, self.formats, book_dirs = {}, {}, {}, {}
+        for book_id in self.book_ids:
+            if not db.data.has_id(book_id):
+                # Deleted since being selected
+                continue
+            row = db.data._data[book_id]
+            self.titles[book_id] = row[fm['title']]
+            self.existing[book_id] = dict((col_name, row[idx])
+                                          for col_name, idx in col_indexes.iteritems())
+            formats = row[fm['formats']]
+            self.formats[book_id] = [f.lower() for f in formats.split(',')] if formats else []
+            book_dirs[book_id] = os.path.join(db.library_path, row[fm['path']].replace('/', os.sep))
+        # Where each format file is, worked out as the library itself does,
+        # so that the queueing threads need not ask the library for each one
+        self.sizes, self.paths = {}, {}
+        for book_id, fmt, size, name in db.conn.get(
+                'SELECT book, format, uncompressed_size, name FROM data'):
+            if book_id in self.titles:
+                fmt = fmt.lower()
+                self.sizes.setdefault(book_id, {})[fmt] = size or 0
+                self.paths.setdefault(book_id, {})[fmt] = os.path.join(book_dirs[book_id],
+                                                                        name + '.' + fmt)
+        self.previous_fingerprints = self.fingerprint_store.get(self.book_ids)
+        self.goodreads_ids = {}
+        if self.use_goodreads and self.statistics_cols_map.get(cfg.STATISTIC_PAGE_COUNT):
+            wanted = set(self.book_ids)
+            for book_id, val in db.conn.get('SELECT book, val FROM identifiers WHERE type=?',
+                                           ('goodreads',)):
+                if book_id in wanted:
+                    self.goodreads_ids[book_id] = val
+
+    def queue_books(self, abort):
+        while not abort.is_set():
+            try:
+                book_id = self.pending.get_nowait()
+            except Empty:
+                break
+            try:
+                book = self.queue_book(book_id)
+                if book is not None:
+                    with self.lock:
+                        self.queued += 1
+                    self.books.put(book)
+            except:
+                traceback.print_exc()
+                self.skip_book(book_id, traceback.format_exc())
+        with self.lock:
+            self.running -= 1
+            if self.running > 0:
+                return
+        # The skipped books are passed on before the run can see it is over
+        self.finished(self)
+        self.books.put(None)
+
+    def skip_book(self, book_id, reason):
+        # Books are skipped by all the queueing threads at once
+        with self.lock:
+            self.bad[book_id] = reason
+
+    def queue_book(self, book_id):
+        '''
+        Returns the tuple of the statistics to count for the book and where
+        to count them from, with the separate file to read the page count from
+        if there is one, or None if there is nothing to count
+        '''
+        if book_id not in self.titles:
+            self.skip_book(book_id, 'Book is no longer in the library')
+            return None
+        title = self.titles[book_id]
+
+        statistics_to_run = []
+        existing = self.existing[book_id]
+        for statistic, col_name in self.statistics_cols_map.iteritems():
+            if not col_name:
+                continue
+            existing_val = existing[col_name]
+            if self.overwrite_existing or existing_val is None or existing_val == 0:
+                statistics_to_run.append(statistic)
+
+        if not self.overwrite_existing:
+            # Since we are not forcing overwriting an existing value we need
+            # to check whether this book has an existing value in each column.
+            # No point in performing statistics if book already has values.
+            if not statistics_to_run:
+                self.skip_book(book_id, 'Book already has all statistics and overwrite is turned off')
+                return None
+
+        goodreads_id = None
+        if cfg.STATISTIC_PAGE_COUNT in statistics_to_run and self.use_goodreads:
+            # We will be attempting to download a page count from goodreads
+            goodreads_id = self.goodreads_ids.get(book_id, None)
+            if not goodreads_id:
+                # No point in continuing with this book
+                self.skip_book(book_id, 'No goodreads id')
+                return None
+            elif len(statistics_to_run) == 1:
+                # Since not counting anything else, we have all we need at this point to continue
+                return (book_id, title, None, goodreads_id, statistics_to_run, None)
+
+        statistics_from_formats = list(statistics_to_run)
+        if goodreads_id:
+            statistics_from_formats.remove(cfg.STATISTIC_PAGE_COUNT)
+        book_formats = self.formats[book_id]
+        input_formats = [f for f in self.input_order if f in book_formats]
+        while True:
+            pages_fmt, text_fmt = plan_formats(input_formats, self.sizes.get(book_id, {}),
+                                               statistics_from_formats)
+            if pages_fmt is None and text_fmt is None:
+                # If we didn't find a compatible format, we absolutely needed one
+                self.skip_book(book_id, 'No convertible format found')
+                return None
+            missing = [f for f in set([pages_fmt, text_fmt])
+                       if f and self.format_path(book_id, f) is None]
+            if not missing:
+                break
+            # Plan again without the formats whose files are missing
+            input_formats = [f for f in input_formats if f not in missing]
+
+        # Leave out statistics there is no format to count from, such as the
+        # text statistics of a book which only has comic formats
+        statistics_from_formats = [s for s in statistics_from_formats
+                                   if (pages_fmt if s == cfg.STATISTIC_PAGE_COUNT else text_fmt)]
+        if not statistics_from_formats and not goodreads_id:
+            self.skip_book(book_id, 'No convertible format found')
+            return None
+        stored = set(s for s in statistics_from_formats
+                     if existing[self.statistics_cols_map[s]] not in (None, 0))
+        statistics_from_formats = self.check_fingerprints(book_id, statistics_from_formats,
+                                                          pages_fmt, text_fmt, stored)
+        if not statistics_from_formats:
+            if not goodreads_id:
+                self.skip_book(book_id, 'Book has not changed since its statistics were counted')
+                return None
+            return (book_id, title, None, goodreads_id, [cfg.STATISTIC_PAGE_COUNT], None)
+        if goodreads_id:
+            statistics_to_run = [cfg.STATISTIC_PAGE_COUNT] + statistics_from_formats
+        else:
+            statistics_to_run = statistics_from_formats
+        if cfg.STATISTIC_PAGE_COUNT not in statistics_from_formats:
+            pages_fmt = None
+        if not set(statistics_from_formats) - set([cfg.STATISTIC_PAGE_COUNT]):
+            text_fmt = None
+
+        book_path = self.get_book_file(book_id, text_fmt or pages_fmt)
+        pages_path = None
+        if pages_fmt and text_fmt and pages_fmt != text_fmt:
+            # Cheaper to read the page count from another format
+            pages_path = self.get_book_file(book_id, pages_fmt)
+        return (book_id, title, book_path, goodreads_id, statistics_to_run, pages_path)
+
+    def check_fingerprints(self, book_id, statistics, pages_fmt, text_fmt, stored):
+        '''
+        Returns which of the statistics need counting, leaving out those of
+        the stored statistics last counted from the same format file with the
+        same algorithm
+        '''
+        previous = self.previous_fingerprints.get(book_id, {})
+        file_fingerprints, fingerprints, to_count = {}, {}, []
+        for statistic in statistics:
+            fmt = pages_fmt if statistic == cfg.STATISTIC_PAGE_COUNT else text_fmt
+            prev_fmt, prev_fingerprint, prev_version = previous.get(statistic, (None, None, None))
+            if fmt not in file_fingerprints:
+                path = self.format_path(book_id, fmt)
+                file_fingerprints[fmt] = get_file_fingerprint(path,
+                                            prev_fingerprint if prev_fmt == fmt else None)
+            fingerprint = file_fingerprints[fmt]
+            version = get_format_version(self.versions, statistic, fmt)
+            fingerprints[statistic] = (fmt, fingerprint, version)
+            if self.force_recount or statistic not in stored or prev_fmt != fmt or \
+                    prev_version != version or \
+                    not fingerprints_match(fingerprint, prev_fingerprint):
+                to_count.append(statistic)
+        self.fingerprints[book_id] = fingerprints
+        return to_count
+
+    def format_path(self, book_id, fmt):
+        '''
+        The path of this format of the book, or None if its file is missing
+        '''
+        path = self.paths.get(book_id, {}).get(fmt, None)
+        if path is not None and os.path.exists(path):
+            return path
+        return None
+
+    def get_book_file(self, book_id, fmt):
+        '''
+        The path for the workers to read this format of the book from. Nothing
+        the workers do changes the book, so unless asked to copy it this only
+        makes a copy if the library cannot give a path to the book itself.
+        '''
+        path = None
+        if self.book_handoff != cfg.HANDOFF_COPY:
+            path = self.format_path(book_id, fmt)
+            if path and self.book_handoff == cfg.HANDOFF_DIRECT:
+                return path
+        # Copy or link the book to the temp directory, using book id as filename
+        dest_file = os.path.join(self.tdir, '%d.%s'%(book_id, fmt.lower()))
+        if self.book_handoff == cfg.HANDOFF_LINK and path and link_file(path, dest_file):
+            return dest_file
+        with open(dest_file, 'w+b') as f:
+            self.db.copy_format_to(book_id, fmt, f, index_is_id=True)
+        return dest_file
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import os, time, heapq
+
+import calibre_plugins.count_pages.config as cfg
+from calibre_plugins.count_pages.sysinfo import get_available_memory_mb, get_idle_cpus
+
+# Rough estimates in seconds of the work to count statistics for a book,
+# before correcting by how long books of the same kind took in past runs
+COST_READ_PAGE_COUNT = 0.2
+COST_CONVERT_BOOK = 1.0
+COST_CONVERT_PER_MB = 2.0
+COST_READABILITY_PER_MB = 2.0
+# How much slower each format is to convert than an EPUB
+FORMAT_COST = { '.epub': 1.0, '.mobi': 1.2, '.azw': 1.2, '.azw3': 1.2, '.prc': 1.2,
+                '.lit': 1.5, '.rtf': 1.5, '.txt': 0.5, '.pdf': 3.0 }
+# Formats whose page count is read from the file rather than by converting it,
+# and those with no text to count anything else from
+NATIVE_PAGE_COUNT_FORMATS = ['pdf', 'cbz', 'cbr']
+COMIC_FORMATS = ['cbz', 'cbr']
+# Rough estimates in MB of the memory a worker needs to count a book
+MEMORY_READ_PAGE_COUNT = 50
+MEMORY_CONVERT_BOOK = 150
+MEMORY_CONVERT_PER_MB = 30
+# Weight given to each new observation of how long a kind of book took
+COST_MODEL_SMOOTHING = 0.2
+
+# The most work to put in one child job, and the most books
+BATCH_MAX_COST = 10.0
+BATCH_MAX_BOOKS = 50
+
+# Cores left for calibre itself, and memory in MB left free for everything else
+RESERVED_CPUS = 1
+RESERVED_MEMORY = 512
+# How long in seconds a newly started job takes to allocate the memory it
+# needs, during which its estimate is counted against the available memory
+MEMORY_SETTLE_TIME = 30
+
+
+def plan_formats(formats, sizes, statistics_to_run):
+    '''
+    Choose which of a book's formats, given in the user's order of preference,
+    to count the statistics from. Returns a tuple of the format to read the
+    page count from and the format to count the other statistics from, either
+    of which is None if there is nothing to count it from.
+
+    The page count is read directly from a PDF or comic if the book has one,
+    as that is both exact and cheap, even when the other statistics need a
+    different format converted. Otherwise the format cheapest to convert for
+    its size is used, preferring the earlier format where there is no
+    difference.
+    '''
+    def conversion_cost(fmt):
+        size_mb = sizes.get(fmt, 1024 * 1024) / (1024 * 1024)
+        return FORMAT_COST.get('.' + fmt, 1.0) * (COST_CONVERT_BOOK + COST_CONVERT_PER_MB * size_mb)
+    convertible = [fmt for fmt in formats if fmt not in COMIC_FORMATS]
+    cheapest = min(convertible, key=conversion_cost) if convertible else None
+    pages_fmt = text_fmt = None
+    if cfg.STATISTIC_PAGE_COUNT in statistics_to_run:
+        native = [fmt for fmt in formats if fmt in NATIVE_PAGE_COUNT_FORMATS]
+        pages_fmt = native[0] if native else cheapest
+    if set(statistics_to_run) - set([cfg.STATISTIC_PAGE_COUNT]):
+        text_fmt = cheapest
+    return pages_fmt, text_fmt
+
+
+class CostModel(object):
+    '''
+    Estimates the seconds of work to count statistics for a book from its
+    format and size, corrected by how long books of the same kind actually
+    took in previous runs.
+    '''
+    def __init__(self):
+        self.factors = dict(cfg.plugin_prefs[cfg.COST_MODEL_STORE_NAME])
+
+    def estimate(self, book_path, statistics_to_run, use_goodreads):
+        '''
+        Returns a tuple of (kind, cost, memory, needs_conversion) for the book
+        '''
+        page_count_only = list(statistics_to_run) == [cfg.STATISTIC_PAGE_COUNT]
+        extension = ''
+        if book_path:
+            extension = os.path.splitext(book_path)[1].lower()
+        if not book_path or (page_count_only and use_goodreads):
+            kind, cost = 'download', COST_READ_PAGE_COUNT
+        elif extension in ['.cbr', '.cbz'] or (page_count_only and extension == '.pdf'):
+            kind, cost = 'read', COST_READ_PAGE_COUNT
+        else:
+            try:
+                size_mb = os.path.getsize(book_path) / (1024 * 1024)
+            except OSError:
+                size_mb = 1
+            kind = extension
+            per_mb = COST_CONVERT_PER_MB
+            if set(statistics_to_run) - set([cfg.STATISTIC_PAGE_COUNT, cfg.STATISTIC_WORD_COUNT]):
+                # Readability statistics need the text analysed too
+                kind += '+readability'
+                per_mb += COST_READABILITY_PER_MB
+            cost = FORMAT_COST.get(extension, 1.0) * (COST_CONVERT_BOOK + per_mb * size_mb)
+            memory = MEMORY_CONVERT_BOOK + MEMORY_CONVERT_PER_MB * size_mb
+            return kind, cost * self.factors.get(kind, 1.0), memory, True
+        return kind, cost * self.factors.get(kind, 1.0), MEMORY_READ_PAGE_COUNT, False
+
+    def observe(self, kind, estimate, actual):
+        '''
+        Record that a book estimated to cost this much actually took this long
+        '''
+        factor = self.factors.get(kind, 1.0)
+        if estimate > 0 and actual > 0:
+            ratio = factor * actual / estimate
+            self.factors[kind] = (1 - COST_MODEL_SMOOTHING) * factor + COST_MODEL_SMOOTHING * ratio
+
+    def save(self):
+        cfg.plugin_prefs[cfg.COST_MODEL_STORE_NAME] = self.factors
+
+
+class Batch(object):
+    '''
+    One or more books counted in turn by a single child job
+    '''
+    def __init__(self, books, estimates, memory, needs_conversion):
+        self.books = books
+        self.estimates = estimates
+        self.needs_conversion = needs_conversion
+        self.cost = sum(cost for kind, cost in estimates)
+        # The books are counted one at a time, so need the memory of the largest
+        self.memory = max(memory)
+        self.book_memory = memory
+
+
+class Scheduler(object):
+    '''
+    Decides the order in which to hand batches of books to the workers.
+
+    Books needing a conversion are handed out largest first, so that the
+    run does not end waiting on one huge book that happened to be selected
+    last. One worker is kept for cheap books, such as comics and PDF page
+    counts, which are handed out cheapest first so that results start to
+    appear straight away. Books can be added at any time, with batches made
+    up from the books waiting as each is handed out.
+    '''
+    def __init__(self, use_goodreads, pool_size, model):
+        self.use_goodreads = use_goodreads
+        self.pool_size = pool_size
+        self.model = model
+        self.light, self.heavy = [], []
+        # Batches to hand out before any others, as they are being retried
+        self.ready = []
+        self.total_cost = 0
+
+    def add_books(self, books):
+        for book in books:
+            book_id, title, book_path, goodreads_id, statistics_to_run, pages_path = book
+            kind, cost, memory, needs_conversion = self.model.estimate(book_path, statistics_to_run,
+                                                                       self.use_goodreads)
+            (self.heavy if needs_conversion else self.light).append((cost, kind, memory, book))
+            self.total_cost += cost
+        self.light.sort(key=lambda b: b[0])
+        self.heavy.sort(key=lambda b: b[0], reverse=True)
+
+    def has_batches(self):
+        return bool(self.ready or self.light or self.heavy)
+
+    def remaining_cost(self):
+        return sum(b.cost for b in self.ready) + sum(b[0] for b in self.light) + \
+               sum(b[0] for b in self.heavy)
+
+    def next_batch(self, running):
+        '''
+        Returns the next batch to start given the batches already running,
+        or None if there are none left
+        '''
+        if self.ready:
+            return self.ready.pop(0)
+        return self._take_batch(self.light, self.heavy, running)
+
+    def _take_batch(self, light, heavy, running):
+        running_heavy = len([b for b in running if b.needs_conversion])
+        if heavy and (not light or running_heavy < self.pool_size - 1):
+            books, needs_conversion = heavy, True
+        elif light:
+            books, needs_conversion = light, False
+        else:
+            return None
+        # Keep to several batches per worker, so a few expensive batches
+        # cannot leave the other workers with nothing to do at the end
+        max_cost = min(BATCH_MAX_COST, self.total_cost / (4 * self.pool_size))
+        batch, estimates, memory, batch_cost = [], [], [], 0
+        while books and len(batch) < BATCH_MAX_BOOKS:
+            cost, kind, book_memory, book = books[0]
+            if batch and batch_cost + cost > max_cost:
+                break
+            del books[0]
+            batch.append(book)
+            estimates.append((kind, cost))
+            memory.append(book_memory)
+            batch_cost += cost
+        return Batch(batch, estimates, memory, needs_conversion)
+
+    def put_back(self, batch):
+        '''
+        Return a batch not started after all, to be the next one handed out
+        '''
+        self.ready.insert(0, batch)
+
+    def retry_separately(self, batch):
+        '''
+        Put each book of a failed batch back to be retried in a batch of its own
+        '''
+        self.ready[0:0] = [Batch([book], [estimate], [memory], batch.needs_conversion)
+                           for book, estimate, memory in zip(batch.books, batch.estimates,
+                                                             batch.book_memory)]
+
+    def predicted_elapsed(self):
+        '''
+        Simulate handing out the remaining batches to the workers in order to
+        predict how much longer the run will take
+        '''
+        ready, light, heavy = list(self.ready), list(self.light), list(self.heavy)
+        workers = [(0, i, None) for i in range(self.pool_size)]
+        finish = 0
+        while ready or light or heavy:
+            now, i, batch = heapq.heappop(workers)
+            if ready:
+                batch = ready.pop(0)
+            else:
+                batch = self._take_batch(light, heavy, [w[2] for w in workers if w[2] is not None])
+            finish = max(finish, now + batch.cost)
+            heapq.heappush(workers, (now + batch.cost, i, batch))
+        return finish
+
+
+class ConcurrencyController(object):
+    '''
+    Decides whether there is room to start another job, keeping within the
+    cores not needed by calibre itself or busy with other programs, and the
+    memory available without swapping. A job is always started if none are
+    running, so that a run cannot stall.
+    '''
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.recently_started = []
+
+    def can_start(self, running, batch):
+        '''
+        Returns None if the batch can be started now, otherwise the reason why not
+        '''
+        if not running:
+            self._started(batch)
+            return None
+        if len(running) >= self.max_workers:
+            return 'all workers busy'
+        # The load average counts our own running workers, but lags behind
+        # them starting, so count them as busy cores either way
+        cpus = get_idle_cpus() + len(running)
+        if len(running) >= cpus - RESERVED_CPUS:
+            return 'processor cores busy'
+        available = get_available_memory_mb()
+        if available is not None:
+            now = time.time()
+            self.recently_started = [(started, memory) for started, memory in self.recently_started
+                                     if now - started < MEMORY_SETTLE_TIME]
+            available -= sum(memory for started, memory in self.recently_started)
+            if available - RESERVED_MEMORY < batch.memory:
+                return 'not enough memory available'
+        self._started(batch)
+        return None
+
+    def _started(self, batch):
+        self.recently_started.append((time.time(), batch.memory))
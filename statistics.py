@@ -7,22 +7,40 @@ __license__ = 'GPL v3'
 __copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
 __docformat__ = 'restructuredtext en'
 
-import re, os, shutil
+import re, os, shutil, random, math
 
 from calibre import prints
-from calibre.ebooks.oeb.iterator import EbookIterator
-from calibre.utils.ipc.simple_worker import fork_job, WorkerError
 
-from calibre_plugins.count_pages.nltk_lite.textanalyzer import TextAnalyzer
+import calibre_plugins.count_pages.constants as const
+from calibre_plugins.count_pages.sysinfo import get_idle_cpus
+
+# The conversion pipeline and the text analysis are only imported by the
+# statistics that need them, so that for instance a worker counting the
+# pages of comics never loads them
 
 RE_HTML_BODY = re.compile(u'<body[^>]*>(.*)</body>', re.UNICODE | re.DOTALL | re.IGNORECASE)
 RE_STRIP_MARKUP = re.compile(u'<[^>]+>', re.UNICODE)
+RE_WORD_CHAR = re.compile(r'\w', re.UNICODE)
+RE_PARAGRAPH_BREAK = re.compile(u'\s*\n\s*', re.UNICODE)
+
+# Books with more text than this are split into chunks for the readability
+# text analysis, with the chunks analysed in a small pool of processes.
+PARALLEL_ANALYSIS_MIN_CHARS = 2000000
+PARALLEL_ANALYSIS_CHUNK_CHARS = 500000
+PARALLEL_ANALYSIS_MAX_PROCESSES = 4
+
+# When sampling for readability, paragraphs are drawn evenly from this many
+# sections of the book, and the confidence interval of the statistics is
+# estimated by bootstrap resampling of the sampled paragraphs.
+SAMPLE_STRATA = 20
+BOOTSTRAP_RESAMPLES = 200
 
 def get_pdf_page_count(book_path):
     '''
     Optimisation to read the actual page count for PDFs from the PDF itself.
     '''
     from calibre.ptempfile import TemporaryDirectory
+    from calibre.utils.ipc.simple_worker import fork_job, WorkerError
     with TemporaryDirectory('_pages_pdf') as pdfpath:
         pdf_copy = os.path.join(pdfpath, 'src.pdf')
         shutil.copyfile(book_path, pdf_copy)
@@ -80,6 +98,7 @@ def _open_epub_file(book_path, strip_html=False):
     '''
     Given a path to an EPUB file, read the contents into a giant block of text
     '''
+    from calibre.ebooks.oeb.iterator import EbookIterator
     iterator = EbookIterator(book_path)
     iterator.__enter__(only_input_plugin=True, run_char_count=True,
             read_anchor_map=False)
@@ -212,6 +231,13 @@ def _read_epub_contents(iterator, strip_html=False):
     '''
     Given an iterator for an ePub file, read the contents into a giant block of text
     '''
+    return ''.join(_read_epub_files(iterator, strip_html))
+
+
+def _read_epub_files(iterator, strip_html=False):
+    '''
+    Given an iterator for an ePub file, read the contents of each file in the spine
+    '''
     book_files = []
     for path in iterator.spine:
         with open(path, 'rb') as f:
@@ -220,7 +246,7 @@ def _read_epub_contents(iterator, strip_html=False):
                 html = unicode(_extract_body_text(html)).strip()
                 #print('FOUND HTML:', html)
         book_files.append(html)
-    return ''.join(book_files)
+    return book_files
 
 
 def _extract_body_text(data):
@@ -265,7 +291,20 @@ def get_cbz_page_count(book_path):
 #    Readability Statistics Functions
 # ---------------------------------------------------------
 
-def get_text_analysis(iterator, book_path, nltk_pickle):
+# The last analyzer created, as a worker process kept running between books
+# would otherwise unpickle the Punkt model again for every book
+_text_analyzer_cache = [None, None]
+
+def get_text_analyzer(nltk_pickle):
+    from calibre_plugins.count_pages.nltk_lite.textanalyzer import TextAnalyzer
+    if nltk_pickle is None:
+        return TextAnalyzer(None)
+    if _text_analyzer_cache[0] != nltk_pickle:
+        _text_analyzer_cache[1] = TextAnalyzer(nltk_pickle)
+        _text_analyzer_cache[0] = nltk_pickle
+    return _text_analyzer_cache[1]
+
+def get_text_analysis(iterator, book_path, nltk_pickle, readability_options=None):
     '''
     Given an iterator for the epub (if already opened/converted), perform text
     analysis using NLTK to produce a dictionary of analysed statistics for
@@ -275,32 +314,267 @@ def get_text_analysis(iterator, book_path, nltk_pickle):
     if iterator is None:
         iterator = _open_epub_file(book_path)
 
-    epub_html = _read_epub_contents(iterator, strip_html=True)
+    book_files = _read_epub_files(iterator, strip_html=True)
+
+    algorithm = 0
+    if readability_options:
+        algorithm = readability_options[const.KEY_READABILITY_ALGORITHM]
+    # The fast algorithm counts sentences without using Punkt
+    fast = algorithm == 2
+
+    if algorithm == 1:
+        text_analysis = _get_text_analysis_sampled(book_files, nltk_pickle,
+                                readability_options[const.KEY_READABILITY_SAMPLE_WORDS],
+                                readability_options[const.KEY_READABILITY_MAX_INTERVAL])
+        if text_analysis is not None:
+            return iterator, text_analysis
+
     # Lets ignore any html content files less than 500 characters to hopefully
     # stop any skewing of results caused by cover pages etc.
     #epub_html = [h for h in epub_html if len(h) > 500]
-    text = ''.join(epub_html).strip()
-    # TODO: Do not analyse the WHOLE book - just a portion should be sufficient???
+    text = ''.join(book_files).strip()
+
+    if len(text) >= PARALLEL_ANALYSIS_MIN_CHARS:
+        text_analysis = _get_text_analysis_parallel(text, nltk_pickle, fast)
+        if text_analysis is not None:
+            return iterator, text_analysis
 
-    t = TextAnalyzer(nltk_pickle)
-    text_analysis = t.analyzeText(text)
+    t = get_text_analyzer(None if fast else nltk_pickle)
+    text_analysis = t.analyzeText(text, fast)
     return iterator, text_analysis
 
+def _get_text_analysis_sampled(book_files, nltk_pickle, sample_words, max_interval):
+    '''
+    Estimate the text analysis from a stratified sample of paragraphs drawn
+    from throughout the spine, up to sample_words words. Returns None if the
+    book is too short to be worth sampling, or if the 95% confidence interval
+    of the Flesch-Kincaid Grade is wider than max_interval, in which case the
+    whole text should be analysed instead.
+    '''
+    t = get_text_analyzer(nltk_pickle)
+    paragraphs = []
+    for html in book_files:
+        for paragraph in RE_PARAGRAPH_BREAK.split(html):
+            words = t.tokenizer.count_tokens(paragraph)
+            if words:
+                paragraphs.append((paragraph, words))
+    total_words = sum(words for paragraph, words in paragraphs)
+    if total_words <= sample_words * 2:
+        return None
+
+    # Split the paragraphs into strata of equal word counts, then randomly
+    # choose paragraphs within each stratum until it has its share of words.
+    # Seeded from the book so that recounting a book gives the same result.
+    rand = random.Random(total_words)
+    strata = [[] for i in xrange(SAMPLE_STRATA)]
+    running_words = 0
+    for paragraph, words in paragraphs:
+        strata[min(running_words * SAMPLE_STRATA // total_words, SAMPLE_STRATA - 1)].append((paragraph, words))
+        running_words += words
+    stratum_words = sample_words // SAMPLE_STRATA
+    sample = []
+    for stratum in strata:
+        rand.shuffle(stratum)
+        words_taken = 0
+        for paragraph, words in stratum:
+            if words_taken >= stratum_words:
+                break
+            sample.append(paragraph)
+            words_taken += words
+
+    from calibre_plugins.count_pages.nltk_lite.textanalyzer import (mergeChunkAnalyses,
+                                                                   countChunkComplexWords)
+    units = [t.analyzeTextChunk(paragraph) for paragraph in sample]
+    complex_counts = countChunkComplexWords(units)
+    unit_counts = [tuple(u[k] for k in BOOTSTRAP_COUNTS[:-1]) + (c,)
+                   for u, c in zip(units, complex_counts)]
+
+    estimates = []
+    for i in xrange(BOOTSTRAP_RESAMPLES):
+        resample = [rand.choice(unit_counts) for u in unit_counts]
+        estimates.append(_get_readability_scores([sum(c) for c in zip(*resample)]))
+    print('\tSampled %d of %d words from %d paragraphs' % (
+                sum(u[0] for u in unit_counts), total_words, len(unit_counts)))
+    intervals = []
+    for i, (name, formula) in enumerate(READABILITY_FORMULAS):
+        scores = sorted(e[i] for e in estimates)
+        low = scores[int(0.025 * len(scores))]
+        high = scores[int(0.975 * len(scores)) - 1]
+        intervals.append(high - low)
+        print('\t  %s 95%% confidence interval: %.1f - %.1f' % (name, low, high))
+    if intervals[1] > max_interval:
+        print('\tSample confidence interval is wider than %.1f grades, analysing full text' % max_interval)
+        return None
+
+    return mergeChunkAnalyses(units)
+
+def _get_readability_scores(counts):
+    text_analysis = dict((k, float(v)) for k, v in zip(BOOTSTRAP_COUNTS, counts))
+    text_analysis['sentenceCount'] = max(text_analysis['sentenceCount'], 1.0)
+    text_analysis['averageWordsPerSentence'] = float(counts[0] // text_analysis['sentenceCount'])
+    return [formula(text_analysis) for name, formula in READABILITY_FORMULAS]
+
+def get_text_analysis_for_chunk(text, nltk_pickle, fast=False):
+    '''
+    Child job, to perform the text analysis for one chunk of a large book
+    '''
+    t = get_text_analyzer(None if fast else nltk_pickle)
+    return t.analyzeTextChunk(text, fast)
+
+def _get_text_analysis_parallel(text, nltk_pickle, fast=False):
+    '''
+    For very large books, split the text into chunks and analyse each chunk
+    in a separate process, merging the results. All counts match a serial
+    analysis except the sentence count, which can differ by at most one per
+    chunk boundary. Returns None if the serial analysis should be used instead.
+    '''
+    from calibre.utils.ipc.server import Server
+    from calibre.utils.ipc.job import ParallelJob
+    from calibre_plugins.count_pages.nltk_lite.textanalyzer import mergeChunkAnalyses
+
+    chunks = _split_text_for_analysis(text, PARALLEL_ANALYSIS_CHUNK_CHARS)
+    if len(chunks) < 2:
+        return None
+    # Only use the cores other workers are not already busy with. This
+    # process is counted as busy but will just be waiting for the chunks.
+    pool_size = min(len(chunks), PARALLEL_ANALYSIS_MAX_PROCESSES, get_idle_cpus() + 1)
+    if pool_size < 2:
+        return None
+    print('\tAnalysing text in %d chunks using %d processes' % (len(chunks), pool_size))
+
+    server = Server(pool_size=pool_size)
+    try:
+        for i, chunk in enumerate(chunks):
+            args = ['calibre_plugins.count_pages.statistics', 'get_text_analysis_for_chunk',
+                    (chunk, nltk_pickle, fast)]
+            job = ParallelJob('arbitrary', 'chunk %d' % i, done=None, args=args)
+            server.add_job(job)
+
+        chunk_analyses = []
+        while len(chunk_analyses) < len(chunks):
+            job = server.changed_jobs_queue.get()
+            job.update()
+            if not job.is_finished:
+                continue
+            if job.failed or job.result is None:
+                print('\tText analysis of a chunk failed, reverting to a single process')
+                print(job.details)
+                return None
+            chunk_analyses.append(job.result)
+    finally:
+        server.close()
+    return mergeChunkAnalyses(chunk_analyses)
+
+def _split_text_for_analysis(text, chunk_size):
+    '''
+    Split the text into chunks of around chunk_size characters, breaking at
+    paragraph boundaries. Each break is made at the start of a run of
+    whitespace following a word, so that every token is split exactly as it
+    would be for the whole text.
+    '''
+    chunks = []
+    start = 0
+    while len(text) - start > chunk_size:
+        cut = _find_analysis_break(text, start, start + chunk_size)
+        if cut is None:
+            break
+        chunks.append(text[start:cut])
+        start = cut
+    chunks.append(text[start:])
+    return chunks
+
+def _find_analysis_break(text, start, target):
+    newline = text.rfind('\n', start, target)
+    while newline > start:
+        cut = newline
+        while cut > start and text[cut-1].isspace():
+            cut -= 1
+        word_start = cut
+        while word_start > start and not text[word_start-1].isspace():
+            word_start -= 1
+        if cut > word_start and RE_WORD_CHAR.match(text[word_start]):
+            return cut
+        newline = text.rfind('\n', start, word_start)
+    return None
+
 def get_flesch_reading_ease(text_analysis):
-    score = 206.835 - (1.015 * (text_analysis['averageWordsPerSentence'])) - (84.6 * (text_analysis['syllableCount']/ text_analysis['wordCount']))
+    score = _flesch_reading_ease(text_analysis)
     print('\tFlesch Reading Ease:', score)
     return score
 
 def get_flesch_kincaid_grade_level(text_analysis):
-    score = 0.39 * (text_analysis['averageWordsPerSentence']) + 11.8 * (text_analysis['syllableCount']/ text_analysis['wordCount']) - 15.59
+    score = _flesch_kincaid_grade_level(text_analysis)
     print('\tFlesch Kincade Grade:', score)
     return score
 
 def get_gunning_fog_index(text_analysis):
-    score = 0.4 * ((text_analysis['averageWordsPerSentence']) + (100 * (text_analysis['complexwordCount']/text_analysis['wordCount'])))
+    score = _gunning_fog_index(text_analysis)
     print('\tGunning Fog:', score)
     return score
 
+def _flesch_reading_ease(text_analysis):
+    return 206.835 - (1.015 * (text_analysis['averageWordsPerSentence'])) - (84.6 * (text_analysis['syllableCount']/ text_analysis['wordCount']))
+
+def _flesch_kincaid_grade_level(text_analysis):
+    return 0.39 * (text_analysis['averageWordsPerSentence']) + 11.8 * (text_analysis['syllableCount']/ text_analysis['wordCount']) - 15.59
+
+def _gunning_fog_index(text_analysis):
+    return 0.4 * ((text_analysis['averageWordsPerSentence']) + (100 * (text_analysis['complexwordCount']/text_analysis['wordCount'])))
+
+def get_smog_index(text_analysis):
+    score = _smog_index(text_analysis)
+    print('\tSMOG Index:', score)
+    return score
+
+def get_coleman_liau_index(text_analysis):
+    score = _coleman_liau_index(text_analysis)
+    print('\tColeman-Liau Index:', score)
+    return score
+
+def get_automated_readability_index(text_analysis):
+    score = _automated_readability_index(text_analysis)
+    print('\tAutomated Readability Index:', score)
+    return score
+
+def get_dale_chall_score(text_analysis):
+    score = _dale_chall_score(text_analysis)
+    print('\tDale-Chall Score:', score)
+    return score
+
+def _smog_index(text_analysis):
+    return 1.0430 * math.sqrt(text_analysis['polysyllableCount'] * (30 / text_analysis['sentenceCount'])) + 3.1291
+
+def _coleman_liau_index(text_analysis):
+    letters_per_100_words = 100 * text_analysis['letterCount'] / text_analysis['wordCount']
+    sentences_per_100_words = 100 * text_analysis['sentenceCount'] / text_analysis['wordCount']
+    return 0.0588 * letters_per_100_words - 0.296 * sentences_per_100_words - 15.8
+
+def _automated_readability_index(text_analysis):
+    return 4.71 * (text_analysis['letterCount'] / text_analysis['wordCount']) + \
+           0.5 * (text_analysis['wordCount'] / text_analysis['sentenceCount']) - 21.43
+
+def _dale_chall_score(text_analysis):
+    difficult_percent = 100 * (1 - text_analysis['familiarWordCount'] / text_analysis['wordCount'])
+    score = 0.1579 * difficult_percent + 0.0496 * (text_analysis['wordCount'] / text_analysis['sentenceCount'])
+    if difficult_percent > 5:
+        score += 3.6365
+    return score
+
+READABILITY_FORMULAS = [
+    ('Flesch Reading Ease', _flesch_reading_ease),
+    ('Flesch-Kincaid Grade', _flesch_kincaid_grade_level),
+    ('Gunning Fog', _gunning_fog_index),
+    ('SMOG Index', _smog_index),
+    ('Coleman-Liau Index', _coleman_liau_index),
+    ('Automated Readability Index', _automated_readability_index),
+    ('Dale-Chall Score', _dale_chall_score)
+    ]
+
+# The counts summed over each sampled paragraph for the bootstrap estimates.
+# The complex word count must be last as it is computed separately.
+BOOTSTRAP_COUNTS = ['wordCount', 'sentenceCount', 'syllableCount', 'polysyllableCount',
+                    'letterCount', 'familiarWordCount', 'complexwordCount']
+
 
 # calibre-debug -e statistics.py
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# vim:fileencoding=UTF-8:ts=4:sw=4:sta:et:sts=4:ai
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2011, Grant Drake <grant.drake@gmail.com>'
+__docformat__ = 'restructuredtext en'
+
+import os
+from multiprocessing import cpu_count
+
+from calibre.constants import iswindows, islinux
+
+
+def get_process_memory_mb():
+    '''
+    The memory in use by this process in MB, or None if it cannot be read.
+    On OS X this is the peak rather than the current memory in use.
+    '''
+    try:
+        if islinux:
+            with open('/proc/self/statm', 'rb') as f:
+                pages = int(f.read().split()[1])
+            return pages * os.sysconf(str('SC_PAGE_SIZE')) / (1024 * 1024)
+        if iswindows:
+            return _get_windows_process_memory_mb()
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+    except:
+        return None
+
+
+def get_available_memory_mb():
+    '''
+    The memory in MB available to start new processes without swapping, or
+    None if it cannot be read
+    '''
+    try:
+        if islinux:
+            meminfo = {}
+            with open('/proc/meminfo', 'rb') as f:
+                for line in f:
+                    name, value = line.split(b':', 1)
+                    meminfo[name] = int(value.split()[0])
+            if b'MemAvailable' in meminfo:
+                kb = meminfo[b'MemAvailable']
+            else:
+                # Older kernels do not estimate this for us
+                kb = meminfo[b'MemFree'] + meminfo.get(b'Buffers', 0) + meminfo.get(b'Cached', 0)
+            return kb / 1024
+        if iswindows:
+            return _get_windows_available_memory_mb()
+    except:
+        pass
+    return None
+
+
+def get_idle_cpus():
+    '''
+    The number of processor cores not busy running other processes, going
+    by the load average where the platform has one
+    '''
+    cpus = cpu_count()
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return cpus
+    return max(0, cpus - int(round(load)))
+
+
+def _get_windows_available_memory_mb():
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [(str('dwLength'), ctypes.c_ulong),
+                    (str('dwMemoryLoad'), ctypes.c_ulong),
+                    (str('ullTotalPhys'), ctypes.c_ulonglong),
+                    (str('ullAvailPhys'), ctypes.c_ulonglong),
+                    (str('ullTotalPageFile'), ctypes.c_ulonglong),
+                    (str('ullAvailPageFile'), ctypes.c_ulonglong),
+                    (str('ullTotalVirtual'), ctypes.c_ulonglong),
+                    (str('ullAvailVirtual'), ctypes.c_ulonglong),
+                    (str('ullAvailExtendedVirtual'), ctypes.c_ulonglong)]
+
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(status)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None
+    return status.ullAvailPhys / (1024 * 1024)
+
+
+def _get_windows_process_memory_mb():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [(str('cb'), wintypes.DWORD),
+                    (str('PageFaultCount'), wintypes.DWORD),
+                    (str('PeakWorkingSetSize'), ctypes.c_size_t),
+                    (str('WorkingSetSize'), ctypes.c_size_t),
+                    (str('QuotaPeakPagedPoolUsage'), ctypes.c_size_t),
+                    (str('QuotaPagedPoolUsage'), ctypes.c_size_t),
+                    (str('QuotaPeakNonPagedPoolUsage'), ctypes.c_size_t),
+                    (str('QuotaNonPagedPoolUsage'), ctypes.c_size_t),
+                    (str('PagefileUsage'), ctypes.c_size_t),
+                    (str('PeakPagefileUsage'), ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize / (1024 * 1024)